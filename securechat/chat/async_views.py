@@ -0,0 +1,140 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from crypto.cache import load_user_key
+from users.authentication import CachedJWTAuthentication
+from users.keyring import get_unlocked_keys, session_id_from_request
+from . import inbox_cache
+from .conversations import conversation_key_for_send
+from .models import EncryptedMessage
+from .realtime import publish_messages
+from .serializers import EncryptedMessageSerializer
+from .views import inbox_queryset, parse_inbox_cursor, parse_inbox_mode, recipient_queryset, seal_message, decrypt_inbox
+
+User = get_user_model()
+
+# Le chiffrement tourne dans un thread (hors de la boucle d'événements) ;
+# la lib cryptography relâche le GIL pendant les opérations RSA/AES.
+# Réservé au calcul pur : les accès à la base (connexions liées au thread)
+# passent par ``sync_to_async`` par défaut (thread_sensitive=True).
+run_crypto = sync_to_async(thread_sensitive=False)
+
+
+async def authenticate(request):
+    """
+    Authentification JWT pour les vues async (DRF n'a pas de vues async).
+
+    Renseigne ``request.user`` et ``request.auth`` ; retourne False si le
+    token est absent ou invalide.
+    """
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return False
+    if result is None:
+        return False
+    request.user, request.auth = result
+    return True
+
+
+def unauthorized():
+    return JsonResponse(
+        {'detail': 'Authentication credentials were not provided.'},
+        status=status.HTTP_401_UNAUTHORIZED
+    )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSendEncryptedMessage(View):
+    """Équivalent async de ``SendEncryptedMessage`` pour le déploiement ASGI."""
+
+    async def post(self, request):
+        if not await authenticate(request):
+            return unauthorized()
+
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+
+        recipient_id = data.get('recipient')
+        message = data.get('message')
+
+        try:
+            recipient = await recipient_queryset().aget(id=recipient_id)
+            keys = await sync_to_async(get_unlocked_keys)(request.user.pk, session_id_from_request(request))
+            session, session_key = await sync_to_async(conversation_key_for_send)(request.user, recipient, keys)
+            recipient_key = None
+            if session is None:
+                recipient_key = await sync_to_async(load_user_key)(recipient)
+            fields = await run_crypto(seal_message)(recipient, message, session, session_key, recipient_key)
+
+            # Enregistre le message
+            msg = await EncryptedMessage.objects.acreate(sender=request.user, recipient=recipient, **fields)
+            await sync_to_async(publish_messages)([msg])
+            await sync_to_async(inbox_cache.append_messages)([msg])
+
+            return JsonResponse({'status': 'Message sent & encrypted ✅'}, status=status.HTTP_201_CREATED)
+
+        except User.DoesNotExist:
+            return JsonResponse({'error': 'Recipient not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncReadEncryptedMessages(View):
+    """Équivalent async de ``ReadEncryptedMessages`` (même pagination par curseur)."""
+
+    async def get(self, request):
+        if not await authenticate(request):
+            return unauthorized()
+        user = request.user
+
+        try:
+            after, limit = parse_inbox_cursor(request.GET)
+            mode = parse_inbox_mode(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        keys = None
+        if mode == 'decrypted':
+            keys = await sync_to_async(get_unlocked_keys)(user.pk, session_id_from_request(request))
+        if mode == 'decrypted' and keys is None:
+            return JsonResponse(
+                {'error': 'Private key locked, please log in again'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            anchor = None
+            if after is not None:
+                anchor = await EncryptedMessage.objects.filter(
+                    recipient=user, id=after
+                ).values_list('created_at', flat=True).afirst()
+
+            messages = [msg async for msg in inbox_queryset(user, after, anchor)[:limit + 1]]
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+
+            if mode == 'envelope':
+                # Enveloppes brutes : le client déchiffre
+                result = EncryptedMessageSerializer(messages, many=True).data
+            else:
+                result = await run_crypto(decrypt_inbox)(keys, messages)
+
+            # Curseur pour la page suivante : id du dernier message renvoyé
+            next_cursor = messages[-1].id if has_more else None
+
+            return JsonResponse({'results': result, 'next': next_cursor}, status=200)
+
+        except Exception as e:
+            return JsonResponse({'error': f'Erreur de déchiffrement : {str(e)}'}, status=500)
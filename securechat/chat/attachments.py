@@ -0,0 +1,178 @@
+import os
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+from crypto.cache import load_user_key
+from crypto.utils import (
+    CHUNK_NONCE_PREFIX_SIZE, GCM_TAG_SIZE,
+    seal_chunk, seal_stream, open_chunk, seal_envelope, open_envelope, wrap_aes_key, unwrap_aes_key,
+)
+from .blobstores import get_blob_store
+from .models import Attachment
+
+ATTACHMENT_CHUNK_SIZE = getattr(settings, 'ATTACHMENT_CHUNK_SIZE', 64 * 1024)
+ATTACHMENT_MAX_SIZE = getattr(settings, 'ATTACHMENT_MAX_SIZE', 1024 * 1024 * 1024)
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def _create_manifest(sender, recipient, storage_key, size, file_key, prefix, filename, content_type):
+    # Le blob est supprimé si le manifeste ne peut pas être créé
+    store = get_blob_store()
+    try:
+        key_id, public_key = load_user_key(recipient)
+        return Attachment.objects.create(
+            sender=sender,
+            recipient=recipient,
+            storage_key=storage_key,
+            size=size,
+            chunk_size=ATTACHMENT_CHUNK_SIZE,
+            nonce_prefix=prefix,
+            encrypted_key=wrap_aes_key(public_key, file_key),
+            recipient_key_id=key_id,
+            encrypted_filename=seal_envelope(file_key, (filename or '').encode()),
+            content_type=content_type or 'application/octet-stream',
+        )
+    except Exception:
+        store.delete(storage_key)
+        raise
+
+
+def store_attachment(sender, recipient, read, filename, content_type=None):
+    """
+    Chiffre le flux ``read(n)`` bloc par bloc vers le blob store, puis crée le
+    manifeste. La mémoire reste de l'ordre de deux blocs quelle que soit la taille.
+
+    :raises AttachmentTooLarge: au-delà de ``ATTACHMENT_MAX_SIZE`` (le blob est supprimé)
+    """
+    file_key = AESGCM.generate_key(bit_length=256)
+    prefix = os.urandom(CHUNK_NONCE_PREFIX_SIZE)
+    store = get_blob_store()
+    storage_key = store.new_key()
+    size = 0
+
+    def encrypted_chunks():
+        nonlocal size
+        for plaintext, chunk in seal_stream(file_key, prefix, read, ATTACHMENT_CHUNK_SIZE):
+            size += len(plaintext)
+            if size > ATTACHMENT_MAX_SIZE:
+                raise AttachmentTooLarge(f'Attachment too large (max {ATTACHMENT_MAX_SIZE} bytes)')
+            yield chunk
+
+    store.write(storage_key, encrypted_chunks())
+    return _create_manifest(sender, recipient, storage_key, size, file_key, prefix, filename, content_type)
+
+
+class AttachmentWriter:
+    """
+    Chiffrement poussé d'une pièce jointe (``write(données)`` au fil de l'eau,
+    cf. chat.uploads) : mêmes blocs que ``store_attachment``. Un bloc plein
+    n'est scellé qu'une fois la suite reçue, pour savoir s'il est le dernier.
+
+    La taille est vérifiée à chaque écriture : au-delà de
+    ``ATTACHMENT_MAX_SIZE`` le blob est abandonné avant d'avoir tout reçu.
+    """
+
+    def __init__(self):
+        self.file_key = AESGCM.generate_key(bit_length=256)
+        self.prefix = os.urandom(CHUNK_NONCE_PREFIX_SIZE)
+        self.storage_key = get_blob_store().new_key()
+        self.size = 0
+        self._blob = get_blob_store().open_writer(self.storage_key)
+        self._buffer = bytearray()
+        self._index = 0
+
+    def _seal(self, plaintext, final):
+        self._blob.write(seal_chunk(self.file_key, self.prefix, self._index, plaintext, final))
+        self._index += 1
+
+    def write(self, data):
+        """:raises AttachmentTooLarge: le blob est abandonné"""
+        self.size += len(data)
+        if self.size > ATTACHMENT_MAX_SIZE:
+            self.abort()
+            raise AttachmentTooLarge(f'Attachment too large (max {ATTACHMENT_MAX_SIZE} bytes)')
+        self._buffer += data
+        while len(self._buffer) > ATTACHMENT_CHUNK_SIZE:
+            self._seal(bytes(self._buffer[:ATTACHMENT_CHUNK_SIZE]), final=False)
+            del self._buffer[:ATTACHMENT_CHUNK_SIZE]
+
+    def close(self):
+        """Scelle le dernier bloc (vide pour un fichier vide) et rend le blob visible."""
+        self._seal(bytes(self._buffer), final=True)
+        self._buffer = bytearray()
+        self._blob.commit()
+
+    def abort(self):
+        self._blob.abort()
+
+    def discard(self):
+        """Supprime le blob déjà écrit (aucun manifeste ne sera créé)."""
+        get_blob_store().delete(self.storage_key)
+
+    def create_manifest(self, sender, recipient, filename, content_type=None):
+        return _create_manifest(
+            sender, recipient, self.storage_key, self.size, self.file_key, self.prefix, filename, content_type
+        )
+
+
+def open_attachment(keys, attachment):
+    """
+    :param keys: clés privées déverrouillées du destinataire (``UnlockedKeys``)
+    :return: (clé du fichier, nom de fichier en clair)
+    """
+    file_key = unwrap_aes_key(keys.for_key(attachment.recipient_key_id), attachment.encrypted_key)
+    filename = open_envelope(file_key, bytes(attachment.encrypted_filename)).decode()
+    return file_key, filename
+
+
+def parse_range(header, size):
+    """
+    En-tête ``Range`` (une seule plage : ``bytes=a-b``, ``bytes=a-``, ``bytes=-n``).
+
+    :return: (start, end) inclusifs, ou None sans en-tête (fichier entier)
+    :raises ValueError: plage invalide ou non satisfiable (réponse 416)
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        raise ValueError('Only single byte ranges are supported')
+
+    first, _, last = spec.strip().partition('-')
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffixe : les n derniers octets
+        length = int(last)
+        if length <= 0:
+            raise ValueError('Unsatisfiable range')
+        start, end = max(0, size - length), size - 1
+
+    if start >= size or start > end:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def iter_plaintext(attachment, file_key, start, end):
+    """
+    Déchiffre les octets ``start``..``end`` (inclus) en ne lisant que les blocs
+    qui les contiennent, un à la fois.
+    """
+    store = get_blob_store()
+    chunk_size = attachment.chunk_size
+    stride = chunk_size + GCM_TAG_SIZE
+    prefix = bytes(attachment.nonce_prefix)
+    first, last = start // chunk_size, end // chunk_size
+    last_index = attachment.chunk_count - 1
+
+    for index in range(first, last + 1):
+        ciphertext = store.read(attachment.storage_key, index * stride, stride)
+        plaintext = open_chunk(file_key, prefix, index, ciphertext, index == last_index)
+        low = start - index * chunk_size if index == first else 0
+        high = end - index * chunk_size + 1 if index == last else len(plaintext)
+        yield plaintext[low:high]
@@ -0,0 +1,98 @@
+import os
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseBlobStore:
+    """
+    Stockage des blocs chiffrés des pièces jointes (cf. chat.attachments).
+
+    Les blobs sont écrits une seule fois, séquentiellement, puis relus par
+    plages : ``read`` ne doit jamais charger le blob entier en mémoire.
+    """
+
+    def new_key(self):
+        return uuid.uuid4().hex
+
+    def open_writer(self, key):
+        """
+        Écriture poussée (cf. ``BlobWriter``) : ``write(bytes)`` au fil de
+        l'eau, puis ``commit()`` rend le blob visible ou ``abort()`` l'oublie.
+        """
+        raise NotImplementedError
+
+    def write(self, key, chunks):
+        """Écrit les blocs (itérable de bytes) ; le blob n'est visible qu'une fois complet."""
+        writer = self.open_writer(key)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def read(self, key, offset, length):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalBlobWriter:
+    """Blob écrit dans un fichier ``.part``, renommé à la fin."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path.with_suffix('.part')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        # Renommage atomique : jamais de blob à moitié écrit sous son nom final
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class LocalBlobStore(BaseBlobStore):
+    """Blobs sur le système de fichiers local, répartis en sous-dossiers par préfixe."""
+
+    def __init__(self, root=None):
+        self.root = Path(root or Path(settings.BASE_DIR) / 'attachments')
+
+    def _path(self, key):
+        return self.root / key[:2] / key
+
+    def open_writer(self, key):
+        return LocalBlobWriter(self._path(key))
+
+    def read(self, key, offset, length):
+        with open(self._path(key), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def delete(self, key):
+        self._path(key).unlink(missing_ok=True)
+
+
+_store = None
+
+
+def get_blob_store():
+    """Instance du backend configuré par ``ATTACHMENT_STORAGE`` (chemin + options)."""
+    global _store
+    if _store is None:
+        config = getattr(settings, 'ATTACHMENT_STORAGE', {})
+        backend = import_string(config.get('BACKEND', 'chat.blobstores.LocalBlobStore'))
+        _store = backend(**config.get('OPTIONS', {}))
+    return _store
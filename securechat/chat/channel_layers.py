@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseChannelLayer:
+    """
+    Diffusion des messages vers les WebSockets connectés.
+
+    ``group_send`` peut être appelé depuis du code sync (vues WSGI/DRF) ou
+    async ; ``subscribe``/``unsubscribe`` sont appelés depuis la boucle
+    d'événements qui sert la socket.
+    """
+
+    def subscribe(self, group):
+        """Retourne une ``asyncio.Queue`` qui reçoit les événements du groupe."""
+        raise NotImplementedError
+
+    def unsubscribe(self, group, queue):
+        raise NotImplementedError
+
+    def group_send(self, group, event):
+        raise NotImplementedError
+
+
+class InMemoryChannelLayer(BaseChannelLayer):
+    """
+    Backend mono-processus : suffisant pour un seul nœud et pour les tests.
+
+    Chaque abonné a une file bornée ; si un client lent ne la vide pas,
+    les nouveaux événements sont ignorés pour lui (il les retrouvera dans l'inbox).
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._groups = {}  # group -> {queue: loop}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def subscribe(self, group):
+        queue = asyncio.Queue(maxsize=self.capacity)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._groups.setdefault(group, {})[queue] = loop
+        return queue
+
+    def unsubscribe(self, group, queue):
+        with self._lock:
+            subscribers = self._groups.get(group)
+            if subscribers is not None:
+                subscribers.pop(queue, None)
+                if not subscribers:
+                    del self._groups[group]
+
+    def group_send(self, group, event):
+        with self._lock:
+            subscribers = list(self._groups.get(group, {}).items())
+
+        for queue, loop in subscribers:
+            # La file appartient à la boucle de la socket : on y passe par call_soon_threadsafe
+            loop.call_soon_threadsafe(self._put, queue, event)
+        return len(subscribers)
+
+    def _put(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+_layer = None
+
+
+def get_channel_layer():
+    """Instance du backend configuré par ``CHAT_CHANNEL_LAYER`` (chemin + options)."""
+    global _layer
+    if _layer is None:
+        config = getattr(settings, 'CHAT_CHANNEL_LAYER', {})
+        backend = import_string(config.get('BACKEND', 'chat.channel_layers.InMemoryChannelLayer'))
+        _layer = backend(**config.get('OPTIONS', {}))
+    return _layer
+
+
+def user_group(user_id):
+    return f'user.{user_id}'
@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from crypto.cache import LRUCache, load_user_key
+from crypto.utils import wrap_aes_key, unwrap_aes_key
+from users.models import UserKey
+from .models import ConversationSession
+
+CONVERSATION_SESSIONS_ENABLED = getattr(settings, 'CONVERSATION_SESSIONS_ENABLED', True)
+CONVERSATION_SESSION_MAX_MESSAGES = getattr(settings, 'CONVERSATION_SESSION_MAX_MESSAGES', 100)
+CONVERSATION_SESSION_MAX_AGE = getattr(settings, 'CONVERSATION_SESSION_MAX_AGE', 3600)
+
+# Clés de session en clair côté serveur (le chiffrement se fait côté serveur) ;
+# elles n'ont pas besoin de survivre à la rotation.
+session_key_cache = LRUCache(
+    name='conversation_session_keys',
+    maxsize=getattr(settings, 'CONVERSATION_SESSION_CACHE_SIZE', 10000),
+    ttl=CONVERSATION_SESSION_MAX_AGE,
+)
+
+
+def _ordered_pair(user1, user2):
+    return (user1, user2) if user1.pk <= user2.pk else (user2, user1)
+
+
+def _open_session(user_a, user_b):
+    session_key = AESGCM.generate_key(bit_length=256)
+    key_id_a, public_key_a = load_user_key(user_a)
+    key_id_b, public_key_b = load_user_key(user_b)
+    session = ConversationSession.objects.create(
+        user_a=user_a,
+        user_b=user_b,
+        wrapped_key_a=wrap_aes_key(public_key_a, session_key),
+        wrapped_key_b=wrap_aes_key(public_key_b, session_key),
+        key_id_a=key_id_a,
+        key_id_b=key_id_b,
+        message_count=1,
+    )
+    session_key_cache.set(session.pk, session_key)
+    return session, session_key
+
+
+def conversation_key_for_send(sender, recipient, sender_keys=None):
+    """
+    Clé symétrique à utiliser pour le prochain message ``sender`` -> ``recipient``.
+
+    Réutilise la session courante de la paire tant qu'elle n'a atteint ni
+    ``CONVERSATION_SESSION_MAX_MESSAGES`` ni ``CONVERSATION_SESSION_MAX_AGE`` ;
+    sinon en ouvre une nouvelle (deux enveloppes asymétriques, une par participant).
+    Si la clé n'est plus en cache, elle est récupérée avec les clés privées
+    déverrouillées de l'expéditeur (``UnlockedKeys``), ou la session est renouvelée.
+
+    :return: (session, session_key), ou (None, None) si les sessions sont désactivées
+    """
+    if not CONVERSATION_SESSIONS_ENABLED:
+        return None, None
+
+    user_a, user_b = _ordered_pair(sender, recipient)
+    cutoff = timezone.now() - timedelta(seconds=CONVERSATION_SESSION_MAX_AGE)
+    session = ConversationSession.objects.filter(
+        user_a=user_a, user_b=user_b,
+        created_at__gte=cutoff,
+        message_count__lt=CONVERSATION_SESSION_MAX_MESSAGES,
+    ).order_by('-created_at', '-id').first()
+
+    if session is not None:
+        session_key = session_key_cache.get(session.pk)
+        if session_key is None and sender_keys is not None:
+            try:
+                session_key = unwrap_aes_key(
+                    sender_keys.for_key(session.key_id_for(sender.pk)), session.wrapped_key_for(sender.pk)
+                )
+                session_key_cache.set(session.pk, session_key)
+            except Exception:
+                session_key = None
+
+        if session_key is not None:
+            # Réserve une place dans la session ; échoue si un envoi concurrent l'a remplie
+            claimed = ConversationSession.objects.filter(
+                pk=session.pk, message_count__lt=CONVERSATION_SESSION_MAX_MESSAGES
+            ).update(message_count=F('message_count') + 1)
+            if claimed:
+                return session, session_key
+
+    return _open_session(user_a, user_b)
+
+
+@receiver(post_save, sender=UserKey, dispatch_uid='chat.close_sessions_on_key_rotation')
+def _close_sessions_on_key_rotation(sender, instance, created, **kwargs):
+    # Les sessions ouvertes sont enveloppées pour l'ancienne clé : on les
+    # épuise pour que le prochain envoi en ouvre une sous la nouvelle.
+    if created and instance.is_active:
+        ConversationSession.objects.filter(
+            Q(user_a_id=instance.user_id) | Q(user_b_id=instance.user_id),
+            message_count__lt=CONVERSATION_SESSION_MAX_MESSAGES,
+        ).update(message_count=CONVERSATION_SESSION_MAX_MESSAGES)
@@ -0,0 +1,211 @@
+"""
+Cache de l'inbox chaude : enveloppes chiffrées (jamais de clair) de chaque
+destinataire, en deux fenêtres d'au plus ``INBOX_CACHE_ROWS`` lignes et
+``INBOX_CACHE_WINDOW_BYTES`` octets chacune :
+
+- ``rows`` : les messages les plus récents, tous ceux d'id > ``floor`` ;
+  la synchronisation incrémentale et les dernières pages y sont servies ;
+- ``head`` : les plus anciens, tous ceux d'id <= ``ceiling`` ; l'inbox se lit
+  du plus ancien au plus récent, la première page (sans curseur) y est servie.
+
+Quand tout l'historique tient dans ``rows``, ``floor`` vaut 0 et ``head`` est
+vide. Une page qui sort des deux fenêtres est lue en base.
+
+Backend : l'alias ``INBOX_CACHE_ALIAS`` de ``CACHES`` (local-memory par
+défaut, borné par ``MAX_ENTRIES`` avec éviction LRU entre utilisateurs ; la
+borne en octets des fenêtres borne la mémoire). Le local-memory est propre à
+chaque processus : en multi-processus, configurer un backend partagé (Redis,
+Memcached) pour que l'écriture à l'envoi soit vue de tous les workers.
+
+Les envois ajoutent leurs lignes à ``rows`` après le commit ; lecture de
+remplissage et ajout se font sous un verrou par destinataire, pour qu'un
+ajout ne soit jamais écrasé par un remplissage lu avant le commit.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import EncryptedMessage
+
+INBOX_CACHE_ENABLED = getattr(settings, 'INBOX_CACHE_ENABLED', True)
+INBOX_CACHE_ALIAS = getattr(settings, 'INBOX_CACHE_ALIAS', 'inbox')
+INBOX_CACHE_ROWS = getattr(settings, 'INBOX_CACHE_ROWS', 100)
+INBOX_CACHE_WINDOW_BYTES = getattr(settings, 'INBOX_CACHE_WINDOW_BYTES', 64 * 1024)
+INBOX_CACHE_LOCK_TIMEOUT = getattr(settings, 'INBOX_CACHE_LOCK_TIMEOUT', 1)
+
+User = get_user_model()
+
+
+def get_cache():
+    alias = INBOX_CACHE_ALIAS if INBOX_CACHE_ALIAS in settings.CACHES else 'default'
+    return caches[alias]
+
+
+def _key(recipient_id):
+    return f'chat:inbox:v3:{recipient_id}'
+
+
+def _acquire(cache, recipient_id):
+    # Verrou par destinataire (cache.add est atomique) ; expire seul si son détenteur meurt
+    lock_key = _key(recipient_id) + ':lock'
+    deadline = time.monotonic() + INBOX_CACHE_LOCK_TIMEOUT
+    while not cache.add(lock_key, 1, timeout=INBOX_CACHE_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.005)
+    return lock_key
+
+
+def _pack(msg):
+    return (
+        msg.id, msg.sender_id, msg.sender.username, msg.recipient_id,
+        bytes(msg.message_bytes), bytes(msg.aes_key_bytes), bytes(msg.iv_bytes),
+        msg.session_id, msg.recipient_key_id, msg.created_at,
+    )
+
+
+def _unpack(row):
+    msg_id, sender_id, sender_username, recipient_id, message, aes_key, iv, session_id, key_id, created_at = row
+    msg = EncryptedMessage(
+        id=msg_id, sender_id=sender_id, recipient_id=recipient_id,
+        encrypted_message_bin=message, encrypted_aes_key_bin=aes_key, iv_bin=iv,
+        session_id=session_id, recipient_key_id=key_id, created_at=created_at,
+    )
+    # Expéditeur minimal (seul le nom est lu) : aucune requête au rendu
+    msg.sender = User(id=sender_id, username=sender_username)
+    return msg
+
+
+def _row_size(row):
+    # Enveloppes, clé enveloppée et nom de l'expéditeur ; le reste est négligeable
+    return len(row[2]) + len(row[4]) + len(row[5]) + len(row[6]) + 64
+
+
+def _within_budget(rows):
+    """Plus long préfixe de ``rows`` qui tient dans la fenêtre (lignes et octets)."""
+    total = 0
+    for count, row in enumerate(rows[:INBOX_CACHE_ROWS]):
+        total += _row_size(row)
+        if total > INBOX_CACHE_WINDOW_BYTES:
+            return rows[:count]
+    return rows[:INBOX_CACHE_ROWS]
+
+
+def _load(recipient_id):
+    queryset = EncryptedMessage.objects.filter(recipient_id=recipient_id).select_related('sender', 'session')
+
+    newest = [_pack(msg) for msg in queryset.order_by('-id')[:INBOX_CACHE_ROWS + 1]]
+    rows = _within_budget(newest)
+    if len(rows) == len(newest):
+        # Tout l'historique tient dans la fenêtre récente
+        return {'floor': 0, 'rows': rows[::-1], 'ceiling': 0, 'head': []}
+
+    # floor : plus grand id absent de la fenêtre récente
+    floor = newest[len(rows)][0]
+    head = _within_budget([_pack(msg) for msg in queryset.filter(id__lte=floor).order_by('id')[:INBOX_CACHE_ROWS]])
+    return {
+        'floor': floor,
+        'rows': rows[::-1],
+        'ceiling': head[-1][0] if head else 0,
+        'head': head,
+    }
+
+
+def get_page(user, after=None, limit=50):
+    """
+    Page de l'inbox (ordre des ids) depuis le cache, remplie au besoin.
+
+    :return: (messages, has_more), ou None si la page sort des fenêtres
+        cachées (lue en base)
+    """
+    if not INBOX_CACHE_ENABLED:
+        return None
+
+    cache = get_cache()
+    entry = cache.get(_key(user.pk))
+    if entry is None:
+        lock_key = _acquire(cache, user.pk)
+        if lock_key is None:
+            return None
+        try:
+            entry = _load(user.pk)
+            cache.set(_key(user.pk), entry)
+        finally:
+            cache.delete(lock_key)
+
+    after = after or 0
+    if after >= entry['floor']:
+        rows = [row for row in entry['rows'] if row[0] > after][:limit + 1]
+    elif after < entry['ceiling']:
+        # Fenêtres contiguës (ceiling == floor) : tout l'historique est en cache
+        complete = entry['ceiling'] == entry['floor']
+        window = entry['head'] + entry['rows'] if complete else entry['head']
+        rows = [row for row in window if row[0] > after][:limit + 1]
+        if len(rows) <= limit and not complete:
+            # La page déborde de la fenêtre ancienne : la suite n'est pas cachée
+            return None
+    else:
+        return None
+
+    return [_unpack(row) for row in rows[:limit]], len(rows) > limit
+
+
+def append_messages(messages):
+    """
+    Ajoute des messages envoyés aux entrées cachées de leurs destinataires,
+    après le commit. Les destinataires sans entrée sont ignorés (remplis à la
+    prochaine lecture).
+    """
+    if not INBOX_CACHE_ENABLED:
+        return
+
+    by_recipient = {}
+    stale = set()
+    for msg in messages:
+        if msg.pk is None:
+            # bulk_create sans RETURNING (MySQL) : ids inconnus, on invalide
+            stale.add(msg.recipient_id)
+        else:
+            by_recipient.setdefault(msg.recipient_id, []).append(_pack(msg))
+
+    def write():
+        cache = get_cache()
+        if stale:
+            invalidate(stale)
+        for recipient_id, rows in by_recipient.items():
+            lock_key = _acquire(cache, recipient_id)
+            if lock_key is None:
+                # Verrou expiré sans être libéré : on préfère relire la base
+                cache.delete(_key(recipient_id))
+                continue
+            try:
+                entry = cache.get(_key(recipient_id))
+                if entry is None:
+                    continue
+                known = {row[0] for row in entry['rows']}
+                merged = sorted(entry['rows'] + [row for row in rows if row[0] not in known])
+                kept = _within_budget(merged[::-1])[::-1]
+                if len(kept) < len(merged):
+                    evicted = merged[:len(merged) - len(kept)]
+                    if entry['floor'] == 0 or entry['ceiling'] == entry['floor']:
+                        # Fenêtre ancienne contiguë à la récente : elle reçoit les
+                        # lignes sorties tant qu'elle a de la place
+                        entry['head'] = _within_budget(entry['head'] + evicted)
+                        entry['ceiling'] = entry['head'][-1][0] if entry['head'] else 0
+                    # Les plus anciens sortent : floor remonte jusqu'au dernier retiré
+                    entry['floor'] = evicted[-1][0]
+                entry['rows'] = kept
+                cache.set(_key(recipient_id), entry)
+            finally:
+                cache.delete(lock_key)
+
+    transaction.on_commit(write)
+
+
+def invalidate(recipient_ids):
+    """Oublie les entrées (messages archivés ou supprimés hors envoi)."""
+    if INBOX_CACHE_ENABLED:
+        get_cache().delete_many([_key(recipient_id) for recipient_id in recipient_ids])
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import retention
+
+
+class Command(BaseCommand):
+    help = (
+        'Applique les politiques de rétention : archive ou supprime les messages '
+        'expirés par lots courts (relançable à tout moment, reprend où il s\'est arrêté).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=retention.RETENTION_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None, help='Arrête après N lots (toutes politiques confondues).')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Pause entre deux lots (secondes), pour la réplication.')
+        parser.add_argument('--dry-run', action='store_true', help='Compte les messages concernés sans rien modifier.')
+
+    def handle(self, *args, **options):
+        batches = 0
+        total = 0
+
+        for label, queryset, action in retention.expired_querysets():
+            if options['dry_run']:
+                self.stdout.write(f'{label}: {queryset.count()} message(s) to {action}')
+                continue
+
+            done = 0
+            while options['max_batches'] is None or batches < options['max_batches']:
+                count = retention.process_batch(queryset, action, options['batch_size'])
+                if not count:
+                    break
+                done += count
+                batches += 1
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+
+            total += done
+            self.stdout.write(f'{label}: {done} message(s) {action}d')
+
+        if not options['dry_run']:
+            self.stdout.write(f'{total} message(s) processed in {batches} batch(es)')
@@ -0,0 +1,57 @@
+import base64
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from chat.models import EncryptedMessage
+
+# Lignes dont au moins une colonne binaire est vide : lisibles uniquement via l'ancien base64
+MISSING_BINARY = Q(encrypted_message_bin__isnull=True) | Q(encrypted_aes_key_bin__isnull=True) | Q(iv_bin__isnull=True)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recopie en binaire les messages qui n\'ont que l\'ancien texte base64 '
+        '(écrits par un nœud antérieur pendant un déploiement progressif). '
+        'Avec --check, échoue s\'il en reste : préalable à la suppression des colonnes base64.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--check', action='store_true', help='Compte les lignes restantes sans rien modifier.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            remaining = EncryptedMessage.objects.filter(MISSING_BINARY).count()
+            if remaining:
+                raise CommandError(f'{remaining} message(s) still have no binary columns')
+            self.stdout.write('Binary backfill complete')
+            return
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(
+                EncryptedMessage.objects.filter(MISSING_BINARY, id__gt=last_id)
+                .order_by('id')[:options['batch_size']]
+            )
+            if not batch:
+                break
+
+            for msg in batch:
+                if msg.encrypted_message_bin is None:
+                    msg.encrypted_message_bin = base64.b64decode(msg.encrypted_message)
+                if msg.encrypted_aes_key_bin is None:
+                    msg.encrypted_aes_key_bin = base64.b64decode(msg.encrypted_aes_key)
+                if msg.iv_bin is None:
+                    msg.iv_bin = base64.b64decode(msg.iv)
+
+            with transaction.atomic():
+                EncryptedMessage.objects.bulk_update(batch, [
+                    'encrypted_message_bin', 'encrypted_aes_key_bin', 'iv_bin',
+                ])
+            total += len(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(f'{total} message(s) backfilled')
@@ -0,0 +1,253 @@
+import json
+import random
+import statistics
+import time
+import uuid
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from chat import inbox_cache
+from chat.conversations import conversation_key_for_send
+from chat.models import EncryptedMessage
+from chat.views import seal_message
+from users.keys import build_user_key
+from users.models import CustomUser, UserKey
+from users.utils import generate_rsa_key_pair, encrypt_private_key
+
+LOADTEST_PASSWORD = 'loadtest-Pass-1234'
+DEFAULT_MIX = 'register=1,login=4,send=20,inbox=75'
+
+
+def parse_mix(value):
+    """``register=1,login=4,send=20,inbox=75`` -> {'register': 1.0, ...}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('register', 'login', 'send', 'inbox'):
+            raise CommandError(f'Unknown operation in --mix: {name!r}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def zipf_weights(n, exponent):
+    # Quelques utilisateurs très actifs, une longue traîne de peu actifs
+    return [1 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def percentile(quantiles, p):
+    return quantiles[p - 1] if quantiles else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Test de charge de bout en bout : crée N utilisateurs (vraies paires de clés) '
+        'et M messages, puis rejoue un mélange register/login/send/inbox via le client '
+        'de test DRF. Rapport p50/p95/p99, débit et requêtes SQL par endpoint. '
+        'En local : --settings=securechat.settings_sqlite'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exposant de la loi de Zipf (activité des utilisateurs)')
+        parser.add_argument('--message-size', type=int, default=200)
+        parser.add_argument('--key-cache', help='Fichier JSON de paires de clés réutilisées d\'un run à l\'autre')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true', help='Garder les données créées (supprimées par défaut)')
+        parser.add_argument('--json', action='store_true', help='Rapport JSON au lieu du tableau')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.prefix = f'load-{uuid.uuid4().hex[:8]}-'
+        # Pas de transaction englobante : les envois doivent être commités pour
+        # que leurs hooks on_commit (cache de l'inbox) s'exécutent comme en
+        # production. Les données sont supprimées à la fin sauf --keep.
+        try:
+            with transaction.atomic():
+                users = self.seed_users(options['users'], options['key_cache'])
+                self.weights = zipf_weights(len(users), options['zipf'])
+                self.seed_messages(users, options['messages'], options['message_size'])
+            report = self.replay(users, options)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    # Préparation
+
+    def load_key_material(self, count, cache_path):
+        """
+        Paires (publique PEM, privée chiffrée sous LOADTEST_PASSWORD).
+
+        La génération RSA et PBKDF2 dominent le temps de préparation : avec
+        ``--key-cache`` les paires sont gardées sur disque et réutilisées.
+        """
+        cached = []
+        path = Path(cache_path) if cache_path else None
+        if path and path.exists():
+            cached = json.loads(path.read_text())
+
+        while len(cached) < count:
+            private_pem, public_pem = generate_rsa_key_pair()
+            cached.append({
+                'public_key': public_pem.decode(),
+                'private_key_encrypted': encrypt_private_key(private_pem, LOADTEST_PASSWORD),
+            })
+
+        if path:
+            path.write_text(json.dumps(cached))
+        return cached[:count]
+
+    def seed_users(self, count, cache_path):
+        started = time.perf_counter()
+        material = self.load_key_material(count, cache_path)
+        # Même mot de passe pour tous : un seul hachage Django
+        password_hash = make_password(LOADTEST_PASSWORD)
+
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'{self.prefix}{i}', password=password_hash)
+            for i in range(len(material))
+        ])
+        users = list(CustomUser.objects.filter(username__startswith=self.prefix).order_by('id'))
+        keys = UserKey.objects.bulk_create([
+            build_user_key(user, CustomUser.KEY_TYPE_RSA, pair['public_key'], pair['private_key_encrypted'])
+            for user, pair in zip(users, material)
+        ])
+        for user, key in zip(users, keys):
+            user.active_key = key
+        self.stderr.write(f'{len(users)} users seeded in {time.perf_counter() - started:.1f}s')
+        return users
+
+    def pick_user(self, users, exclude=None):
+        while True:
+            user = self.rng.choices(users, weights=self.weights)[0]
+            if user != exclude or len(users) == 1:
+                return user
+
+    def seed_messages(self, users, count, size):
+        started = time.perf_counter()
+        rows = []
+        for _ in range(count):
+            sender = self.pick_user(users)
+            recipient = self.pick_user(users, exclude=sender)
+            session, session_key = conversation_key_for_send(sender, recipient)
+            rows.append(EncryptedMessage(
+                sender=sender, recipient=recipient,
+                **seal_message(recipient, 'x' * size, session, session_key)
+            ))
+        EncryptedMessage.objects.bulk_create(rows, batch_size=1000)
+        self.stderr.write(f'{count} messages seeded in {time.perf_counter() - started:.1f}s')
+
+    def cleanup(self):
+        """Supprime les utilisateurs du run (messages, clés et sessions en cascade)."""
+        user_ids = list(CustomUser.objects.filter(username__startswith=self.prefix).values_list('id', flat=True))
+        CustomUser.objects.filter(id__in=user_ids).delete()
+        inbox_cache.invalidate(user_ids)
+
+    # Rejeu
+
+    def login(self, client, user):
+        response = client.post(
+            '/api/users/login/', {'username': user.username, 'password': LOADTEST_PASSWORD}, format='json'
+        )
+        return response, response.json().get('access') if response.status_code == 200 else None
+
+    def replay(self, users, options):
+        client = APIClient()
+        tokens = {}
+        # first/last : début de la première et fin de la dernière requête de l'endpoint
+        stats = {op: {'latencies': [], 'queries': [], 'errors': 0, 'first': None, 'last': None} for op in options['mix']}
+        operations = list(options['mix'])
+        weights = [options['mix'][op] for op in operations]
+        message = 'x' * options['message_size']
+
+        started = time.perf_counter()
+        for _ in range(options['requests']):
+            op = self.rng.choices(operations, weights=weights)[0]
+            user = self.pick_user(users)
+
+            # Un utilisateur doit être connecté pour envoyer ou lire (hors mesure)
+            if op in ('send', 'inbox') and user.pk not in tokens:
+                _, tokens[user.pk] = self.login(client, user)
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens.get(user.pk)}')
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                if op == 'register':
+                    client.credentials()
+                    response = client.post('/api/users/register/', {
+                        'username': f'{self.prefix}reg-{uuid.uuid4().hex[:12]}', 'password': LOADTEST_PASSWORD,
+                    }, format='json')
+                elif op == 'login':
+                    client.credentials()
+                    response, tokens[user.pk] = self.login(client, user)
+                elif op == 'send':
+                    recipient = self.pick_user(users, exclude=user)
+                    response = client.post('/api/messages/send/', {'recipient': recipient.pk, 'message': message}, format='json')
+                else:
+                    response = client.get('/api/messages/inbox/')
+                end = time.perf_counter()
+                elapsed = (end - start) * 1000
+
+            if stats[op]['first'] is None:
+                stats[op]['first'] = start
+            stats[op]['last'] = end
+            stats[op]['latencies'].append(elapsed)
+            stats[op]['queries'].append(len(queries))
+            stats[op]['errors'] += response.status_code >= 400
+        total = time.perf_counter() - started
+
+        endpoints = {}
+        for op, data in stats.items():
+            latencies = data['latencies']
+            if not latencies:
+                continue
+            quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            # Débit réel : requêtes rapportées au temps écoulé (horloge murale)
+            # entre la première et la dernière requête de l'endpoint, pas à la
+            # somme de leurs latences (qui ne donnerait que 1 / latence moyenne)
+            window = data['last'] - data['first']
+            endpoints[op] = {
+                'requests': len(latencies),
+                'errors': data['errors'],
+                'p50_ms': percentile(quantiles, 50),
+                'p95_ms': percentile(quantiles, 95),
+                'p99_ms': percentile(quantiles, 99),
+                'throughput_rps': len(latencies) / window if window else 0.0,
+                'queries_avg': statistics.fmean(data['queries']),
+                'queries_max': max(data['queries']),
+            }
+
+        return {
+            'database': connection.vendor,
+            'users': len(users),
+            'messages': options['messages'],
+            'requests': options['requests'],
+            'elapsed_s': total,
+            'throughput_rps': options['requests'] / total if total else 0.0,
+            'endpoints': endpoints,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['requests']} requests in {report['elapsed_s']:.1f}s "
+            f"({report['throughput_rps']:.1f} req/s, {report['database']})"
+        )
+        self.stdout.write(f"{'endpoint':<10}{'n':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'sql':>7}")
+        for op, data in report['endpoints'].items():
+            self.stdout.write(
+                f"{op:<10}{data['requests']:>6}{data['errors']:>5}"
+                f"{data['p50_ms']:>9.1f}{data['p95_ms']:>9.1f}{data['p99_ms']:>9.1f}"
+                f"{data['throughput_rps']:>9.1f}{data['queries_avg']:>7.1f}"
+            )
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+async def http_request(host, port, method, path, headers=None, body=None, slow=0.0):
+    """
+    Requête HTTP/1.0 minimale (une connexion par requête, pas de chunked).
+
+    ``slow`` simule un client lent : pause avant de lire la réponse.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps(body).encode() if body is not None else b''
+    lines = [f'{method} {path} HTTP/1.0', f'Host: {host}']
+    for name, value in (headers or {}).items():
+        lines.append(f'{name}: {value}')
+    if body is not None:
+        lines += ['Content-Type: application/json', f'Content-Length: {len(payload)}']
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+    await writer.drain()
+
+    if slow:
+        await asyncio.sleep(slow)
+
+    raw = await reader.read()
+    writer.close()
+    head, _, content = raw.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, content
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare le débit des vues sync (api/messages/...) et async '
+        '(api/messages/async/...) contre un serveur ASGI lancé à part.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--endpoint', choices=['inbox', 'send'], default='inbox')
+        parser.add_argument('--recipient', type=int, help='Destinataire pour --endpoint send')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--slow', type=float, default=0.0, help='Pause (s) simulant un client lent')
+
+    def handle(self, *args, **options):
+        if options['endpoint'] == 'send' and options['recipient'] is None:
+            raise CommandError('--recipient is required with --endpoint send')
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        url = urlsplit(options['url'])
+        host, port = url.hostname, url.port or 80
+
+        status, content = await http_request(
+            host, port, 'POST', '/api/users/login/',
+            body={'username': options['username'], 'password': options['password']}
+        )
+        if status != 200:
+            raise CommandError(f'Login failed ({status}): {content[:200]!r}')
+        headers = {'Authorization': 'Bearer ' + json.loads(content)['access']}
+
+        for label, prefix in (('sync', '/api/messages/'), ('async', '/api/messages/async/')):
+            report = await self.bench(host, port, prefix, headers, options)
+            self.stdout.write(
+                f"{label:>5} {options['endpoint']}: {report['ok']}/{options['requests']} ok, "
+                f"{report['throughput']:.1f} req/s, p50 {report['p50']:.1f} ms, p95 {report['p95']:.1f} ms"
+            )
+
+    async def bench(self, host, port, prefix, headers, options):
+        if options['endpoint'] == 'send':
+            method, path = 'POST', prefix + 'send/'
+            body = {'recipient': options['recipient'], 'message': 'load test'}
+        else:
+            method, path, body = 'GET', prefix + 'inbox/', None
+
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies = []
+        ok = 0
+
+        async def one():
+            nonlocal ok
+            async with semaphore:
+                start = time.perf_counter()
+                status, _ = await http_request(host, port, method, path, headers, body, options['slow'])
+                latencies.append((time.perf_counter() - start) * 1000)
+                ok += status < 400
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            'ok': ok,
+            'throughput': len(latencies) / elapsed,
+            'p50': quantiles[49],
+            'p95': quantiles[94],
+        }
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_encryptedmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedmessage',
+            name='encrypted_aes_key_bin',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedmessage',
+            name='encrypted_message_bin',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedmessage',
+            name='iv_bin',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='encryptedmessage',
+            name='encrypted_aes_key',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='encryptedmessage',
+            name='encrypted_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='encryptedmessage',
+            name='iv',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
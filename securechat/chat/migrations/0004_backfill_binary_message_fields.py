@@ -0,0 +1,82 @@
+import base64
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_binary(apps, schema_editor):
+    """
+    Copie les colonnes base64 vers les colonnes binaires, par lots de
+    ``BATCH_SIZE`` lignes (un commit par lot, pas de verrou long).
+
+    L'ancien texte est gardé : les nœuds qui tournent encore l'ancien code
+    le lisent pendant un déploiement progressif. Il n'est vidé qu'ensuite
+    (cf. 0011_clear_legacy_message_text).
+    """
+    EncryptedMessage = apps.get_model('chat', 'EncryptedMessage')
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+
+    while True:
+        batch = list(
+            EncryptedMessage.objects.using(db_alias)
+            .filter(id__gt=last_id, encrypted_message_bin__isnull=True)
+            .order_by('id')
+            .only('id', 'encrypted_message', 'encrypted_aes_key', 'iv')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        for msg in batch:
+            msg.encrypted_message_bin = base64.b64decode(msg.encrypted_message)
+            msg.encrypted_aes_key_bin = base64.b64decode(msg.encrypted_aes_key)
+            msg.iv_bin = base64.b64decode(msg.iv)
+
+        with transaction.atomic(using=db_alias):
+            EncryptedMessage.objects.using(db_alias).bulk_update(batch, [
+                'encrypted_message_bin', 'encrypted_aes_key_bin', 'iv_bin',
+            ])
+        last_id = batch[-1].id
+
+
+def restore_base64(apps, schema_editor):
+    EncryptedMessage = apps.get_model('chat', 'EncryptedMessage')
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+
+    while True:
+        batch = list(
+            EncryptedMessage.objects.using(db_alias)
+            .filter(id__gt=last_id, encrypted_message_bin__isnull=False)
+            .order_by('id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        for msg in batch:
+            msg.encrypted_message = base64.b64encode(msg.encrypted_message_bin).decode()
+            msg.encrypted_aes_key = base64.b64encode(msg.encrypted_aes_key_bin).decode()
+            msg.iv = base64.b64encode(msg.iv_bin).decode()
+            msg.encrypted_message_bin = msg.encrypted_aes_key_bin = msg.iv_bin = None
+
+        with transaction.atomic(using=db_alias):
+            EncryptedMessage.objects.using(db_alias).bulk_update(batch, [
+                'encrypted_message_bin', 'encrypted_aes_key_bin', 'iv_bin',
+                'encrypted_message', 'encrypted_aes_key', 'iv',
+            ])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    # Un commit par lot plutôt qu'une transaction sur toute la table
+    atomic = False
+
+    dependencies = [
+        ('chat', '0003_binary_message_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_binary, restore_base64),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_conversationsession'),
+        ('users', '0003_customuser_key_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inbox_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('delivered_up_to', models.BigIntegerField(default=0)),
+                ('read_up_to', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='encryptedmessage',
+            index=models.Index(fields=['recipient', 'id'], name='chat_inbox_sync_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_attachment'),
+        ('users', '0003_customuser_key_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='retention_policy', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('retention_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('action', models.CharField(choices=[('archive', 'Archive'), ('delete', 'Delete')], default='archive', max_length=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('encrypted_message_bin', models.BinaryField()),
+                ('encrypted_aes_key_bin', models.BinaryField()),
+                ('iv_bin', models.BinaryField(default=b'')),
+                ('session_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to=settings.AUTH_USER_MODEL)),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', 'created_at', 'id'], name='chat_archive_cursor_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='recipient_key_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='recipient_key_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='conversationsession',
+            name='key_id_a',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='conversationsession',
+            name='key_id_b',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='encryptedmessage',
+            name='recipient_key_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations, transaction
+from django.db.models import Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+# (modèle, colonne utilisateur, colonne key_id)
+TARGETS = [
+    ('EncryptedMessage', 'recipient', 'recipient_key_id'),
+    ('ArchivedMessage', 'recipient', 'recipient_key_id'),
+    ('Attachment', 'recipient', 'recipient_key_id'),
+    ('ConversationSession', 'user_a', 'key_id_a'),
+    ('ConversationSession', 'user_b', 'key_id_b'),
+]
+
+
+def backfill_key_ids(apps, schema_editor):
+    """
+    Renseigne la clé sous laquelle les lignes existantes sont enveloppées :
+    avant la rotation, c'est la clé active de l'utilisateur. Par tranches de
+    ``BATCH_SIZE`` ids (un commit par tranche, pas de verrou long).
+    """
+    UserKey = apps.get_model('users', 'UserKey')
+    db_alias = schema_editor.connection.alias
+
+    for model_name, user_field, key_field in TARGETS:
+        model = apps.get_model('chat', model_name)
+        active_key_id = Coalesce(
+            Subquery(
+                UserKey.objects.using(db_alias)
+                .filter(user=OuterRef(user_field), is_active=True).values('key_id')[:1]
+            ),
+            Value(''),
+        )
+        max_id = model.objects.using(db_alias).aggregate(max_id=Max('id'))['max_id'] or 0
+        last_id = 0
+        while last_id < max_id:
+            with transaction.atomic(using=db_alias):
+                model.objects.using(db_alias).filter(
+                    id__gt=last_id, id__lte=last_id + BATCH_SIZE, **{key_field: ''}
+                ).update(**{key_field: active_key_id})
+            last_id += BATCH_SIZE
+
+
+class Migration(migrations.Migration):
+
+    # Un commit par tranche plutôt qu'une transaction sur toute la table
+    atomic = False
+
+    dependencies = [
+        ('chat', '0009_recipient_key_id'),
+        ('users', '0005_move_user_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_key_ids, migrations.RunPython.noop),
+    ]
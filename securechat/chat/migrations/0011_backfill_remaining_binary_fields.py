@@ -0,0 +1,64 @@
+import base64
+
+from django.db import migrations, transaction
+from django.db.models import Q
+
+BATCH_SIZE = 1000
+
+
+def backfill_remaining(apps, schema_editor):
+    """
+    Recopie en binaire les lignes restées sans colonne binaire : celles
+    écrites par un nœud antérieur à 0003 pendant le déploiement progressif,
+    après le passage de 0004. Par lots de ``BATCH_SIZE`` (un commit par lot).
+
+    Le texte base64 est gardé : le code de cette version le relit encore
+    (lecture double). Il ne sera supprimé qu'une fois
+    ``manage.py backfill_binary_messages --check`` à zéro.
+    """
+    EncryptedMessage = apps.get_model('chat', 'EncryptedMessage')
+    db_alias = schema_editor.connection.alias
+    missing = Q(encrypted_message_bin__isnull=True) | Q(encrypted_aes_key_bin__isnull=True) | Q(iv_bin__isnull=True)
+    last_id = 0
+
+    while True:
+        batch = list(
+            EncryptedMessage.objects.using(db_alias)
+            .filter(missing, id__gt=last_id)
+            .order_by('id')
+            .only(
+                'id', 'encrypted_message', 'encrypted_aes_key', 'iv',
+                'encrypted_message_bin', 'encrypted_aes_key_bin', 'iv_bin',
+            )[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        for msg in batch:
+            if msg.encrypted_message_bin is None:
+                msg.encrypted_message_bin = base64.b64decode(msg.encrypted_message)
+            if msg.encrypted_aes_key_bin is None:
+                msg.encrypted_aes_key_bin = base64.b64decode(msg.encrypted_aes_key)
+            if msg.iv_bin is None:
+                msg.iv_bin = base64.b64decode(msg.iv)
+
+        with transaction.atomic(using=db_alias):
+            EncryptedMessage.objects.using(db_alias).bulk_update(batch, [
+                'encrypted_message_bin', 'encrypted_aes_key_bin', 'iv_bin',
+            ])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    # Un commit par lot plutôt qu'une transaction sur toute la table
+    atomic = False
+
+    dependencies = [
+        ('chat', '0010_backfill_recipient_key_id'),
+    ]
+
+    operations = [
+        # Retour arrière sans effet : le texte base64 n'a pas été touché
+        migrations.RunPython(backfill_remaining, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,219 @@
+import base64
+
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from crypto.utils import envelope_version
+
 User = get_user_model()
 
+
+def _dual_read(binary, text):
+    # Période de transition : colonne binaire si remplie, sinon ancien base64
+    if binary is not None:
+        return binary
+    return base64.b64decode(text)
+
+
+class ConversationSession(models.Model):
+    """
+    Clé symétrique partagée par deux utilisateurs pendant une session de conversation.
+
+    La clé est enveloppée une fois pour chaque participant (``user_a`` a toujours
+    le plus petit id) puis réutilisée, avec un nonce par message, jusqu'à la
+    rotation (nombre de messages ou âge, cf. chat.conversations).
+    """
+    user_a = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_b = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    wrapped_key_a = models.BinaryField()
+    wrapped_key_b = models.BinaryField()
+    # Clés (users.UserKey.key_id) sous lesquelles la clé de session est enveloppée
+    key_id_a = models.CharField(max_length=64, blank=True, default='')
+    key_id_b = models.CharField(max_length=64, blank=True, default='')
+    message_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_a', 'user_b', 'created_at'], name='chat_conv_session_idx'),
+        ]
+
+    def wrapped_key_for(self, user_id):
+        return self.wrapped_key_a if user_id == self.user_a_id else self.wrapped_key_b
+
+    def key_id_for(self, user_id):
+        return self.key_id_a if user_id == self.user_a_id else self.key_id_b
+
+    def __str__(self):
+        return f'Session {self.user_a} / {self.user_b} at {self.created_at}'
+
+
 class EncryptedMessage(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     recipient = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
-    encrypted_message = models.TextField()
-    encrypted_aes_key = models.TextField()
-    iv = models.CharField(max_length=32)  # En base64
+    # Ancien format base64, gardé pour la lecture double : les lignes écrites par
+    # un nœud antérieur aux colonnes binaires n'ont que lui. Déclaré (avec
+    # default='') tant que la base a les colonnes NOT NULL ; la suppression
+    # attend une version ultérieure (cf. manage.py backfill_binary_messages --check)
+    encrypted_message = models.TextField(blank=True, default='')
+    encrypted_aes_key = models.TextField(blank=True, default='')
+    iv = models.CharField(max_length=32, blank=True, default='')  # En base64
+    # Format binaire (bytes bruts, sans l'inflation base64) ; iv_bin est vide pour
+    # les enveloppes versionnées (cf. crypto.utils), qui portent leur nonce
+    encrypted_message_bin = models.BinaryField(null=True)
+    encrypted_aes_key_bin = models.BinaryField(null=True)
+    iv_bin = models.BinaryField(null=True)
+    # Message chiffré sous la clé de session (encrypted_aes_key_bin est alors vide)
+    session = models.ForeignKey(ConversationSession, null=True, blank=True, related_name='messages', on_delete=models.CASCADE)
+    # Clé du destinataire (users.UserKey.key_id) sous laquelle aes_key_bytes est
+    # enveloppée, celle de la session pour un message de session
+    recipient_key_id = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Pagination keyset de l'inbox : WHERE recipient = ? ORDER BY created_at, id
+            models.Index(fields=['recipient', 'created_at', 'id'], name='chat_inbox_cursor_idx'),
+            # Synchronisation incrémentale : WHERE recipient = ? AND id > ? ORDER BY id
+            models.Index(fields=['recipient', 'id'], name='chat_inbox_sync_idx'),
+        ]
+
+    @property
+    def message_bytes(self):
+        return _dual_read(self.encrypted_message_bin, self.encrypted_message)
+
+    @property
+    def aes_key_bytes(self):
+        aes_key = _dual_read(self.encrypted_aes_key_bin, self.encrypted_aes_key)
+        if self.session_id is not None and not aes_key:
+            # Clé de session enveloppée pour le destinataire (déjà résolue pour
+            # les lignes reconstruites depuis le cache, cf. chat.inbox_cache)
+            return self.session.wrapped_key_for(self.recipient_id)
+        return aes_key
+
+    @property
+    def iv_bytes(self):
+        return _dual_read(self.iv_bin, self.iv)
+
+    @property
+    def version(self):
+        return envelope_version(self.message_bytes, self.iv_bytes)
+
     def __str__(self):
         return f'Message from {self.sender} to {self.recipient} at {self.created_at}'
+
+
+class InboxState(models.Model):
+    """
+    État de l'inbox d'un utilisateur : plus grands ids de message remis et lus.
+
+    Une ligne par utilisateur (marques hautes) au lieu d'un état par message :
+    tous les messages d'id <= ``delivered_up_to`` sont remis, <= ``read_up_to`` lus.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='inbox_state', on_delete=models.CASCADE)
+    delivered_up_to = models.BigIntegerField(default=0)
+    read_up_to = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Inbox of {self.user}: delivered {self.delivered_up_to}, read {self.read_up_to}'
+
+
+class Attachment(models.Model):
+    """
+    Manifeste d'une pièce jointe. Le contenu, chiffré par blocs (cf.
+    crypto.utils.seal_stream), est dans le blob store ; la ligne ne garde que
+    de quoi le relire : clé du fichier enveloppée pour le destinataire, préfixe
+    de nonce, taille et taille de bloc.
+    """
+    sender = models.ForeignKey(User, related_name='sent_attachments', on_delete=models.CASCADE)
+    recipient = models.ForeignKey(User, related_name='received_attachments', on_delete=models.CASCADE)
+    storage_key = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()  # taille en clair
+    chunk_size = models.PositiveIntegerField()
+    nonce_prefix = models.BinaryField(max_length=8)
+    encrypted_key = models.BinaryField()
+    # Clé du destinataire (users.UserKey.key_id) sous laquelle encrypted_key est enveloppée
+    recipient_key_id = models.CharField(max_length=64, blank=True, default='')
+    # Nom de fichier chiffré sous la clé du fichier (enveloppe v2)
+    encrypted_filename = models.BinaryField()
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'created_at', 'id'], name='chat_attachment_inbox_idx'),
+        ]
+
+    @property
+    def chunk_count(self):
+        # Un fichier vide a quand même un bloc (vide, authentifié)
+        return max(1, -(-self.size // self.chunk_size))
+
+    def __str__(self):
+        return f'Attachment from {self.sender} to {self.recipient} ({self.size} bytes)'
+
+
+class RetentionPolicy(models.Model):
+    """
+    Durée de conservation propre à un utilisateur (messages reçus), prioritaire
+    sur la politique globale ``MESSAGE_RETENTION_DAYS`` (cf. chat.retention).
+    ``retention_days`` vide : messages gardés indéfiniment.
+    """
+    ACTION_ARCHIVE = 'archive'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = [
+        (ACTION_ARCHIVE, 'Archive'),
+        (ACTION_DELETE, 'Delete'),
+    ]
+
+    user = models.OneToOneField(User, primary_key=True, related_name='retention_policy', on_delete=models.CASCADE)
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default=ACTION_ARCHIVE)
+
+    def __str__(self):
+        return f'Retention of {self.user}: {self.retention_days or "forever"} days ({self.action})'
+
+
+class ArchivedMessage(models.Model):
+    """
+    Message sorti de la table chaude par la rétention : mêmes octets chiffrés,
+    sans les colonnes base64 ni la clé étrangère de session. Pour un message de
+    session, la clé de session enveloppée pour le destinataire est recopiée :
+    la ligne se déchiffre seule. L'id est celui du message d'origine.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    sender = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    recipient = models.ForeignKey(User, related_name='archived_messages', on_delete=models.CASCADE)
+    encrypted_message_bin = models.BinaryField()
+    encrypted_aes_key_bin = models.BinaryField()
+    iv_bin = models.BinaryField(default=b'')
+    # Id de la session d'origine : une seule opération asymétrique par session à la lecture
+    session_id = models.BigIntegerField(null=True, blank=True)
+    recipient_key_id = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'created_at', 'id'], name='chat_archive_cursor_idx'),
+        ]
+
+    @property
+    def message_bytes(self):
+        return self.encrypted_message_bin
+
+    @property
+    def aes_key_bytes(self):
+        return self.encrypted_aes_key_bin
+
+    @property
+    def iv_bytes(self):
+        return self.iv_bin
+
+    @property
+    def version(self):
+        return envelope_version(self.message_bytes, self.iv_bytes)
+
+    def __str__(self):
+        return f'Archived message from {self.sender} to {self.recipient} at {self.created_at}'
@@ -0,0 +1,108 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from users.authentication import CachedJWTAuthentication
+from .channel_layers import get_channel_layer, user_group
+from .serializers import EncryptedMessageSerializer
+
+WEBSOCKET_PATH = '/ws/messages/'
+
+# Codes de fermeture applicatifs (plage 4000-4999)
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+
+
+def publish_messages(messages):
+    """
+    Pousse l'enveloppe chiffrée de chaque message vers les sockets du destinataire.
+
+    Appelé après le commit : un client ne reçoit jamais un message annulé.
+    Un message sans id n'est pas poussé : les clients dédoublonnent et
+    avancent leur curseur de synchronisation par id (ils le liront dans l'inbox).
+    """
+    envelopes = [
+        (msg.recipient_id, {'type': 'message', 'message': EncryptedMessageSerializer(msg).data})
+        for msg in messages
+        if msg.pk is not None
+    ]
+
+    def send():
+        layer = get_channel_layer()
+        for recipient_id, event in envelopes:
+            layer.group_send(user_group(recipient_id), event)
+
+    transaction.on_commit(send)
+
+
+def authenticate_token(raw_token):
+    auth = CachedJWTAuthentication()
+    validated_token = auth.get_validated_token(raw_token.encode())
+    return auth.get_user(validated_token)
+
+
+async def websocket_application(scope, receive, send):
+    """
+    WebSocket ``/ws/messages/?token=<access JWT>`` : reçoit en temps réel les
+    messages adressés à l'utilisateur (mêmes enveloppes que ``EncryptedMessageSerializer``).
+    """
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    if scope['path'] != WEBSOCKET_PATH:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    # Les navigateurs ne peuvent pas poser d'en-tête Authorization sur une WebSocket
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [''])[0]
+    try:
+        user = await sync_to_async(authenticate_token)(token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    await send({'type': 'websocket.accept'})
+
+    layer = get_channel_layer()
+    group = user_group(user.pk)
+    queue = layer.subscribe(group)
+    receiving = asyncio.ensure_future(receive())
+    pushing = asyncio.ensure_future(queue.get())
+
+    try:
+        while True:
+            done, _ = await asyncio.wait({receiving, pushing}, return_when=asyncio.FIRST_COMPLETED)
+
+            if pushing in done:
+                await send({'type': 'websocket.send', 'text': json.dumps(pushing.result())})
+                pushing = asyncio.ensure_future(queue.get())
+
+            if receiving in done:
+                event = receiving.result()
+                if event['type'] == 'websocket.disconnect':
+                    break
+                # Les messages du client sont ignorés (keep-alive)
+                receiving = asyncio.ensure_future(receive())
+    finally:
+        layer.unsubscribe(group, queue)
+        for task in (receiving, pushing):
+            task.cancel()
+
+
+class ProtocolRouter:
+    """Routeur ASGI par type de protocole (``http``, ``websocket``...)."""
+
+    def __init__(self, applications):
+        self.applications = applications
+
+    async def __call__(self, scope, receive, send):
+        application = self.applications.get(scope['type'])
+        if application is None:
+            raise ValueError(f"No application configured for scope type {scope['type']!r}")
+        return await application(scope, receive, send)
@@ -0,0 +1,104 @@
+"""
+Rétention des messages : les messages reçus plus vieux que la politique de
+leur destinataire sortent de la table chaude, par lots (cf. commande
+``apply_retention``), vers ``ArchivedMessage`` ou sont supprimés.
+
+Chaque lot est une transaction courte (insertion dans l'archive + suppression)
+: pas de verrou long, et une exécution interrompue reprend où elle s'est arrêtée.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import inbox_cache
+from .models import ArchivedMessage, EncryptedMessage, RetentionPolicy
+
+MESSAGE_RETENTION_DAYS = getattr(settings, 'MESSAGE_RETENTION_DAYS', None)
+MESSAGE_RETENTION_ACTION = getattr(settings, 'MESSAGE_RETENTION_ACTION', RetentionPolicy.ACTION_ARCHIVE)
+RETENTION_BATCH_SIZE = getattr(settings, 'RETENTION_BATCH_SIZE', 1000)
+
+
+def expired_querysets(now=None):
+    """
+    Messages à traiter, par politique.
+
+    :return: liste de (libellé, queryset, action) — les politiques par
+        utilisateur d'abord, puis la politique globale pour les autres
+    """
+    now = now or timezone.now()
+    targets = []
+
+    for policy in RetentionPolicy.objects.filter(retention_days__isnull=False).select_related('user'):
+        cutoff = now - timedelta(days=policy.retention_days)
+        targets.append((
+            f'user {policy.user.username} ({policy.retention_days}d, {policy.action})',
+            EncryptedMessage.objects.filter(recipient=policy.user, created_at__lt=cutoff),
+            policy.action,
+        ))
+
+    if MESSAGE_RETENTION_DAYS is not None:
+        cutoff = now - timedelta(days=MESSAGE_RETENTION_DAYS)
+        targets.append((
+            f'global ({MESSAGE_RETENTION_DAYS}d, {MESSAGE_RETENTION_ACTION})',
+            EncryptedMessage.objects.filter(created_at__lt=cutoff).exclude(
+                # Une politique propre (même « garder indéfiniment ») remplace la globale
+                recipient__in=RetentionPolicy.objects.values('user')
+            ),
+            MESSAGE_RETENTION_ACTION,
+        ))
+
+    return targets
+
+
+def archived_copy(msg):
+    return ArchivedMessage(
+        id=msg.id,
+        sender_id=msg.sender_id,
+        recipient_id=msg.recipient_id,
+        encrypted_message_bin=msg.message_bytes,
+        # Clé de session recopiée : l'archive ne dépend plus de ConversationSession
+        encrypted_aes_key_bin=msg.aes_key_bytes,
+        iv_bin=msg.iv_bytes,
+        session_id=msg.session_id,
+        recipient_key_id=msg.recipient_key_id,
+        created_at=msg.created_at,
+    )
+
+
+def process_batch(queryset, action, batch_size=RETENTION_BATCH_SIZE):
+    """
+    Archive (ou supprime) au plus ``batch_size`` messages de ``queryset``.
+
+    Les lignes traitées quittent la table : il suffit de rappeler la fonction
+    jusqu'à ce qu'elle retourne 0, sans curseur.
+
+    :return: nombre de messages traités
+    """
+    with transaction.atomic():
+        batch = list(queryset.select_related('session').order_by('id')[:batch_size])
+        if not batch:
+            return 0
+        if action == RetentionPolicy.ACTION_ARCHIVE:
+            # ignore_conflicts : idempotent si un lot précédent a été archivé sans être supprimé
+            ArchivedMessage.objects.bulk_create([archived_copy(msg) for msg in batch], ignore_conflicts=True)
+        EncryptedMessage.objects.filter(id__in=[msg.id for msg in batch]).delete()
+        recipient_ids = {msg.recipient_id for msg in batch}
+        transaction.on_commit(lambda: inbox_cache.invalidate(recipient_ids))
+    return len(batch)
+
+
+def archive_page(user, after=None, limit=50):
+    """Page de l'historique archivé (keyset sur ``(created_at, id)``, comme l'inbox)."""
+    queryset = ArchivedMessage.objects.filter(recipient=user)
+    if after is not None:
+        anchor = queryset.filter(id=after).values_list('created_at', flat=True).first()
+        if anchor is None:
+            queryset = queryset.filter(id__gt=after)
+        else:
+            queryset = queryset.filter(Q(created_at__gt=anchor) | Q(created_at=anchor, id__gt=after))
+
+    rows = list(queryset.select_related('sender').order_by('created_at', 'id')[:limit + 1])
+    return rows[:limit], len(rows) > limit
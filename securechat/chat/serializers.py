@@ -1,8 +1,48 @@
+import base64
+
 from rest_framework import serializers
-from .models import EncryptedMessage
+
+from crypto.profiling import timed
+from .models import EncryptedMessage, Attachment, ArchivedMessage
+
+
+class Base64BytesField(serializers.Field):
+    """Expose en base64 (JSON) un champ binaire (bytes ou memoryview)."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    @timed('b64', size_arg=1)
+    def to_representation(self, value):
+        return base64.b64encode(value).decode()
+
 
 class EncryptedMessageSerializer(serializers.ModelSerializer):
+    sender_username = serializers.CharField(source='sender.username', read_only=True)
+    encrypted_message = Base64BytesField(source='message_bytes')
+    encrypted_aes_key = Base64BytesField(source='aes_key_bytes')
+    iv = Base64BytesField(source='iv_bytes')
+    version = serializers.IntegerField(read_only=True)
+    # Clé du destinataire sous laquelle encrypted_aes_key est enveloppée
+    key_id = serializers.CharField(source='recipient_key_id', read_only=True)
+
     class Meta:
         model = EncryptedMessage
-        fields = ['id', 'sender', 'recipient', 'encrypted_message', 'encrypted_aes_key', 'iv', 'created_at']
+        fields = ['id', 'sender', 'sender_username', 'recipient', 'encrypted_message', 'encrypted_aes_key', 'iv', 'key_id', 'version', 'created_at']
         read_only_fields = ['sender', 'created_at']
+
+
+class ArchivedMessageSerializer(EncryptedMessageSerializer):
+    class Meta(EncryptedMessageSerializer.Meta):
+        model = ArchivedMessage
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    """Manifeste d'une pièce jointe (le nom de fichier chiffré n'est rendu qu'au téléchargement)."""
+    sender_username = serializers.CharField(source='sender.username', read_only=True)
+
+    class Meta:
+        model = Attachment
+        fields = ['id', 'sender', 'sender_username', 'recipient', 'size', 'content_type', 'created_at']
+        read_only_fields = fields
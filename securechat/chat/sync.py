@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core import signing
+
+from . import inbox_cache
+from .models import EncryptedMessage, InboxState
+
+SYNC_PAGE_SIZE = getattr(settings, 'SYNC_PAGE_SIZE', 100)
+SYNC_MAX_PAGE_SIZE = getattr(settings, 'SYNC_MAX_PAGE_SIZE', 500)
+SYNC_TOKEN_SALT = 'chat.sync'
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+def make_sync_token(user, last_id):
+    """Token opaque (signé) : dernier id de message vu par le client."""
+    return signing.dumps({'u': user.pk, 'm': last_id}, salt=SYNC_TOKEN_SALT)
+
+
+def read_sync_token(user, token):
+    """
+    :return: dernier id vu (0 sans token : synchronisation initiale)
+    :raises InvalidSyncToken: token altéré ou émis pour un autre utilisateur
+    """
+    if not token:
+        return 0
+    try:
+        data = signing.loads(token, salt=SYNC_TOKEN_SALT)
+    except signing.BadSignature:
+        raise InvalidSyncToken('Invalid sync token')
+    if data.get('u') != user.pk:
+        raise InvalidSyncToken('Invalid sync token')
+    return data['m']
+
+
+def sync_page(user, after_id, limit=SYNC_PAGE_SIZE):
+    """
+    Messages de ``user`` d'id > ``after_id`` (index ``chat_inbox_sync_idx``).
+
+    En régime établi (rien de nouveau) la requête ne lit aucune ligne, et le
+    cache de l'inbox chaude l'évite le plus souvent.
+
+    :return: (messages, has_more)
+    """
+    cached = inbox_cache.get_page(user, after_id, limit)
+    if cached is not None:
+        return cached
+
+    rows = list(
+        EncryptedMessage.objects.filter(recipient=user, id__gt=after_id)
+        .select_related('sender', 'session')
+        .order_by('id')[:limit + 1]
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def advance_inbox_state(user, field, up_to):
+    """
+    Avance la marque ``field`` ('delivered_up_to' ou 'read_up_to') jusqu'à
+    ``up_to`` ; une seule UPDATE conditionnelle, la marque ne recule jamais.
+    """
+    lookup = {'user': user, f'{field}__lt': up_to}
+    if InboxState.objects.filter(**lookup).update(**{field: up_to}):
+        return
+
+    _, created = InboxState.objects.get_or_create(user=user, defaults={field: up_to})
+    if not created:
+        # Ligne créée entre-temps (ou déjà plus loin : l'UPDATE ne fait rien)
+        InboxState.objects.filter(**lookup).update(**{field: up_to})
+
+
+def mark_delivered(user, up_to):
+    advance_inbox_state(user, 'delivered_up_to', up_to)
+
+
+def mark_read(user, up_to):
+    """
+    Marque comme lus les messages d'id <= ``up_to`` (borné au dernier message
+    existant de l'inbox). Lu implique remis : les deux marques avancent.
+
+    :return: la marque effectivement appliquée (0 si rien à marquer)
+    """
+    up_to = EncryptedMessage.objects.filter(
+        recipient=user, id__lte=up_to
+    ).order_by('-id').values_list('id', flat=True).first()
+    if up_to is None:
+        return 0
+    advance_inbox_state(user, 'read_up_to', up_to)
+    advance_inbox_state(user, 'delivered_up_to', up_to)
+    return up_to
+
+
+def inbox_state(user):
+    """:return: (delivered_up_to, read_up_to)"""
+    state = InboxState.objects.filter(user=user).values_list('delivered_up_to', 'read_up_to').first()
+    return state or (0, 0)
+
+
+def unread_count(user, read_up_to):
+    return EncryptedMessage.objects.filter(recipient=user, id__gt=read_up_to).count()
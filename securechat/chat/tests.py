@@ -1,3 +1,1408 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import serialization
+from django.core import signing
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.attachments import AttachmentTooLarge, AttachmentWriter, iter_plaintext, open_attachment, parse_range, store_attachment
+from chat import inbox_cache, retention
+from chat.blobstores import LocalBlobStore
+from chat.channel_layers import InMemoryChannelLayer, user_group
+from chat.management.commands.loadtest import parse_mix, zipf_weights
+from chat.management.commands.loadtest_async import http_request
+from chat.conversations import conversation_key_for_send, session_key_cache
+from chat.models import ArchivedMessage, Attachment, ConversationSession, EncryptedMessage, RetentionPolicy
+from chat.realtime import (
+    CLOSE_NOT_FOUND, CLOSE_UNAUTHORIZED, WEBSOCKET_PATH, ProtocolRouter, publish_messages, websocket_application,
+)
+from chat.sync import SYNC_TOKEN_SALT, InvalidSyncToken, make_sync_token, read_sync_token
+from chat.views import (
+    INBOX_MAX_PAGE_SIZE, decrypt_inbox, decrypt_row, decrypt_rows, inbox_page, inbox_queryset, iter_inbox,
+    parse_inbox_cursor, seal_message, stream_json_array,
+)
+from crypto.profiling import RequestProfile, _current_profile
+from crypto.utils import decrypt_payload, unwrap_aes_key
+from users import keyring
+from users.keyring import UnlockedKeys, shared_keyring
+from users.keys import create_user_key
+from users.models import CustomUser
+from users.utils import CryptoWorkerPool, generate_rsa_key_pair, generate_x25519_key_pair
+
+
+def make_user(username, key_type=CustomUser.KEY_TYPE_X25519):
+    """
+    Utilisateur avec une clé (X25519 par défaut : génération instantanée) et
+    ses clés déverrouillées ; la clé privée chiffrée stockée n'est pas relue.
+    """
+    user = CustomUser.objects.create_user(username=username)
+    if key_type == CustomUser.KEY_TYPE_RSA:
+        private_pem, public_pem = generate_rsa_key_pair()
+    else:
+        private_pem, public_pem = generate_x25519_key_pair()
+    key = create_user_key(user, key_type, public_pem, b64encode(b'unused').decode())
+    keys = UnlockedKeys({key.key_id: serialization.load_pem_private_key(private_pem, password=None)}, key.key_id)
+    return user, keys
+
+
+def add_user_key(user, keys):
+    """Rotation : nouvelle clé X25519 active, ajoutée aux clés déverrouillées ``keys``."""
+    private_pem, public_pem = generate_x25519_key_pair()
+    key = create_user_key(user, CustomUser.KEY_TYPE_X25519, public_pem, b64encode(b'unused').decode())
+    keys.keys[key.key_id] = serialization.load_pem_private_key(private_pem, password=None)
+    keys.active_key_id = key.key_id
+    return key
+
+
+class InboxTestCase(TestCase):
+    """Le cache de l'inbox survit aux rollbacks de TestCase (ids réutilisés) : vidé à chaque test."""
+
+    def setUp(self):
+        inbox_cache.get_cache().clear()
+        self.addCleanup(inbox_cache.get_cache().clear)
+
+    def send(self, sender, recipient, text='bonjour'):
+        with self.captureOnCommitCallbacks(execute=True):
+            msg = EncryptedMessage.objects.create(sender=sender, recipient=recipient, **seal_message(recipient, text))
+            inbox_cache.append_messages([msg])
+        return msg
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_no_header(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('', 100))
+
+    def test_full(self):
+        self.assertEqual(parse_range('bytes=0-', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=0-99', 100), (0, 99))
+
+    def test_mid_file(self):
+        self.assertEqual(parse_range('bytes=10-19', 100), (10, 19))
+        self.assertEqual(parse_range('bytes=50-', 100), (50, 99))
+
+    def test_end_is_clamped(self):
+        self.assertEqual(parse_range('bytes=90-500', 100), (90, 99))
+
+    def test_suffix(self):
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+
+    def test_unsatisfiable(self):
+        for header, size in (
+            ('bytes=100-', 100), ('bytes=20-10', 100), ('bytes=-0', 100), ('bytes=0-', 0), ('bytes=-5', 0),
+        ):
+            with self.subTest(header=header, size=size), self.assertRaises(ValueError):
+                parse_range(header, size)
+
+    def test_malformed(self):
+        for header in ('items=0-1', 'bytes=0-1,5-6', 'bytes=a-b'):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range(header, 100)
+
+
+class AttachmentTests(TestCase):
+    chunk_size = 16
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.store = LocalBlobStore(root)
+        for patcher in (
+            mock.patch('chat.blobstores._store', self.store),
+            mock.patch('chat.attachments.ATTACHMENT_CHUNK_SIZE', self.chunk_size),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sender, _ = make_user('sender')
+        self.recipient, self.keys = make_user('recipient')
+
+    def blobs(self):
+        return sorted(path.name for path in self.store.root.rglob('*') if path.is_file())
+
+    def read(self, attachment, start=None, end=None):
+        file_key, filename = open_attachment(self.keys, attachment)
+        if not attachment.size:
+            return b'', filename
+        start = 0 if start is None else start
+        end = attachment.size - 1 if end is None else end
+        return b''.join(iter_plaintext(attachment, file_key, start, end)), filename
+
+    def test_store_round_trip(self):
+        cs = self.chunk_size
+        for size in (0, 1, cs, 3 * cs, 3 * cs + 5):
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                attachment = store_attachment(self.sender, self.recipient, io.BytesIO(data).read, 'f.bin')
+                self.assertEqual(attachment.size, size)
+                self.assertEqual(self.read(attachment), (data, 'f.bin'))
+
+    def test_writer_matches_stream(self):
+        # Écriture poussée (multipart) en morceaux quelconques : mêmes blocs que store_attachment
+        cs = self.chunk_size
+        for size in (0, cs - 1, cs, 2 * cs, 2 * cs + 1):
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                writer = AttachmentWriter()
+                for offset in range(0, size, 7):
+                    writer.write(data[offset:offset + 7])
+                writer.close()
+                attachment = writer.create_manifest(self.sender, self.recipient, 'w.bin')
+                self.assertEqual(attachment.chunk_count, max(1, -(-size // cs)))
+                self.assertEqual(self.read(attachment), (data, 'w.bin'))
+
+    def test_ranges_read_only_needed_chunks(self):
+        data = os.urandom(5 * self.chunk_size + 3)
+        attachment = store_attachment(self.sender, self.recipient, io.BytesIO(data).read, 'r.bin')
+        for start, end in ((0, 0), (15, 16), (20, 47), (len(data) - 3, len(data) - 1)):
+            with self.subTest(start=start, end=end):
+                with mock.patch.object(self.store, 'read', wraps=self.store.read) as read:
+                    self.assertEqual(self.read(attachment, start, end)[0], data[start:end + 1])
+                self.assertEqual(read.call_count, end // self.chunk_size - start // self.chunk_size + 1)
+
+    def test_tampered_blob(self):
+        attachment = store_attachment(self.sender, self.recipient, io.BytesIO(b'x' * 40).read, 't.bin')
+        path = self.store._path(attachment.storage_key)
+        blob = bytearray(path.read_bytes())
+        blob[self.chunk_size + 20] ^= 1
+        path.write_bytes(bytes(blob))
+        with self.assertRaises(InvalidTag):
+            self.read(attachment)
+
+    def test_too_large(self):
+        with mock.patch('chat.attachments.ATTACHMENT_MAX_SIZE', 2 * self.chunk_size):
+            with self.assertRaises(AttachmentTooLarge):
+                store_attachment(self.sender, self.recipient, io.BytesIO(b'x' * 100).read, 'big')
+            writer = AttachmentWriter()
+            writer.write(b'x' * 2 * self.chunk_size)
+            with self.assertRaises(AttachmentTooLarge):
+                writer.write(b'x')
+        self.assertEqual(self.blobs(), [])
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_multipart_upload(self):
+        client = APIClient()
+        client.force_authenticate(self.sender)
+        data = os.urandom(3 * self.chunk_size + 1)
+        upload = io.BytesIO(data)
+        upload.name = 'photo.jpg'
+
+        # Les handlers par défaut écriraient ce fichier en clair sur le disque
+        with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0), mock.patch(
+            'django.core.files.uploadedfile.TemporaryUploadedFile.__init__', side_effect=AssertionError
+        ):
+            response = client.post(
+                reverse('encrypted_attachments'), {'recipient': self.recipient.pk, 'file': upload}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        attachment = Attachment.objects.get(pk=response.json()['id'])
+        self.assertEqual(self.read(attachment), (data, 'photo.jpg'))
+
+    def test_multipart_upload_too_large(self):
+        client = APIClient()
+        client.force_authenticate(self.sender)
+        upload = io.BytesIO(b'x' * 100)
+        upload.name = 'big.bin'
+        with mock.patch('chat.attachments.ATTACHMENT_MAX_SIZE', 2 * self.chunk_size):
+            response = client.post(
+                reverse('encrypted_attachments'), {'recipient': self.recipient.pk, 'file': upload}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.blobs(), [])
+
+    def test_multipart_unknown_recipient(self):
+        client = APIClient()
+        client.force_authenticate(self.sender)
+        upload = io.BytesIO(b'abc')
+        upload.name = 'a.txt'
+        response = client.post(reverse('encrypted_attachments'), {'recipient': 0, 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.blobs(), [])
+
+
+def legacy_message(sender, recipient, text):
+    """Ligne écrite par un nœud antérieur aux colonnes binaires (texte base64 seul)."""
+    fields = seal_message(recipient, text)
+    return EncryptedMessage.objects.create(
+        sender=sender, recipient=recipient, recipient_key_id=fields['recipient_key_id'],
+        encrypted_message=b64encode(fields['encrypted_message_bin']).decode(),
+        encrypted_aes_key=b64encode(fields['encrypted_aes_key_bin']).decode(),
+        encrypted_message_bin=None, encrypted_aes_key_bin=None, iv_bin=None,
+    )
+
+
+class ConversationSessionTests(TestCase):
+    def setUp(self):
+        # Les ids de session sont réutilisés d'un test à l'autre (rollback)
+        session_key_cache.clear()
+        self.addCleanup(session_key_cache.clear)
+        self.alice, self.alice_keys = make_user('alice')
+        self.bob, self.bob_keys = make_user('bob')
+
+    def send(self, sender, recipient, text='bonjour', sender_keys=None):
+        session, session_key = conversation_key_for_send(sender, recipient, sender_keys)
+        return EncryptedMessage.objects.create(
+            sender=sender, recipient=recipient, **seal_message(recipient, text, session, session_key)
+        )
+
+    def read(self, msg, keys):
+        msg = EncryptedMessage.objects.select_related('sender', 'session').get(pk=msg.pk)
+        return decrypt_row(keys, msg)['message']
+
+    def test_session_key_round_trip(self):
+        msg = self.send(self.alice, self.bob, 'salut')
+        session = msg.session
+        self.assertEqual(msg.encrypted_aes_key_bin, b'')
+        self.assertEqual(msg.recipient_key_id, self.bob_keys.active_key_id)
+        # Clé de session enveloppée pour chaque participant
+        key_a = unwrap_aes_key(self.alice_keys.active, session.wrapped_key_for(self.alice.pk))
+        key_b = unwrap_aes_key(self.bob_keys.active, session.wrapped_key_for(self.bob.pk))
+        self.assertEqual(key_a, key_b)
+        self.assertEqual(session_key_cache.get(session.pk), key_a)
+        self.assertEqual(self.read(msg, self.bob_keys), 'salut')
+
+    def test_session_is_reused_in_both_directions(self):
+        first = self.send(self.alice, self.bob)
+        reply = self.send(self.bob, self.alice, 'réponse')
+        self.assertEqual(reply.session_id, first.session_id)
+        self.assertEqual(ConversationSession.objects.get().message_count, 2)
+        self.assertEqual(self.read(reply, self.alice_keys), 'réponse')
+
+    def test_one_unwrap_per_session(self):
+        msgs = [self.send(self.alice, self.bob, f'm{i}') for i in range(5)]
+        rows = list(EncryptedMessage.objects.select_related('sender', 'session').filter(pk__in=[m.pk for m in msgs]))
+        with mock.patch('chat.views.unwrap_aes_key', wraps=unwrap_aes_key) as unwrap:
+            self.assertEqual([row['message'] for row in decrypt_inbox(self.bob_keys, rows)], [f'm{i}' for i in range(5)])
+        self.assertEqual(unwrap.call_count, 1)
+
+    @mock.patch('chat.conversations.CONVERSATION_SESSION_MAX_MESSAGES', 2)
+    def test_rotation_after_max_messages(self):
+        msgs = [self.send(self.alice, self.bob, f'm{i}') for i in range(5)]
+        self.assertEqual([m.session_id for m in msgs].count(msgs[0].session_id), 2)
+        self.assertEqual(len({m.session_id for m in msgs}), 3)
+        # Les messages des sessions précédentes restent lisibles
+        self.assertEqual([self.read(m, self.bob_keys) for m in msgs], [f'm{i}' for i in range(5)])
+
+    def test_rotation_after_max_age(self):
+        first = self.send(self.alice, self.bob, 'ancien')
+        ConversationSession.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        second = self.send(self.alice, self.bob, 'récent')
+        self.assertNotEqual(second.session_id, first.session_id)
+        self.assertEqual(self.read(first, self.bob_keys), 'ancien')
+
+    def test_rotation_on_key_change(self):
+        old_key_id = self.bob_keys.active_key_id
+        first = self.send(self.alice, self.bob, 'avant')
+        new_key = add_user_key(self.bob, self.bob_keys)
+
+        second = self.send(self.alice, self.bob, 'après')
+        self.assertNotEqual(second.session_id, first.session_id)
+        self.assertEqual(second.session.key_id_for(self.bob.pk), new_key.key_id)
+        self.assertEqual((first.recipient_key_id, second.recipient_key_id), (old_key_id, new_key.key_id))
+        # Ancien message : déchiffré avec la clé retirée, choisie par son key_id
+        self.assertEqual(self.read(first, self.bob_keys), 'avant')
+        self.assertEqual(self.read(second, self.bob_keys), 'après')
+
+    def test_evicted_key_is_recovered_with_sender_keys(self):
+        first = self.send(self.alice, self.bob)
+        session_key_cache.clear()
+        second = self.send(self.alice, self.bob, sender_keys=self.alice_keys)
+        self.assertEqual(second.session_id, first.session_id)
+
+    def test_evicted_key_without_sender_keys_opens_a_session(self):
+        first = self.send(self.alice, self.bob)
+        session_key_cache.clear()
+        second = self.send(self.alice, self.bob, 'suite')
+        self.assertNotEqual(second.session_id, first.session_id)
+        self.assertEqual(self.read(second, self.bob_keys), 'suite')
+
+    @mock.patch('chat.conversations.CONVERSATION_SESSIONS_ENABLED', False)
+    def test_disabled(self):
+        self.assertEqual(conversation_key_for_send(self.alice, self.bob), (None, None))
+        msg = self.send(self.alice, self.bob, 'direct')
+        self.assertIsNone(msg.session_id)
+        self.assertEqual(self.read(msg, self.bob_keys), 'direct')
+
+
+class LegacyMessageTests(TestCase):
+    def setUp(self):
+        self.sender, _ = make_user('sender')
+        self.user, self.keys = make_user('user')
+
+    def legacy(self, text):
+        return legacy_message(self.sender, self.user, text)
+
+    def test_new_rows_fill_legacy_columns(self):
+        # Colonnes base64 encore NOT NULL en base pendant le déploiement
+        msg = EncryptedMessage.objects.create(sender=self.sender, recipient=self.user, **seal_message(self.user, 'x'))
+        row = EncryptedMessage.objects.filter(pk=msg.pk).values('encrypted_message', 'encrypted_aes_key', 'iv').get()
+        self.assertEqual(row, {'encrypted_message': '', 'encrypted_aes_key': '', 'iv': ''})
+
+    def test_dual_read(self):
+        msg = EncryptedMessage.objects.select_related('sender').get(pk=self.legacy('ancien').pk)
+        self.assertIsNone(msg.encrypted_message_bin)
+        self.assertEqual(decrypt_row(self.keys, msg)['message'], 'ancien')
+
+    def test_backfill_command(self):
+        legacy = self.legacy('ancien')
+        with self.assertRaisesMessage(CommandError, '1 message(s) still have no binary columns'):
+            call_command('backfill_binary_messages', '--check', stdout=io.StringIO())
+
+        call_command('backfill_binary_messages', stdout=io.StringIO())
+        msg = EncryptedMessage.objects.select_related('sender').get(pk=legacy.pk)
+        self.assertIsNotNone(msg.encrypted_message_bin)
+        self.assertEqual(msg.iv_bin, b'')
+        self.assertEqual(decrypt_row(self.keys, msg)['message'], 'ancien')
+        # Texte base64 gardé : les colonnes ne sont supprimées qu'à une version ultérieure
+        self.assertNotEqual(msg.encrypted_message, '')
+        call_command('backfill_binary_messages', '--check', stdout=io.StringIO())
+
+
+class BinaryBackfillMigrationTests(TransactionTestCase):
+    before = [('chat', '0010_backfill_recipient_key_id')]
+    after = [('chat', '0011_backfill_remaining_binary_fields')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+
+    def test_rows_written_by_old_nodes_are_backfilled(self):
+        self.migrate(self.before)
+        self.addCleanup(self.migrate, self.after)
+        sender, _ = make_user('sender')
+        user, keys = make_user('user')
+        # Le schéma de 0010 est celui du modèle : la ligne s'écrit avec le code actuel
+        legacy = legacy_message(sender, user, 'ancien')
+
+        self.migrate(self.after)
+        msg = EncryptedMessage.objects.select_related('sender').get(pk=legacy.pk)
+        self.assertIsNotNone(msg.encrypted_message_bin)
+        self.assertIsNotNone(msg.encrypted_aes_key_bin)
+        self.assertEqual(decrypt_row(keys, msg)['message'], 'ancien')
+
+
+class BulkSendTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.recipients = [make_user(f'r{i}')[0] for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+        self.layer = mock.Mock()
+        patcher = mock.patch('chat.realtime.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send_bulk(self, recipients, message='à tous'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('send_bulk_encrypted_message'), {'recipients': recipients, 'message': message}, format='json'
+            )
+
+    def pushed(self):
+        return {call.args[0]: call.args[1]['message']['id'] for call in self.layer.group_send.call_args_list}
+
+    def assert_pushed_ids(self):
+        expected = {f'user.{msg.recipient_id}': msg.id for msg in EncryptedMessage.objects.all()}
+        self.assertEqual(len(expected), len(self.recipients))
+        self.assertEqual(self.pushed(), expected)
+
+    def test_mixed_key_types(self):
+        rsa_user, rsa_keys = make_user('rsa', CustomUser.KEY_TYPE_RSA)
+        x25519_user, x25519_keys = make_user('x25519')
+        # Doublon ignoré, ordre gardé
+        response = self.send_bulk([rsa_user.pk, x25519_user.pk, rsa_user.pk], 'annonce')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['count'], 2)
+
+        rows = {msg.recipient_id: msg for msg in EncryptedMessage.objects.select_related('sender')}
+        self.assertEqual(set(rows), {rsa_user.pk, x25519_user.pk})
+        # Un seul chiffrement du message, une enveloppe de clé par destinataire
+        self.assertEqual(bytes(rows[rsa_user.pk].encrypted_message_bin), bytes(rows[x25519_user.pk].encrypted_message_bin))
+        self.assertEqual(len(rows[rsa_user.pk].encrypted_aes_key_bin), 256)
+        for user, keys in ((rsa_user, rsa_keys), (x25519_user, x25519_keys)):
+            self.assertEqual(rows[user.pk].recipient_key_id, keys.active_key_id)
+            self.assertEqual(decrypt_row(keys, rows[user.pk])['message'], 'annonce')
+
+    def test_count(self):
+        response = self.send_bulk([r.pk for r in self.recipients])
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(EncryptedMessage.objects.count(), 3)
+
+    def test_unknown_recipient(self):
+        response = self.send_bulk([self.recipients[0].pk, 999999])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Recipient not found', 'missing': [999999]})
+        self.assertFalse(EncryptedMessage.objects.exists())
+        self.layer.group_send.assert_not_called()
+
+    def test_invalid_requests(self):
+        for recipients, message, error in (
+            ([], 'x', 'recipients must be a non-empty list'),
+            ('1,2', 'x', 'recipients must be a non-empty list'),
+            ([self.recipients[0].pk], None, 'message is required'),
+            (['abc'], 'x', 'recipients must be user ids'),
+        ):
+            with self.subTest(recipients=recipients):
+                response = self.send_bulk(recipients, message)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], error)
+        self.assertFalse(EncryptedMessage.objects.exists())
+
+    @mock.patch('chat.views.BULK_SEND_MAX_RECIPIENTS', 2)
+    def test_too_many_recipients(self):
+        response = self.send_bulk([r.pk for r in self.recipients])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(EncryptedMessage.objects.exists())
+
+    def test_pushes_carry_ids(self):
+        self.assertEqual(self.send_bulk([r.pk for r in self.recipients]).status_code, 201)
+        self.assert_pushed_ids()
+
+    def test_pushes_carry_ids_without_returning(self):
+        # MySQL : bulk_create ne renvoie pas les ids, ils sont relus
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            self.assertEqual(self.send_bulk([r.pk for r in self.recipients]).status_code, 201)
+        self.assert_pushed_ids()
+
+
+class ParseInboxCursorTests(SimpleTestCase):
+    def test_defaults(self):
+        self.assertEqual(parse_inbox_cursor({}), (None, 50))
+        self.assertEqual(parse_inbox_cursor({'after': '', 'limit': ''}), (None, 50))
+
+    def test_values(self):
+        self.assertEqual(parse_inbox_cursor({'after': '12', 'limit': '5'}), (12, 5))
+        self.assertEqual(parse_inbox_cursor({'limit': '100000'}), (None, INBOX_MAX_PAGE_SIZE))
+
+    def test_invalid(self):
+        for params in ({'after': '-1'}, {'after': 'abc'}, {'limit': '0'}, {'limit': '-5'}, {'limit': '1.5'}):
+            with self.subTest(params=params), self.assertRaises(ValueError):
+                parse_inbox_cursor(params)
+
+
+@mock.patch('chat.inbox_cache.INBOX_CACHE_ENABLED', False)
+class InboxPaginationTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, self.keys = make_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def inbox(self, **params):
+        with mock.patch('chat.views.get_unlocked_keys', return_value=self.keys):
+            return self.client.get(reverse('received_encrypted_messages'), params)
+
+    def test_pages(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(5)]
+        self.send(self.user, self.sender, 'ailleurs')
+
+        seen, after = [], None
+        while True:
+            params = {'limit': 2} if after is None else {'limit': 2, 'after': after}
+            response = self.inbox(**params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen += page['results']
+            after = page['next']
+            if after is None:
+                break
+            self.assertEqual(after, page['results'][-1]['id'])
+
+        self.assertEqual([row['id'] for row in seen], sent)
+        self.assertEqual([row['message'] for row in seen], [f'm{i}' for i in range(5)])
+        self.assertEqual({row['from'] for row in seen}, {'sender'})
+
+    def test_same_created_at(self):
+        # Égalité sur created_at : départagée par l'id, sans doublon ni trou
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(4)]
+        EncryptedMessage.objects.filter(id__in=sent).update(created_at=timezone.now())
+        seen, after = [], None
+        while True:
+            messages, has_more = inbox_page(self.user, after=after, limit=1)
+            seen += [msg.id for msg in messages]
+            if not has_more:
+                break
+            after = messages[-1].id
+        self.assertEqual(seen, sent)
+
+    def test_unknown_cursor(self):
+        other = self.send(self.user, self.sender, 'ailleurs').id
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(3)]
+        # Curseur hors de l'inbox (message d'un autre destinataire) : repli sur l'id seul
+        messages, has_more = inbox_page(self.user, after=other, limit=10)
+        self.assertEqual([msg.id for msg in messages], sent)
+        self.assertFalse(has_more)
+        self.assertEqual(inbox_page(self.user, after=sent[-1] + 100, limit=10), ([], False))
+
+    def test_query_count_does_not_grow_with_history(self):
+        for i in range(20):
+            self.send(self.sender, self.user, f'm{i}')
+        after = EncryptedMessage.objects.filter(recipient=self.user).order_by('id').values_list('id', flat=True)[9]
+        # Ancre du curseur + page (expéditeur joint) : pas de requête par ligne
+        with self.assertNumQueries(2):
+            messages, has_more = inbox_page(self.user, after=after, limit=5)
+            senders = [msg.sender.username for msg in messages]
+        self.assertEqual(senders, ['sender'] * 5)
+        self.assertTrue(has_more)
+
+    def test_cursor_index(self):
+        indexes = {index.name: index.fields for index in EncryptedMessage._meta.indexes}
+        self.assertEqual(indexes['chat_inbox_cursor_idx'], ['recipient', 'created_at', 'id'])
+
+    def test_invalid_params(self):
+        response = self.inbox(limit='zero')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+    def test_locked_key(self):
+        with mock.patch('chat.views.get_unlocked_keys', return_value=None):
+            response = self.client.get(reverse('received_encrypted_messages'))
+        self.assertEqual(response.status_code, 403)
+
+
+class EnvelopeInboxTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, self.keys = make_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def inbox(self, **params):
+        return self.client.get(reverse('received_encrypted_messages'), {'mode': 'envelope', **params})
+
+    def test_client_side_decryption(self):
+        sent = self.send(self.sender, self.user, 'chiffré de bout en bout')
+        # Aucun déchiffrement côté serveur : ni clé déverrouillée ni decrypt_row
+        with mock.patch('chat.views.get_unlocked_keys', return_value=None) as unlocked, \
+                mock.patch('chat.views.decrypt_row', side_effect=AssertionError) as decrypt:
+            response = self.inbox()
+        unlocked.assert_not_called()
+        decrypt.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+
+        [row] = response.json()['results']
+        self.assertEqual(row['id'], sent.id)
+        self.assertEqual((row['sender'], row['sender_username'], row['recipient']), (self.sender.pk, 'sender', self.user.pk))
+        self.assertEqual(row['key_id'], self.keys.active_key_id)
+        self.assertEqual(row['version'], sent.version)
+        self.assertNotIn('message', row)
+
+        aes_key = unwrap_aes_key(self.keys.for_key(row['key_id']), b64decode(row['encrypted_aes_key']))
+        plaintext = decrypt_payload(aes_key, b64decode(row['iv']), b64decode(row['encrypted_message']))
+        self.assertEqual(plaintext.decode(), 'chiffré de bout en bout')
+
+    def test_pagination(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(3)]
+        first = self.inbox(limit=2).json()
+        self.assertEqual([row['id'] for row in first['results']], sent[:2])
+        self.assertEqual(first['next'], sent[1])
+        second = self.inbox(limit=2, after=first['next']).json()
+        self.assertEqual([row['id'] for row in second['results']], sent[2:])
+        self.assertIsNone(second['next'])
+
+    def test_same_rows_as_decrypted_mode(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(3)]
+        with mock.patch('chat.views.get_unlocked_keys', return_value=self.keys):
+            decrypted = self.client.get(reverse('received_encrypted_messages')).json()
+        self.assertEqual([row['id'] for row in decrypted['results']], sent)
+        self.assertEqual([row['id'] for row in self.inbox().json()['results']], sent)
+
+    def test_unknown_mode(self):
+        response = self.inbox(mode='clair')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'mode must be one of decrypted, envelope'})
+
+
+class StreamInboxTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, self.keys = make_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stream(self, **params):
+        with mock.patch('chat.views.get_unlocked_keys', return_value=self.keys):
+            response = self.client.get(reverse('stream_encrypted_messages'), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            return json.loads(b''.join(response.streaming_content))
+
+    def test_stream_json_array(self):
+        self.assertEqual(''.join(stream_json_array([])), '[]')
+        # Encodeur de Django : les dates sortent en ISO 8601
+        at = timezone.now().replace(microsecond=0)
+        items = json.loads(''.join(stream_json_array(iter([{'a': 1}, {'b': at}]))))
+        self.assertEqual(items, [{'a': 1}, {'b': at.isoformat().replace('+00:00', 'Z')}])
+
+    def test_decrypted(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(5)]
+        self.send(self.user, self.sender, 'ailleurs')
+        rows = self.stream()
+        self.assertEqual([row['id'] for row in rows], sent)
+        self.assertEqual([row['message'] for row in rows], [f'm{i}' for i in range(5)])
+        self.assertEqual([row['id'] for row in self.stream(after=sent[2])], sent[3:])
+
+    def test_envelope(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(3)]
+        with mock.patch('chat.views.decrypt_row', side_effect=AssertionError):
+            rows = self.stream(mode='envelope')
+        self.assertEqual([row['id'] for row in rows], sent)
+        self.assertTrue(all('encrypted_message' in row for row in rows))
+
+    def test_keyset_batches(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(5)]
+        # Une requête par paquet : 2 + 2 + 1 lignes
+        with self.assertNumQueries(3):
+            self.assertEqual([msg.id for msg in iter_inbox(self.user, batch_size=2)], sent)
+        # Dernier paquet plein : une requête de plus, vide
+        with self.assertNumQueries(3):
+            self.assertEqual([msg.id for msg in iter_inbox(self.user, after=sent[0], batch_size=2)], sent[1:])
+
+    def test_lazy(self):
+        for i in range(4):
+            self.send(self.sender, self.user, f'm{i}')
+        messages = iter_inbox(self.user, batch_size=2)
+        # Rien n'est lu avant la consommation, puis un paquet à la fois
+        with self.assertNumQueries(1):
+            next(messages)
+            next(messages)
+
+    def test_row_error_does_not_abort_the_stream(self):
+        sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(3)]
+        EncryptedMessage.objects.filter(id=sent[1]).update(encrypted_message_bin=b'\x02' + b'\x00' * 40)
+        rows = self.stream()
+        self.assertEqual([row['id'] for row in rows], sent)
+        self.assertEqual(rows[0]['message'], 'm0')
+        self.assertTrue(rows[1]['error'].startswith('Erreur de déchiffrement'))
+        self.assertEqual(rows[2]['message'], 'm2')
+
+    def test_locked_key(self):
+        with mock.patch('chat.views.get_unlocked_keys', return_value=None):
+            response = self.client.get(reverse('stream_encrypted_messages'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(reverse('stream_encrypted_messages'), {'after': 'x'}).status_code, 400)
+
+
+@mock.patch('chat.views.INBOX_DECRYPT_CHUNK_SIZE', 2)
+@mock.patch('chat.views.INBOX_DECRYPT_WORKERS', 3)
+class ParallelDecryptTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, self.keys = make_user('user')
+        self.sent = [self.send(self.sender, self.user, f'm{i}').id for i in range(9)]
+        self.messages = list(inbox_queryset(self.user))
+        self.executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='test-decrypt')
+        self.addCleanup(self.executor.shutdown)
+        patcher = mock.patch('chat.views.get_decrypt_executor', return_value=self.executor)
+        self.get_executor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_order_is_stable(self):
+        threads = set()
+
+        def record(keys, msg, session_keys=None):
+            threads.add(threading.current_thread().name)
+            if msg.id == self.sent[0]:
+                # Le premier paquet finit après les suivants
+                time.sleep(0.05)
+            return {'id': msg.id}
+
+        with mock.patch('chat.views.decrypt_row', side_effect=record):
+            rows = decrypt_inbox(self.keys, self.messages)
+        self.assertEqual([row['id'] for row in rows], self.sent)
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('test-decrypt') for name in threads))
+
+    def test_decrypts(self):
+        rows = decrypt_inbox(self.keys, self.messages)
+        self.assertEqual([row['message'] for row in rows], [f'm{i}' for i in range(9)])
+        self.get_executor.assert_called_once()
+
+    def test_row_errors(self):
+        EncryptedMessage.objects.filter(id__in=self.sent[3:5]).update(encrypted_message_bin=b'\x02' + b'\x00' * 40)
+        rows = decrypt_inbox(self.keys, list(inbox_queryset(self.user)))
+        self.assertEqual([row['id'] for row in rows], self.sent)
+        self.assertEqual([i for i, row in enumerate(rows) if 'error' in row], [3, 4])
+        self.assertEqual(rows[5]['message'], 'm5')
+
+    def test_small_or_serial_fetch_stays_in_thread(self):
+        self.assertEqual(len(decrypt_inbox(self.keys, self.messages[:2])), 2)
+        with mock.patch('chat.views.INBOX_DECRYPT_WORKERS', 1):
+            self.assertEqual(len(decrypt_inbox(self.keys, self.messages)), 9)
+        self.get_executor.assert_not_called()
+
+    def test_iterator_is_consumed_with_backpressure(self):
+        pulled = []
+
+        def messages():
+            for msg in self.messages:
+                pulled.append(msg.id)
+                yield msg
+
+        with mock.patch('chat.views.INBOX_DECRYPT_CHUNK_SIZE', 1):
+            rows = decrypt_rows(self.keys, messages())
+            self.assertEqual(next(rows)['id'], self.sent[0])
+        # 2 * INBOX_DECRYPT_WORKERS paquets d'une ligne lus d'avance, pas plus
+        self.assertEqual(len(pulled), 6)
+        self.assertEqual([row['id'] for row in rows], self.sent[1:])
+
+    def test_spans_reach_the_request_profile(self):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            decrypt_inbox(self.keys, self.messages)
+        finally:
+            _current_profile.reset(token)
+        self.assertEqual(profile.spans['decrypt'][0], 9)
+
+
+class SyncTokenTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, _ = make_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, token=None):
+        params = {'mode': 'envelope'}
+        if token is not None:
+            params['token'] = token
+        return self.client.get(reverse('sync_encrypted_messages'), params)
+
+    def test_round_trip(self):
+        self.assertEqual(read_sync_token(self.user, make_sync_token(self.user, 42)), 42)
+        self.assertEqual(read_sync_token(self.user, None), 0)
+        self.assertEqual(read_sync_token(self.user, ''), 0)
+
+    def test_tampered(self):
+        token = make_sync_token(self.user, 42)
+        payload, _, signature = token.rpartition(':')
+        forged = signing.dumps({'u': self.user.pk, 'm': 0}, salt=SYNC_TOKEN_SALT).rpartition(':')[0] + ':' + signature
+        for bad in (token[:-1] + ('A' if token[-1] != 'A' else 'B'), forged, 'garbage', payload):
+            with self.subTest(token=bad), self.assertRaises(InvalidSyncToken):
+                read_sync_token(self.user, bad)
+
+    def test_other_user(self):
+        with self.assertRaises(InvalidSyncToken):
+            read_sync_token(self.user, make_sync_token(self.sender, 42))
+
+    def test_other_salt(self):
+        with self.assertRaises(InvalidSyncToken):
+            read_sync_token(self.user, signing.dumps({'u': self.user.pk, 'm': 42}))
+
+    def test_tampered_token_is_rejected_by_the_view(self):
+        response = self.sync(make_sync_token(self.user, 1)[:-2] + 'xx')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid sync token'})
+
+    def test_incremental_sync(self):
+        first = [self.send(self.sender, self.user, f'm{i}').id for i in range(3)]
+        response = self.sync().json()
+        self.assertEqual([row['id'] for row in response['results']], first)
+        self.assertEqual(response['delivered_up_to'], first[-1])
+
+        token = response['sync_token']
+        self.assertEqual(self.sync(token).json()['results'], [])
+        latest = self.send(self.sender, self.user, 'm3').id
+        response = self.sync(token).json()
+        self.assertEqual([row['id'] for row in response['results']], [latest])
+
+
+@mock.patch('chat.inbox_cache.INBOX_CACHE_ROWS', 5)
+class InboxCacheTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, _ = make_user('user')
+
+    def entry(self):
+        return inbox_cache.get_cache().get(inbox_cache._key(self.user.pk))
+
+    def page(self, after=None, limit=3):
+        result = inbox_cache.get_page(self.user, after, limit)
+        return None if result is None else ([msg.id for msg in result[0]], result[1])
+
+    def expected(self, after=None, limit=3):
+        ids = [msg.id for msg in inbox_queryset(self.user)]
+        ids = [i for i in ids if after is None or i > after]
+        return ids[:limit], len(ids) > limit
+
+    def test_small_inbox_is_fully_cached(self):
+        ids = [self.send(self.sender, self.user).id for _ in range(4)]
+        self.assertEqual(self.page(), self.expected())
+        self.assertEqual(self.entry()['floor'], 0)
+        expected = self.expected(ids[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page(ids[1]), expected)
+            self.assertEqual(self.page(ids[-1]), ([], False))
+
+    def test_first_page_of_large_inbox_is_cached(self):
+        ids = [self.send(self.sender, self.user).id for _ in range(12)]
+        self.page()
+        entry = self.entry()
+        # Fenêtre récente : les 5 derniers ; fenêtre ancienne : les 5 premiers
+        self.assertEqual(entry['floor'], ids[6])
+        self.assertEqual([row[0] for row in entry['rows']], ids[7:])
+        self.assertEqual([row[0] for row in entry['head']], ids[:5])
+        self.assertEqual(entry['ceiling'], ids[4])
+
+        expected = [self.expected(), self.expected(ids[0]), self.expected(ids[8])]
+        with self.assertNumQueries(0):
+            self.assertEqual([self.page(), self.page(ids[0]), self.page(ids[8])], expected)
+        # Pages entre les deux fenêtres : lues en base
+        self.assertIsNone(self.page(ids[2]))
+        self.assertIsNone(self.page(ids[5]))
+
+    def test_append_moves_rows_to_head(self):
+        ids = [self.send(self.sender, self.user).id for _ in range(4)]
+        self.page()
+        ids += [self.send(self.sender, self.user).id for _ in range(4)]
+        entry = self.entry()
+        self.assertEqual([row[0] for row in entry['rows']], ids[3:])
+        self.assertEqual([row[0] for row in entry['head']], ids[:3])
+        self.assertEqual((entry['ceiling'], entry['floor']), (ids[2], ids[2]))
+        # Fenêtres contiguës : une page à cheval sur les deux est servie du cache
+        expected = [self.expected(), self.expected(ids[1]), self.expected(ids[4])]
+        with self.assertNumQueries(0):
+            self.assertEqual([self.page(), self.page(ids[1]), self.page(ids[4])], expected)
+
+    def test_append_without_entry_is_ignored(self):
+        self.send(self.sender, self.user)
+        self.assertIsNone(self.entry())
+
+    def test_byte_budget(self):
+        for _ in range(4):
+            self.send(self.sender, self.user, os.urandom(300).hex())
+        size = inbox_cache._row_size(inbox_cache._pack(EncryptedMessage.objects.select_related('sender').first()))
+        with mock.patch('chat.inbox_cache.INBOX_CACHE_WINDOW_BYTES', 2 * size):
+            self.page()
+        entry = self.entry()
+        self.assertEqual(len(entry['rows']), 2)
+        self.assertEqual(len(entry['head']), 2)
+        self.assertEqual(self.page(limit=1), self.expected(limit=1))
+
+    def test_invalidate(self):
+        msgs = [self.send(self.sender, self.user) for _ in range(3)]
+        self.page()
+        EncryptedMessage.objects.filter(pk=msgs[0].pk).delete()
+        inbox_cache.invalidate([self.user.pk])
+        self.assertIsNone(self.entry())
+        self.assertEqual(self.page(), self.expected())
+        self.assertNotIn(msgs[0].pk, self.page()[0])
+
+    def test_unknown_ids_invalidate(self):
+        # bulk_create sans RETURNING (MySQL) : ids inconnus, l'entrée est oubliée
+        self.send(self.sender, self.user)
+        self.page()
+        msg = EncryptedMessage(sender=self.sender, recipient=self.user, **seal_message(self.user, 'x'))
+        with self.captureOnCommitCallbacks(execute=True):
+            inbox_cache.append_messages([msg])
+        self.assertIsNone(self.entry())
+
+    def test_append_runs_after_commit_only(self):
+        self.send(self.sender, self.user)
+        self.page()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            msg = EncryptedMessage.objects.create(sender=self.sender, recipient=self.user, **seal_message(self.user, 'x'))
+            inbox_cache.append_messages([msg])
+        self.assertNotIn(msg.id, [row[0] for row in self.entry()['rows']])
+        callbacks[0]()
+        self.assertIn(msg.id, [row[0] for row in self.entry()['rows']])
+
+
+class RetentionTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        session_key_cache.clear()
+        self.addCleanup(session_key_cache.clear)
+        self.now = timezone.now()
+        self.sender, self.sender_keys = make_user('sender')
+        self.user, self.keys = make_user('user')
+        self.other, _ = make_user('other')
+
+    def aged(self, msg, **delta):
+        EncryptedMessage.objects.filter(pk=msg.pk).update(created_at=self.now - timedelta(**delta))
+        return msg
+
+    def policy(self, user, days, action=RetentionPolicy.ACTION_ARCHIVE):
+        RetentionPolicy.objects.create(user=user, retention_days=days, action=action)
+
+    def expired_ids(self):
+        return {label.split(' (')[0]: sorted(qs.values_list('id', flat=True)) for label, qs, _ in retention.expired_querysets(self.now)}
+
+    def run_all(self, batch_size=retention.RETENTION_BATCH_SIZE):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _, queryset, action in retention.expired_querysets(self.now):
+                while retention.process_batch(queryset, action, batch_size):
+                    pass
+
+    def test_cutoff_boundary(self):
+        self.policy(self.user, 30)
+        on_cutoff = self.aged(self.send(self.sender, self.user), days=30)
+        past_cutoff = self.aged(self.send(self.sender, self.user), days=30, microseconds=1)
+        self.aged(self.send(self.sender, self.user), days=29)
+        # Strictement plus vieux que la politique : la ligne pile à la limite reste
+        self.assertEqual(self.expired_ids(), {'user user': [past_cutoff.id]})
+        self.assertTrue(EncryptedMessage.objects.filter(pk=on_cutoff.pk, created_at=self.now - timedelta(days=30)).exists())
+
+    def test_archive_policy(self):
+        self.policy(self.user, 30)
+        old = self.aged(self.send(self.sender, self.user, 'vieux'), days=31)
+        recent = self.send(self.sender, self.user, 'récent')
+        self.run_all()
+        self.assertEqual(list(EncryptedMessage.objects.values_list('id', flat=True)), [recent.id])
+        archived = ArchivedMessage.objects.get()
+        self.assertEqual((archived.id, archived.recipient_id), (old.id, self.user.pk))
+        self.assertEqual(bytes(archived.encrypted_message_bin), bytes(old.encrypted_message_bin))
+
+    def test_delete_policy(self):
+        self.policy(self.user, 30, RetentionPolicy.ACTION_DELETE)
+        self.aged(self.send(self.sender, self.user), days=31)
+        self.run_all()
+        self.assertFalse(EncryptedMessage.objects.exists())
+        self.assertFalse(ArchivedMessage.objects.exists())
+
+    @mock.patch('chat.retention.MESSAGE_RETENTION_DAYS', 10)
+    @mock.patch('chat.retention.MESSAGE_RETENTION_ACTION', RetentionPolicy.ACTION_DELETE)
+    def test_user_policy_overrides_global(self):
+        # Politique propre « garder indéfiniment » : exclue de la politique globale
+        RetentionPolicy.objects.create(user=self.user, retention_days=None)
+        kept = self.aged(self.send(self.sender, self.user), days=400)
+        expired = self.aged(self.send(self.sender, self.other), days=11)
+        self.assertEqual(self.expired_ids(), {'global': [expired.id]})
+        self.run_all()
+        self.assertEqual(list(EncryptedMessage.objects.values_list('id', flat=True)), [kept.id])
+        self.assertFalse(ArchivedMessage.objects.exists())
+
+    def test_batches(self):
+        self.policy(self.user, 30)
+        ids = [self.aged(self.send(self.sender, self.user), days=31).id for _ in range(5)]
+        [(_, queryset, action)] = retention.expired_querysets(self.now)
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = [retention.process_batch(queryset, action, 2) for _ in range(4)]
+        self.assertEqual(counts, [2, 2, 1, 0])
+        self.assertEqual(sorted(ArchivedMessage.objects.values_list('id', flat=True)), ids)
+
+    def test_already_archived_batch_is_deleted(self):
+        # Lot archivé puis interrompu avant la suppression : repris sans doublon
+        self.policy(self.user, 30)
+        old = self.aged(self.send(self.sender, self.user), days=31)
+        ArchivedMessage.objects.bulk_create([retention.archived_copy(EncryptedMessage.objects.get(pk=old.pk))])
+        self.run_all()
+        self.assertFalse(EncryptedMessage.objects.exists())
+        self.assertEqual(ArchivedMessage.objects.get().id, old.id)
+
+    def test_command(self):
+        self.policy(self.user, 30)
+        for _ in range(5):
+            self.aged(self.send(self.sender, self.user), days=31)
+        out = io.StringIO()
+        call_command('apply_retention', '--dry-run', stdout=out)
+        self.assertIn('user user (30d, archive): 5 message(s) to archive', out.getvalue())
+
+        out = io.StringIO()
+        call_command('apply_retention', '--batch-size', '2', '--max-batches', '1', stdout=out)
+        self.assertIn('2 message(s) processed in 1 batch(es)', out.getvalue())
+        out = io.StringIO()
+        call_command('apply_retention', '--batch-size', '2', stdout=out)
+        self.assertIn('3 message(s) processed in 2 batch(es)', out.getvalue())
+        self.assertEqual(ArchivedMessage.objects.count(), 5)
+
+    def test_inbox_cache_is_invalidated(self):
+        self.policy(self.user, 30)
+        self.aged(self.send(self.sender, self.user), days=31)
+        recent = self.send(self.sender, self.user)
+        inbox_cache.get_page(self.user)
+        self.assertIsNotNone(inbox_cache.get_cache().get(inbox_cache._key(self.user.pk)))
+        self.run_all()
+        self.assertIsNone(inbox_cache.get_cache().get(inbox_cache._key(self.user.pk)))
+        self.assertEqual([msg.id for msg in inbox_cache.get_page(self.user)[0]], [recent.id])
+
+    def test_archived_messages_decrypt(self):
+        self.policy(self.user, 30)
+        direct = EncryptedMessage.objects.create(sender=self.sender, recipient=self.user, **seal_message(self.user, 'direct'))
+        session, session_key = conversation_key_for_send(self.sender, self.user, self.sender_keys)
+        in_session = EncryptedMessage.objects.create(
+            sender=self.sender, recipient=self.user, **seal_message(self.user, 'en session', session, session_key)
+        )
+        for msg in (direct, in_session):
+            self.aged(msg, days=31)
+        self.run_all()
+        # L'archive porte la clé de session enveloppée : la session peut disparaître
+        ConversationSession.objects.all().delete()
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('chat.views.get_unlocked_keys', return_value=self.keys):
+            response = client.get(reverse('archived_encrypted_messages'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['message'] for row in response.json()['results']], ['direct', 'en session'])
+
+        response = client.get(reverse('archived_encrypted_messages'), {'mode': 'envelope'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [direct.id, in_session.id])
+
+    def test_archive_requires_unlocked_keys(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(reverse('archived_encrypted_messages')).status_code, 403)
+
+
+class AsyncViewTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, self.sender_keys = make_user('sender')
+        self.user, self.keys = make_user('user')
+        self.client = AsyncClient()
+        self.layer = mock.Mock()
+        patcher = mock.patch('chat.realtime.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def unlocked(self, keys):
+        return mock.patch('chat.async_views.get_unlocked_keys', return_value=keys)
+
+    def bearer(self, user):
+        # En-têtes par requête : ceux du constructeur d'AsyncClient ne sont pas vus par ASGIRequest
+        return {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+    def inbox(self, **params):
+        return self.client.get(reverse('async_received_encrypted_messages'), params, headers=self.bearer(self.user))
+
+    def send_as(self, user, body, **kwargs):
+        return self.client.post(
+            reverse('async_send_encrypted_message'), body, content_type='application/json',
+            headers=self.bearer(user), **kwargs
+        )
+
+    async def test_unauthenticated(self):
+        url = reverse('async_received_encrypted_messages')
+        self.assertEqual((await self.client.get(url)).status_code, 401)
+        response = await self.client.get(url, headers={'Authorization': 'Bearer invalide'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_send_then_read(self):
+        with self.unlocked(self.sender_keys):
+            for text in ('un', 'deux', 'trois'):
+                response = await self.send_as(self.sender, {'recipient': self.user.pk, 'message': text})
+                self.assertEqual(response.status_code, 201)
+
+        with self.unlocked(self.keys):
+            first = (await self.inbox(limit=2)).json()
+            self.assertEqual([row['message'] for row in first['results']], ['un', 'deux'])
+            self.assertEqual(first['next'], first['results'][-1]['id'])
+            second = (await self.inbox(limit=2, after=first['next'])).json()
+        self.assertEqual([row['message'] for row in second['results']], ['trois'])
+        self.assertIsNone(second['next'])
+        self.assertEqual({row['from'] for row in first['results'] + second['results']}, {'sender'})
+
+    async def test_send_errors(self):
+        response = await self.send_as(self.sender, b'{')
+        self.assertEqual(response.status_code, 400)
+        with self.unlocked(self.sender_keys):
+            response = await self.send_as(self.sender, {'recipient': 999999, 'message': 'x'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(await EncryptedMessage.objects.aexists())
+
+    async def test_envelope_mode_needs_no_key(self):
+        await sync_to_async(self.send)(self.sender, self.user, 'enveloppe')
+        with self.unlocked(None):
+            response = await self.inbox(mode='envelope')
+            self.assertEqual(response.status_code, 200)
+            [row] = response.json()['results']
+            self.assertEqual(row['sender_username'], 'sender')
+            self.assertIn('encrypted_message', row)
+            self.assertNotIn('message', row)
+            # Mode déchiffré : clé verrouillée
+            response = await self.inbox()
+        self.assertEqual(response.status_code, 403)
+
+    async def test_invalid_cursor(self):
+        self.assertEqual((await self.inbox(after='-3')).status_code, 400)
+        self.assertEqual((await self.inbox(mode='clair')).status_code, 400)
+
+
+class AsyncLoadTestCommandTests(SimpleTestCase):
+    def test_requires_recipient_for_send(self):
+        with self.assertRaisesMessage(CommandError, '--recipient is required'):
+            call_command('loadtest_async', '--username', 'a', '--password', 'b', '--endpoint', 'send')
+
+    def test_compares_sync_and_async(self):
+        calls = []
+
+        async def fake_request(host, port, method, path, headers=None, body=None, slow=0.0):
+            calls.append((method, path, (headers or {}).get('Authorization')))
+            if path == '/api/users/login/':
+                return 200, b'{"access": "jeton"}'
+            return 200, b'{}'
+
+        out = io.StringIO()
+        with mock.patch('chat.management.commands.loadtest_async.http_request', fake_request):
+            call_command(
+                'loadtest_async', '--username', 'a', '--password', 'b', '--endpoint', 'send',
+                '--recipient', '2', '--requests', '4', '--concurrency', '2', stdout=out,
+            )
+        self.assertEqual(calls[0], ('POST', '/api/users/login/', None))
+        self.assertEqual(
+            sorted(set(calls[1:])),
+            [('POST', '/api/messages/async/send/', 'Bearer jeton'), ('POST', '/api/messages/send/', 'Bearer jeton')]
+        )
+        self.assertEqual(len(calls), 9)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(' sync send: 4/4 ok'))
+        self.assertTrue(lines[1].startswith('async send: 4/4 ok'))
+
+    def test_login_failure(self):
+        async def fake_request(*args, **kwargs):
+            return 401, b'{"detail": "nope"}'
+
+        with mock.patch('chat.management.commands.loadtest_async.http_request', fake_request):
+            with self.assertRaisesMessage(CommandError, 'Login failed (401)'):
+                call_command('loadtest_async', '--username', 'a', '--password', 'b')
+
+    def test_http_request(self):
+        received = []
+
+        async def handle(reader, writer):
+            received.append(await reader.readuntil(b'\r\n\r\n'))
+            received.append(await reader.readexactly(8))
+            writer.write(b'HTTP/1.0 201 Created\r\nContent-Type: application/json\r\n\r\n{"ok": true}')
+            await writer.drain()
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await http_request('127.0.0.1', port, 'POST', '/x/', {'X-Test': '1'}, {'a': 1})
+
+        self.assertEqual(asyncio.run(main()), (201, b'{"ok": true}'))
+        head = received[0].decode()
+        self.assertTrue(head.startswith('POST /x/ HTTP/1.0\r\n'))
+        self.assertIn('X-Test: 1\r\n', head)
+        self.assertIn('Content-Length: 8\r\n', head)
+        self.assertEqual(received[1], b'{"a": 1}')
+
+
+class InMemoryChannelLayerTests(SimpleTestCase):
+    def test_group_send(self):
+        async def main():
+            layer = InMemoryChannelLayer()
+            first, second, other = layer.subscribe('user.1'), layer.subscribe('user.1'), layer.subscribe('user.2')
+            self.assertEqual(layer.group_send('user.1', {'n': 1}), 2)
+            self.assertEqual(await asyncio.wait_for(first.get(), 1), {'n': 1})
+            self.assertEqual(await asyncio.wait_for(second.get(), 1), {'n': 1})
+            self.assertTrue(other.empty())
+
+            layer.unsubscribe('user.1', first)
+            layer.unsubscribe('user.1', second)
+            self.assertEqual(layer.group_send('user.1', {'n': 2}), 0)
+            self.assertEqual(layer._groups.keys(), {'user.2'})
+
+        asyncio.run(main())
+
+    def test_send_from_another_thread(self):
+        async def main():
+            layer = InMemoryChannelLayer()
+            queue = layer.subscribe(user_group(7))
+            # Appel depuis une vue sync (thread de WSGI ou de sync_to_async)
+            await asyncio.to_thread(layer.group_send, user_group(7), {'n': 1})
+            return await asyncio.wait_for(queue.get(), 1)
+
+        self.assertEqual(asyncio.run(main()), {'n': 1})
+
+    def test_slow_subscriber_drops_events(self):
+        async def main():
+            layer = InMemoryChannelLayer(capacity=2)
+            queue = layer.subscribe('user.1')
+            for n in range(4):
+                layer.group_send('user.1', {'n': n})
+            await asyncio.sleep(0)
+            return layer, [queue.get_nowait() for _ in range(queue.qsize())]
+
+        layer, events = asyncio.run(main())
+        self.assertEqual(events, [{'n': 0}, {'n': 1}])
+        self.assertEqual(layer.dropped, 2)
+
+
+class WebSocketTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender, _ = make_user('sender')
+        self.user, _ = make_user('user')
+        self.layer = InMemoryChannelLayer()
+        patcher = mock.patch('chat.realtime.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, token, path=WEBSOCKET_PATH):
+        """Démarre la socket ; retourne (tâche, entrée client, sortie serveur, premier événement)."""
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'query_string': f'token={token}'.encode()}
+        task = asyncio.ensure_future(websocket_application(scope, incoming.get, outgoing.put))
+        await incoming.put({'type': 'websocket.connect'})
+        return task, incoming, outgoing, await asyncio.wait_for(outgoing.get(), 5)
+
+    def publish(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            msg = EncryptedMessage.objects.create(sender=self.sender, recipient=self.user, **seal_message(self.user, text))
+            publish_messages([msg])
+        return msg
+
+    async def test_push(self):
+        task, incoming, outgoing, accepted = await self.connect(AccessToken.for_user(self.user))
+        self.assertEqual(accepted, {'type': 'websocket.accept'})
+
+        msg = await sync_to_async(self.publish)('en direct')
+        event = await asyncio.wait_for(outgoing.get(), 5)
+        self.assertEqual(event['type'], 'websocket.send')
+        pushed = json.loads(event['text'])
+        self.assertEqual(pushed['type'], 'message')
+        self.assertEqual((pushed['message']['id'], pushed['message']['sender_username']), (msg.id, 'sender'))
+        self.assertIn('encrypted_message', pushed['message'])
+
+        # Messages du client ignorés, puis déconnexion : désabonné
+        await incoming.put({'type': 'websocket.receive', 'text': 'ping'})
+        await incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(task, 5)
+        self.assertTrue(outgoing.empty())
+        self.assertEqual(self.layer._groups, {})
+
+    async def test_other_users_messages_are_not_pushed(self):
+        task, incoming, outgoing, _ = await self.connect(AccessToken.for_user(self.sender))
+        await sync_to_async(self.publish)('pas pour toi')
+        await asyncio.sleep(0.05)
+        self.assertTrue(outgoing.empty())
+        await incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(task, 5)
+
+    async def test_invalid_token(self):
+        for token in ('', 'invalide'):
+            with self.subTest(token=token):
+                task, _, _, closed = await self.connect(token)
+                self.assertEqual(closed, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+                await asyncio.wait_for(task, 5)
+        self.assertEqual(self.layer._groups, {})
+
+    async def test_unknown_path(self):
+        task, _, _, closed = await self.connect(AccessToken.for_user(self.user), path='/ws/autre/')
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        await asyncio.wait_for(task, 5)
+
+
+class ProtocolRouterTests(SimpleTestCase):
+    def test_routes_by_scope_type(self):
+        calls = []
+
+        def app(name):
+            async def application(scope, receive, send):
+                calls.append(name)
+            return application
+
+        router = ProtocolRouter({'http': app('http'), 'websocket': app('websocket')})
+        asyncio.run(router({'type': 'websocket'}, None, None))
+        asyncio.run(router({'type': 'http'}, None, None))
+        self.assertEqual(calls, ['websocket', 'http'])
+        with self.assertRaisesMessage(ValueError, "No application configured for scope type 'lifespan'"):
+            asyncio.run(router({'type': 'lifespan'}, None, None))
+
+    def test_asgi_application(self):
+        from securechat.asgi import application
+
+        self.assertIsInstance(application, ProtocolRouter)
+        self.assertIs(application.applications['websocket'], websocket_application)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoadTestCommandTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        shared_keyring().clear()
+        self.addCleanup(shared_keyring().clear)
+        keyring.keyring.clear()
+        # PBKDF2 allégé, dans le processus de test
+        pool = CryptoWorkerPool(max_workers=0)
+        for patcher in (
+            mock.patch('users.utils.crypto_pool', pool),
+            mock.patch('users.serializers.crypto_pool', pool),
+            mock.patch('users.utils.PRIVATE_KEY_KDF_ITERATIONS', 1000),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def loadtest(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command(
+            'loadtest', '--users', '3', '--messages', '6', '--requests', '20', '--seed', '1', *args,
+            stdout=out, stderr=err,
+        )
+        return out.getvalue()
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('send=2,inbox'), {'send': 2.0, 'inbox': 1.0})
+        with self.assertRaisesMessage(CommandError, "Unknown operation in --mix: 'delete'"):
+            parse_mix('send=1,delete=1')
+
+    def test_zipf_weights(self):
+        weights = zipf_weights(4, 1.0)
+        self.assertEqual(weights, [1.0, 0.5, 1 / 3, 0.25])
+
+    def test_json_report(self):
+        report = json.loads(self.loadtest('--json', '--mix', 'register=1,login=1,send=2,inbox=4'))
+        self.assertEqual((report['users'], report['messages'], report['requests']), (3, 6, 20))
+        self.assertEqual(report['database'], connection.vendor)
+        endpoints = report['endpoints']
+        self.assertEqual(sum(data['requests'] for data in endpoints.values()), 20)
+        for op, data in endpoints.items():
+            with self.subTest(op=op):
+                self.assertEqual(data['errors'], 0)
+                self.assertLessEqual(data['p50_ms'], data['p99_ms'])
+                self.assertGreater(data['queries_max'], 0)
+        # Données du run supprimées (utilisateurs inscrits pendant le rejeu compris)
+        self.assertFalse(CustomUser.objects.exists())
+        self.assertFalse(EncryptedMessage.objects.exists())
+
+    def test_keep_and_key_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'keys.json')
+            output = self.loadtest('--mix', 'inbox=1', '--keep', '--key-cache', path)
+            with open(path) as f:
+                self.assertEqual(len(json.load(f)), 3)
+            # Clés relues depuis le cache au run suivant
+            with mock.patch('chat.management.commands.loadtest.generate_rsa_key_pair') as generate:
+                self.loadtest('--mix', 'inbox=1', '--key-cache', path)
+            generate.assert_not_called()
+
+        self.assertTrue(output.startswith('20 requests in '))
+        self.assertIn('inbox', output)
+        self.assertEqual(CustomUser.objects.count(), 3)
+        self.assertEqual(EncryptedMessage.objects.count(), 6)
@@ -0,0 +1,77 @@
+"""
+Envoi de pièces jointes en ``multipart/form-data`` sans fichier temporaire.
+
+Les handlers par défaut de Django écrivent tout fichier de plus de
+``FILE_UPLOAD_MAX_MEMORY_SIZE`` (2,5 Mo) en clair sur le disque, avant que la
+vue n'en vérifie la taille. ``EncryptingUploadHandler`` chiffre au contraire
+chaque bloc reçu vers le blob store (cf. chat.attachments.AttachmentWriter)
+et coupe l'envoi dès que ``ATTACHMENT_MAX_SIZE`` est dépassé.
+"""
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.http.multipartparser import MultiPartParser as DjangoMultiPartParser, MultiPartParserError
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+from .attachments import AttachmentWriter
+
+ATTACHMENT_FIELD = 'file'
+
+
+class EncryptedUpload(UploadedFile):
+    """Fichier reçu, déjà chiffré dans le blob store : seul le manifeste reste à créer."""
+
+    def __init__(self, writer, name, content_type):
+        super().__init__(file=None, name=name, content_type=content_type, size=writer.size)
+        self.writer = writer
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Chiffre le champ ``file`` à la volée ; tout autre fichier (ou un second
+    ``file``) est ignoré.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.writer = None
+        self.done = False
+
+    def new_file(self, field_name, *args, **kwargs):
+        if field_name != ATTACHMENT_FIELD or self.done:
+            raise SkipFile()
+        super().new_file(field_name, *args, **kwargs)
+        self.writer = AttachmentWriter()
+
+    def receive_data_chunk(self, raw_data, start):
+        # AttachmentTooLarge remonte jusqu'à la vue (le blob est déjà abandonné)
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.writer.close()
+        self.done = True
+        return EncryptedUpload(self.writer, self.file_name, self.content_type)
+
+    def upload_interrupted(self):
+        if self.writer is not None and not self.done:
+            self.writer.abort()
+
+
+class EncryptedMultiPartParser(MultiPartParser):
+    """``MultiPartParser`` dont les fichiers passent par ``EncryptingUploadHandler``."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+
+        try:
+            parser = DjangoMultiPartParser(meta, stream, [EncryptingUploadHandler(request)], encoding)
+            data, files = parser.parse()
+            return DataAndFiles(data, files)
+        except MultiPartParserError as exc:
+            raise ParseError('Multipart form parse error - %s' % str(exc))
@@ -1,7 +1,20 @@
 from django.urls import path
-from .views import SendEncryptedMessageView, ReceivedMessagesView
+from .views import (
+    SendEncryptedMessage, SendBulkEncryptedMessage, ReadEncryptedMessages, StreamEncryptedMessages,
+    ArchivedEncryptedMessages, SyncEncryptedMessages, MarkMessagesRead, EncryptedAttachments, DownloadAttachment,
+)
+from .async_views import AsyncSendEncryptedMessage, AsyncReadEncryptedMessages
 
 urlpatterns = [
-    path('send/', SendEncryptedMessageView.as_view(), name='send_encrypted_message'),
-    path('inbox/', ReceivedMessagesView.as_view(), name='received_encrypted_messages'),
+    path('send/', SendEncryptedMessage.as_view(), name='send_encrypted_message'),
+    path('send/bulk/', SendBulkEncryptedMessage.as_view(), name='send_bulk_encrypted_message'),
+    path('inbox/', ReadEncryptedMessages.as_view(), name='received_encrypted_messages'),
+    path('inbox/stream/', StreamEncryptedMessages.as_view(), name='stream_encrypted_messages'),
+    path('archive/', ArchivedEncryptedMessages.as_view(), name='archived_encrypted_messages'),
+    path('sync/', SyncEncryptedMessages.as_view(), name='sync_encrypted_messages'),
+    path('sync/read/', MarkMessagesRead.as_view(), name='mark_messages_read'),
+    path('attachments/', EncryptedAttachments.as_view(), name='encrypted_attachments'),
+    path('attachments/<int:pk>/', DownloadAttachment.as_view(), name='download_attachment'),
+    path('async/send/', AsyncSendEncryptedMessage.as_view(), name='async_send_encrypted_message'),
+    path('async/inbox/', AsyncReadEncryptedMessages.as_view(), name='async_received_encrypted_messages'),
 ]
@@ -1,63 +1,306 @@
-import base64
+import contextvars
+import json
 import os
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes
-from .models import EncryptedMessage
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from crypto.cache import load_user_key
+from crypto.profiling import timed
+from crypto.utils import encrypt_payload, seal_envelope, wrap_aes_key, unwrap_aes_key, decrypt_payload
+from users.keyring import get_unlocked_keys, session_id_from_request
+from users.keys import with_active_key_id
+from . import inbox_cache
+from .conversations import conversation_key_for_send
+from .models import EncryptedMessage, Attachment
+from .realtime import publish_messages
+from .serializers import EncryptedMessageSerializer, ArchivedMessageSerializer, AttachmentSerializer
+from .retention import archive_page
+from .attachments import AttachmentTooLarge, store_attachment, open_attachment, parse_range, iter_plaintext
+from .uploads import EncryptedMultiPartParser
+from .sync import (
+    SYNC_PAGE_SIZE, SYNC_MAX_PAGE_SIZE,
+    make_sync_token, read_sync_token, sync_page, mark_delivered, mark_read, inbox_state, unread_count,
+)
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 
 User = get_user_model()
 
-class SendEncryptedMessage(APIView):
-    def post(self, request):
-        recipient_id = request.data.get('recipient')
-        message = request.data.get('message')
+INBOX_PAGE_SIZE = getattr(settings, 'INBOX_PAGE_SIZE', 50)
+INBOX_MAX_PAGE_SIZE = getattr(settings, 'INBOX_MAX_PAGE_SIZE', 500)
+BULK_SEND_MAX_RECIPIENTS = getattr(settings, 'BULK_SEND_MAX_RECIPIENTS', 500)
+INBOX_STREAM_CHUNK_SIZE = getattr(settings, 'INBOX_STREAM_CHUNK_SIZE', 200)
+INBOX_DECRYPT_WORKERS = getattr(settings, 'INBOX_DECRYPT_WORKERS', min(8, os.cpu_count() or 1))
+INBOX_DECRYPT_CHUNK_SIZE = getattr(settings, 'INBOX_DECRYPT_CHUNK_SIZE', 64)
 
-        try:
-            recipient = User.objects.get(id=recipient_id)
-            recipient_public_key = serialization.load_pem_public_key(
-                recipient.public_key.encode()  # Assure-toi que ce champ existe et est bien une clé PEM
+
+def recipient_queryset():
+    """Destinataires avec l'id de leur clé active (clé publique servie par le cache)."""
+    return with_active_key_id(User.objects.all())
+
+
+def parse_inbox_cursor(query_params):
+    """
+    Lit les paramètres de pagination ``?after=<id>&limit=N`` de l'inbox.
+
+    :return: (after, limit) — ``after`` vaut None pour la première page
+    :raises ValueError: si un paramètre n'est pas un entier positif
+    """
+    after = query_params.get('after')
+    after = int(after) if after not in (None, '') else None
+    if after is not None and after < 0:
+        raise ValueError('after must be a positive integer')
+
+    limit = query_params.get('limit')
+    limit = int(limit) if limit not in (None, '') else INBOX_PAGE_SIZE
+    if limit <= 0:
+        raise ValueError('limit must be a positive integer')
+
+    return after, min(limit, INBOX_MAX_PAGE_SIZE)
+
+
+INBOX_MODES = ('decrypted', 'envelope')
+
+
+def parse_inbox_mode(query_params):
+    """
+    ``?mode=decrypted`` (défaut) : le serveur déchiffre les messages.
+    ``?mode=envelope`` : enveloppes chiffrées brutes, déchiffrées par le client.
+    """
+    mode = query_params.get('mode') or 'decrypted'
+    if mode not in INBOX_MODES:
+        raise ValueError(f'mode must be one of {", ".join(INBOX_MODES)}')
+    return mode
+
+
+def inbox_queryset(user, after=None, anchor=None):
+    """
+    Requête ordonnée de l'inbox à partir du curseur ``after``.
+
+    ``anchor`` est le ``created_at`` du message ``after`` (None si inconnu).
+    """
+    queryset = EncryptedMessage.objects.filter(recipient=user)
+
+    if after is not None:
+        if anchor is None:
+            # Curseur inconnu : on retombe sur l'id seul (créés dans l'ordre)
+            queryset = queryset.filter(id__gt=after)
+        else:
+            queryset = queryset.filter(
+                Q(created_at__gt=anchor) | Q(created_at=anchor, id__gt=after)
             )
 
-            # Génère une clé AES aléatoire (256 bits)
-            aes_key = os.urandom(32)
+    return queryset.select_related('sender', 'session').order_by('created_at', 'id')
 
-            # Génère un IV (Initialisation Vector)
-            iv = os.urandom(16)
 
-            # Chiffre le message
-            cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
-            encryptor = cipher.encryptor()
+def iter_inbox(user, after=None, anchor=None, batch_size=INBOX_STREAM_CHUNK_SIZE):
+    """
+    Parcourt l'inbox à partir du curseur par paquets de ``batch_size`` : une
+    requête keyset (``inbox_queryset`` repris après la dernière ligne) par
+    paquet. Contrairement à ``.iterator()``, aucun curseur n'est gardé ouvert
+    et la mémoire reste bornée même si le pilote (mysqlclient) charge tout le
+    résultat d'une requête côté client.
+    """
+    while True:
+        batch = list(inbox_queryset(user, after, anchor)[:batch_size])
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        after, anchor = batch[-1].id, batch[-1].created_at
 
-            # Padding du message à un multiple de 16 (CBC nécessite un bloc multiple)
-            from cryptography.hazmat.primitives import padding as sym_padding
-            padder = sym_padding.PKCS7(128).padder()
-            padded_data = padder.update(message.encode()) + padder.finalize()
 
-            encrypted_message = encryptor.update(padded_data) + encryptor.finalize()
+def inbox_page(user, after=None, limit=INBOX_PAGE_SIZE):
+    """
+    Retourne une page de l'inbox (keyset sur ``(created_at, id)``).
 
-            # Chiffre la clé AES avec la clé publique du destinataire (RSA)
-            encrypted_aes_key = recipient_public_key.encrypt(
-                aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
+    La requête suit l'index ``(recipient, created_at, id)`` : le coût ne dépend
+    que de ``limit``, pas de la taille de l'historique. On lit ``limit + 1``
+    lignes pour savoir s'il reste une page suivante. Les pages récentes sont
+    servies par le cache de l'inbox chaude (cf. chat.inbox_cache).
+
+    :return: (messages, has_more)
+    """
+    cached = inbox_cache.get_page(user, after, limit)
+    if cached is not None:
+        return cached
+
+    anchor = None
+    if after is not None:
+        anchor = EncryptedMessage.objects.filter(recipient=user, id=after).values_list('created_at', flat=True).first()
+
+    rows = list(inbox_queryset(user, after, anchor)[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+@timed('seal')
+def seal_message(recipient, message, session=None, session_key=None, recipient_key=None):
+    """
+    Chiffre ``message`` pour ``recipient`` (enveloppe AES-256-GCM + clé AES enveloppée en RSA-OAEP).
+
+    Avec une session de conversation (cf. chat.conversations), le message est
+    chiffré sous la clé de session : aucune opération asymétrique.
+
+    :param recipient_key: ``(key_id, clé publique)`` déjà chargée
+        (``load_user_key``) ; sans elle, la clé est lue via le cache, avec une
+        requête en cas d'absence. Avec elle, aucun accès à la base.
+    :return: champs binaires prêts pour ``EncryptedMessage``
+    """
+    if session is not None:
+        return {
+            'encrypted_message_bin': seal_envelope(session_key, message.encode()),
+            'encrypted_aes_key_bin': b'',
+            'iv_bin': b'',
+            'session': session,
+            'recipient_key_id': session.key_id_for(recipient.pk),
+        }
+
+    recipient_key_id, recipient_public_key = recipient_key or load_user_key(recipient)
+
+    # Chiffre le message avec une clé AES aléatoire (256 bits) ; le nonce est dans l'enveloppe
+    aes_key, encrypted_message = encrypt_payload(message)
+
+    # Chiffre la clé AES avec la clé publique du destinataire (RSA)
+    encrypted_aes_key = wrap_aes_key(recipient_public_key, aes_key)
+
+    return {
+        'encrypted_message_bin': encrypted_message,
+        'encrypted_aes_key_bin': encrypted_aes_key,
+        'iv_bin': b'',  # réservé aux anciens messages CBC
+        'recipient_key_id': recipient_key_id,
+    }
+
+
+@timed('decrypt')
+def decrypt_row(keys, msg, session_keys=None):
+    """
+    Déchiffre un message avec les clés privées déverrouillées du destinataire
+    (``UnlockedKeys`` : la clé est choisie par ``recipient_key_id``).
+
+    ``session_keys`` (dict) mémorise les clés de session déjà déchiffrées :
+    une seule opération asymétrique par session et non par message.
+    """
+    if session_keys is not None and msg.session_id in session_keys:
+        aes_key = session_keys[msg.session_id]
+    else:
+        # 🔓 Déchiffre la clé AES avec la clé privée RSA
+        aes_key = unwrap_aes_key(keys.for_key(msg.recipient_key_id), msg.aes_key_bytes)
+        if session_keys is not None and msg.session_id is not None:
+            session_keys[msg.session_id] = aes_key
+
+    plaintext = decrypt_payload(aes_key, msg.iv_bytes, msg.message_bytes)
+
+    return {
+        'id': msg.id,
+        'from': msg.sender.username,
+        'message': plaintext.decode(),
+        'received_at': msg.created_at
+    }
+
+
+def decrypt_row_safe(keys, msg, session_keys=None):
+    """Comme ``decrypt_row``, mais une erreur est signalée sur la ligne au lieu d'être levée."""
+    try:
+        return decrypt_row(keys, msg, session_keys)
+    except Exception as e:
+        return {'id': msg.id, 'error': f'Erreur de déchiffrement : {str(e)}'}
+
+
+def _decrypt_chunk(keys, chunk):
+    session_keys = {}
+    return [decrypt_row_safe(keys, msg, session_keys) for msg in chunk]
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+_decrypt_executor = None
+_decrypt_executor_lock = threading.Lock()
+
+
+def get_decrypt_executor():
+    global _decrypt_executor
+    with _decrypt_executor_lock:
+        if _decrypt_executor is None:
+            _decrypt_executor = ThreadPoolExecutor(
+                max_workers=INBOX_DECRYPT_WORKERS, thread_name_prefix='inbox-decrypt'
+            )
+        return _decrypt_executor
+
+
+def decrypt_rows(keys, messages):
+    """
+    Déchiffre ``messages`` par paquets de ``INBOX_DECRYPT_CHUNK_SIZE`` sur un
+    ``ThreadPoolExecutor`` borné (la lib cryptography relâche le GIL) ; les
+    lignes sortent dans l'ordre d'entrée.
+
+    ``messages`` peut être un itérateur : il est consommé dans le thread
+    appelant (accès DB) avec au plus ``2 * INBOX_DECRYPT_WORKERS`` paquets en vol.
+    """
+    small = isinstance(messages, (list, tuple)) and len(messages) <= INBOX_DECRYPT_CHUNK_SIZE
+    if INBOX_DECRYPT_WORKERS <= 1 or small:
+        for chunk in _chunked(messages, INBOX_DECRYPT_CHUNK_SIZE):
+            yield from _decrypt_chunk(keys, chunk)
+        return
+
+    executor = get_decrypt_executor()
+    pending = deque()
+    for chunk in _chunked(messages, INBOX_DECRYPT_CHUNK_SIZE):
+        # copy_context : les spans des threads vont au profil de la requête (cf. crypto.profiling)
+        pending.append(executor.submit(contextvars.copy_context().run, _decrypt_chunk, keys, chunk))
+        if len(pending) >= 2 * INBOX_DECRYPT_WORKERS:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def decrypt_inbox(keys, messages):
+    """Déchiffre une page de messages avec les clés privées du destinataire."""
+    return list(decrypt_rows(keys, messages))
+
+
+def stream_json_array(items):
+    """Sérialise ``items`` en tableau JSON, un élément à la fois."""
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item, cls=DjangoJSONEncoder)
+    yield ']'
+
+class SendEncryptedMessage(APIView):
+    def post(self, request):
+        recipient_id = request.data.get('recipient')
+        message = request.data.get('message')
+
+        try:
+            recipient = recipient_queryset().get(id=recipient_id)
+            session, session_key = conversation_key_for_send(
+                request.user, recipient,
+                get_unlocked_keys(request.user.pk, session_id_from_request(request))
             )
 
             # Enregistre le message
-            EncryptedMessage.objects.create(
+            msg = EncryptedMessage.objects.create(
                 sender=request.user,
                 recipient=recipient,
-                encrypted_message=base64.b64encode(encrypted_message).decode(),
-                encrypted_aes_key=base64.b64encode(encrypted_aes_key).decode(),
-                iv=base64.b64encode(iv).decode(),
+                **seal_message(recipient, message, session, session_key)
             )
+            publish_messages([msg])
+            inbox_cache.append_messages([msg])
 
             return Response({'status': 'Message sent & encrypted ✅'}, status=status.HTTP_201_CREATED)
 
@@ -66,52 +309,372 @@ class SendEncryptedMessage(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def fill_bulk_ids(rows, encrypted_message):
+    """
+    Complète les ids des messages créés par ``bulk_create`` quand la base ne
+    les renvoie pas (MySQL : pas de RETURNING). Les lignes sont relues par
+    destinataire et ``created_at`` (index de l'inbox), puis reconnues à leur
+    enveloppe, propre à cet envoi (clé AES et nonce aléatoires).
+    """
+    missing = {row.recipient_id: row for row in rows if row.pk is None}
+    if not missing:
+        return
+
+    inserted = EncryptedMessage.objects.filter(
+        sender=rows[0].sender,
+        recipient_id__in=list(missing),
+        created_at__gte=min(row.created_at for row in missing.values()),
+    ).values_list('id', 'recipient_id', 'encrypted_message_bin')
+    for msg_id, recipient_id, message in inserted:
+        if recipient_id in missing and bytes(message) == encrypted_message:
+            missing.pop(recipient_id).pk = msg_id
+
+
+class SendBulkEncryptedMessage(APIView):
+    """
+    Envoie un même message à plusieurs destinataires en une requête.
+
+    Le message est chiffré une seule fois sous une clé AES ; seule
+    l'enveloppe RSA de cette clé est calculée par destinataire.
+    """
+    def post(self, request):
+        recipient_ids = request.data.get('recipients')
+        message = request.data.get('message')
+
+        if not isinstance(recipient_ids, list) or not recipient_ids:
+            return Response({'error': 'recipients must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if message is None:
+            return Response({'error': 'message is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # dict.fromkeys : dédoublonne en gardant l'ordre
+            recipient_ids = list(dict.fromkeys(int(i) for i in recipient_ids))
+        except (TypeError, ValueError):
+            return Response({'error': 'recipients must be user ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(recipient_ids) > BULK_SEND_MAX_RECIPIENTS:
+            return Response(
+                {'error': f'Too many recipients (max {BULK_SEND_MAX_RECIPIENTS})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            recipients = recipient_queryset().in_bulk(recipient_ids)
+            missing = [i for i in recipient_ids if i not in recipients]
+            if missing:
+                # Liste invalide : rien n'est envoyé
+                return Response({'error': 'Recipient not found', 'missing': missing}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Un seul chiffrement AES pour tous les destinataires
+            aes_key, encrypted_message = encrypt_payload(message)
+
+            rows = []
+            for recipient_id in recipient_ids:
+                recipient = recipients[recipient_id]
+                recipient_key_id, recipient_public_key = load_user_key(recipient)
+                rows.append(EncryptedMessage(
+                    sender=request.user,
+                    recipient=recipient,
+                    encrypted_message_bin=encrypted_message,
+                    encrypted_aes_key_bin=wrap_aes_key(recipient_public_key, aes_key),
+                    iv_bin=b'',
+                    recipient_key_id=recipient_key_id,
+                ))
+
+            with transaction.atomic():
+                EncryptedMessage.objects.bulk_create(rows)
+                fill_bulk_ids(rows, encrypted_message)
+                publish_messages(rows)
+                inbox_cache.append_messages(rows)
+
+            return Response(
+                {'status': 'Message sent & encrypted ✅', 'count': len(rows)},
+                status=status.HTTP_201_CREATED
+            )
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class ReadEncryptedMessages(APIView):
     def get(self, request):
         user = request.user
 
-        # Si on a stocké la clé privée déchiffrée (en mémoire ou dans la DB temporairement)
         try:
-            private_key = serialization.load_pem_private_key(
-                user.decrypted_private_key.encode(),  # 🔐 doit être disponible en texte PEM
-                password=None,
+            after, limit = parse_inbox_cursor(request.query_params)
+            mode = parse_inbox_mode(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if mode == 'envelope':
+            # Aucun déchiffrement côté serveur : pas besoin de la clé privée
+            messages, has_more = inbox_page(user, after=after, limit=limit)
+            next_cursor = messages[-1].id if has_more else None
+            return Response(
+                {'results': EncryptedMessageSerializer(messages, many=True).data, 'next': next_cursor},
+                status=200
             )
 
-            messages = EncryptedMessage.objects.filter(recipient=user)
-            result = []
-
-            for msg in messages:
-                # Décodage base64
-                encrypted_aes_key = base64.b64decode(msg.encrypted_aes_key)
-                iv = base64.b64decode(msg.iv)
-                encrypted_message = base64.b64decode(msg.encrypted_message)
-
-                # 🔓 Déchiffre la clé AES avec la clé privée RSA
-                aes_key = private_key.decrypt(
-                    encrypted_aes_key,
-                    asym_padding.OAEP(
-                        mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
-                        algorithm=hashes.SHA256(),
-                        label=None
-                    )
+        # Clé privée déverrouillée au login et gardée pour la session (cf. users.keyring)
+        keys = get_unlocked_keys(user.pk, session_id_from_request(request))
+        if keys is None:
+            return Response(
+                {'error': 'Private key locked, please log in again'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            messages, has_more = inbox_page(user, after=after, limit=limit)
+            result = decrypt_inbox(keys, messages)
+
+            # Curseur pour la page suivante : id du dernier message renvoyé
+            next_cursor = messages[-1].id if has_more else None
+
+            return Response({'results': result, 'next': next_cursor}, status=200)
+
+        except Exception as e:
+            return Response({'error': f'Erreur de déchiffrement : {str(e)}'}, status=500)
+
+
+class StreamEncryptedMessages(APIView):
+    """
+    Inbox complète (à partir de ``?after=<id>``) en tableau JSON streamé.
+
+    Les lignes sont lues par paquets keyset de ``INBOX_STREAM_CHUNK_SIZE``
+    (cf. ``iter_inbox``) et déchiffrées au fil de l'eau : la mémoire reste
+    bornée quelle que soit la taille de l'historique et le client reçoit les
+    premiers messages tout de suite.
+    """
+    def get(self, request):
+        user = request.user
+
+        try:
+            after, _ = parse_inbox_cursor(request.query_params)
+            mode = parse_inbox_mode(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        keys = None
+        if mode == 'decrypted':
+            keys = get_unlocked_keys(user.pk, session_id_from_request(request))
+            if keys is None:
+                return Response(
+                    {'error': 'Private key locked, please log in again'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        anchor = None
+        if after is not None:
+            anchor = EncryptedMessage.objects.filter(recipient=user, id=after).values_list('created_at', flat=True).first()
+        messages = iter_inbox(user, after, anchor)
+
+        if mode == 'envelope':
+            rows = (EncryptedMessageSerializer(msg).data for msg in messages)
+        else:
+            # Le statut HTTP est déjà envoyé : une erreur est signalée sur la ligne
+            rows = decrypt_rows(keys, messages)
+
+        return StreamingHttpResponse(stream_json_array(rows), content_type='application/json')
+
+
+class ArchivedEncryptedMessages(APIView):
+    """
+    Historique archivé par la rétention (cf. chat.retention) : chemin lent,
+    séparé de l'inbox, même pagination ``?after=<id>&limit=N`` et mêmes modes.
+    """
+    def get(self, request):
+        user = request.user
+
+        try:
+            after, limit = parse_inbox_cursor(request.query_params)
+            mode = parse_inbox_mode(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        keys = None
+        if mode == 'decrypted':
+            keys = get_unlocked_keys(user.pk, session_id_from_request(request))
+            if keys is None:
+                return Response(
+                    {'error': 'Private key locked, please log in again'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        try:
+            messages, has_more = archive_page(user, after=after, limit=limit)
+            if mode == 'envelope':
+                result = ArchivedMessageSerializer(messages, many=True).data
+            else:
+                result = decrypt_inbox(keys, messages)
+        except Exception as e:
+            return Response({'error': f'Erreur de déchiffrement : {str(e)}'}, status=500)
+
+        next_cursor = messages[-1].id if has_more else None
+        return Response({'results': result, 'next': next_cursor}, status=200)
+
+
+class SyncEncryptedMessages(APIView):
+    """
+    Synchronisation incrémentale : ``?token=<sync_token>`` ne renvoie que les
+    messages arrivés depuis le token (aucun au premier appel sans nouveauté).
+
+    Sans token, reprend depuis le début de l'historique, page par page
+    (``has_more``). Les messages renvoyés sont marqués remis (marque haute,
+    cf. chat.sync) ; la réponse inclut les marques remis/lu pour les autres appareils.
+    """
+    def get(self, request):
+        user = request.user
+
+        try:
+            after_id = read_sync_token(user, request.query_params.get('token'))
+            limit = request.query_params.get('limit')
+            limit = int(limit) if limit not in (None, '') else SYNC_PAGE_SIZE
+            if limit <= 0:
+                raise ValueError('limit must be a positive integer')
+            limit = min(limit, SYNC_MAX_PAGE_SIZE)
+            mode = parse_inbox_mode(request.query_params)
+        except ValueError as e:  # InvalidSyncToken inclus
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        keys = None
+        if mode == 'decrypted':
+            keys = get_unlocked_keys(user.pk, session_id_from_request(request))
+            if keys is None:
+                return Response(
+                    {'error': 'Private key locked, please log in again'},
+                    status=status.HTTP_403_FORBIDDEN
                 )
 
-                # 🔓 Déchiffre le message AES
-                cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
-                decryptor = cipher.decryptor()
-                padded_plaintext = decryptor.update(encrypted_message) + decryptor.finalize()
+        try:
+            messages, has_more = sync_page(user, after_id, limit)
+            if mode == 'envelope':
+                results = EncryptedMessageSerializer(messages, many=True).data
+            else:
+                results = decrypt_inbox(keys, messages)
+        except Exception as e:
+            return Response({'error': f'Erreur de déchiffrement : {str(e)}'}, status=500)
+
+        last_id = after_id
+        if messages:
+            last_id = messages[-1].id
+            mark_delivered(user, last_id)
+        delivered_up_to, read_up_to = inbox_state(user)
+
+        return Response({
+            'results': results,
+            'sync_token': make_sync_token(user, last_id),
+            'has_more': has_more,
+            'delivered_up_to': delivered_up_to,
+            'read_up_to': read_up_to,
+        }, status=200)
+
+
+class MarkMessagesRead(APIView):
+    """Marque comme lus tous les messages reçus d'id <= ``up_to``."""
+
+    def post(self, request):
+        try:
+            up_to = int(request.data.get('up_to'))
+            if up_to <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({'error': 'up_to must be a positive message id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        mark_read(request.user, up_to)
+        _, read_up_to = inbox_state(request.user)
+        return Response({'read_up_to': read_up_to, 'unread': unread_count(request.user, read_up_to)}, status=200)
 
-                # Retire le padding
-                unpadder = sym_padding.PKCS7(128).unpadder()
-                plaintext = unpadder.update(padded_plaintext) + unpadder.finalize()
 
-                result.append({
-                    'from': msg.sender.username,
-                    'message': plaintext.decode(),
-                    'received_at': msg.created_at
-                })
+class EncryptedAttachments(APIView):
+    """
+    ``GET`` : pièces jointes reçues (manifestes, plus récentes en dernier).
 
-            return Response(result, status=200)
+    ``POST`` : envoi d'une pièce jointe, chiffrée par blocs à la volée vers le
+    blob store. En ``multipart/form-data`` (champs ``recipient`` et ``file``),
+    chiffré pendant la réception (cf. chat.uploads), ou corps brut
+    (``?recipient=<id>&filename=<nom>``) lu directement depuis la requête.
+    Dans les deux cas, aucun fichier temporaire en clair.
+    """
+    parser_classes = [EncryptedMultiPartParser]
 
+    def get(self, request):
+        attachments = Attachment.objects.filter(recipient=request.user).select_related('sender').order_by('created_at', 'id')
+        return Response(AttachmentSerializer(attachments, many=True).data, status=200)
+
+    def post(self, request):
+        upload = None
+        if request.content_type.startswith('multipart/'):
+            try:
+                recipient_id = request.data.get('recipient')
+                upload = request.FILES.get('file')
+            except AttachmentTooLarge as e:
+                return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            if upload is None:
+                return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            recipient_id = request.query_params.get('recipient')
+            stream = request.stream  # None si le corps est vide
+            read = stream.read if stream is not None else (lambda size: b'')
+            filename, content_type = request.query_params.get('filename'), request.content_type
+
+        try:
+            recipient = recipient_queryset().get(id=recipient_id)
+        except (User.DoesNotExist, ValueError, TypeError):
+            if upload is not None:
+                upload.writer.discard()
+            return Response({'error': 'Recipient not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        if upload is not None:
+            attachment = upload.writer.create_manifest(request.user, recipient, upload.name, upload.content_type)
+        else:
+            try:
+                attachment = store_attachment(request.user, recipient, read, filename, content_type)
+            except AttachmentTooLarge as e:
+                return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        return Response(AttachmentSerializer(attachment).data, status=status.HTTP_201_CREATED)
+
+
+class DownloadAttachment(APIView):
+    """
+    Téléchargement déchiffré d'une pièce jointe reçue, streamé bloc par bloc.
+
+    Gère ``Range: bytes=...`` (une plage) : seuls les blocs concernés sont lus
+    et déchiffrés. Un bloc altéré interrompt le transfert (tag GCM invalide).
+    """
+    def get(self, request, pk):
+        try:
+            attachment = Attachment.objects.get(pk=pk, recipient=request.user)
+        except Attachment.DoesNotExist:
+            return Response({'error': 'Attachment not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        keys = get_unlocked_keys(request.user.pk, session_id_from_request(request))
+        if keys is None:
+            return Response(
+                {'error': 'Private key locked, please log in again'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            byte_range = parse_range(request.headers.get('Range'), attachment.size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{attachment.size}'
+            return response
+
+        try:
+            file_key, filename = open_attachment(keys, attachment)
         except Exception as e:
             return Response({'error': f'Erreur de déchiffrement : {str(e)}'}, status=500)
+
+        start, end = byte_range or (0, attachment.size - 1)
+        response = StreamingHttpResponse(
+            iter_plaintext(attachment, file_key, start, end) if attachment.size else iter(()),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type=attachment.content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = content_disposition_header(True, filename or f'attachment-{attachment.pk}')
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{attachment.size}'
+        return response
@@ -0,0 +1,219 @@
+"""
+Micro-benchmarks du chemin chaud envoi/lecture (cf. commande ``crypto_bench``).
+
+Chaque mesure retourne un dict sérialisable en JSON :
+``{'name', 'params', 'iterations', 'mean_ms', 'p50_ms', 'min_ms', 'max_ms', 'ops_per_s'}``.
+"""
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from base64 import b64encode
+
+MESSAGE_SIZES = [16, 256, 4096, 65536, 1048576]
+INBOX_SIZES = [10, 100, 1000, 10000, 100000]
+COMPRESSION_SIZES = [1024, 16384, 262144]
+BENCH_PASSWORD = 'bench-password-1234'
+
+
+def measure(name, fn, repeat=20, **params):
+    """Exécute ``fn()`` ``repeat`` fois et résume les durées (en ms)."""
+    fn()  # échauffement (caches, imports paresseux)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    mean = statistics.fmean(samples)
+    return {
+        'name': name,
+        'params': params,
+        'iterations': repeat,
+        'mean_ms': mean,
+        'p50_ms': statistics.median(samples),
+        'min_ms': min(samples),
+        'max_ms': max(samples),
+        'ops_per_s': 1000 / mean if mean else None,
+    }
+
+
+def bench_symmetric(sizes=MESSAGE_SIZES, repeat=20):
+    """crypto.utils.encrypt_message / decrypt_message par taille de message."""
+    from crypto.utils import encrypt_message, decrypt_message
+
+    key = os.urandom(32)
+    results = []
+    for size in sizes:
+        plaintext = 'x' * size
+        envelope = encrypt_message(key, plaintext)
+        results.append(measure('encrypt_message', lambda: encrypt_message(key, plaintext), repeat, size=size))
+        results.append(measure('decrypt_message', lambda: decrypt_message(key, envelope), repeat, size=size))
+    return results
+
+
+def sample_payloads(size, seed=0):
+    """
+    Messages types de ``size`` octets : logs collés, JSON, et texte
+    incompressible (base64 aléatoire) pour mesurer le surcoût dans le pire cas.
+    """
+    rng = random.Random(seed)
+    levels = ['INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']
+    log_lines, records = [], []
+    while sum(len(line) + 1 for line in log_lines) < size:
+        log_lines.append(
+            f'2026-10-18 02:{rng.randrange(60):02d}:{rng.randrange(60):02d},{rng.randrange(1000):03d} '
+            f'{rng.choice(levels)} [chat.views] inbox user_id={rng.randrange(10000)} '
+            f'rows={rng.randrange(500)} duration_ms={rng.random() * 50:.2f}'
+        )
+    while len(json.dumps(records)) < size:
+        records.append({
+            'id': rng.randrange(10 ** 6), 'sender': f'user{rng.randrange(1000)}',
+            'status': rng.choice(['delivered', 'read', 'pending']), 'score': round(rng.random(), 4),
+        })
+    return {
+        'logs': '\n'.join(log_lines)[:size].encode(),
+        'json': json.dumps(records)[:size].encode(),
+        'random': b64encode(rng.randbytes(size))[:size],
+    }
+
+
+def bench_compression(sizes=COMPRESSION_SIZES, repeat=20):
+    """
+    seal_envelope/open_envelope avec et sans compression : durées, taille
+    stockée (``envelope_bytes``) et transférée en JSON (``base64_bytes``).
+    """
+    from crypto.utils import seal_envelope, open_envelope
+
+    key = os.urandom(32)
+    results = []
+    for size in sizes:
+        for kind, plaintext in sample_payloads(size).items():
+            for compress in (False, True):
+                envelope = seal_envelope(key, plaintext, compress=compress)
+                params = {'size': size, 'payload': kind, 'compress': compress}
+                for result in (
+                    measure('seal_envelope', lambda: seal_envelope(key, plaintext, compress=compress), repeat, **params),
+                    measure('open_envelope', lambda: open_envelope(key, envelope), repeat, **params),
+                ):
+                    result['envelope_bytes'] = len(envelope)
+                    result['base64_bytes'] = len(b64encode(envelope))
+                    result['ratio'] = len(envelope) / len(plaintext)
+                    results.append(result)
+    return results
+
+
+def bench_key_material(repeat=5):
+    """Fonctions de users.utils : génération de paires, PBKDF2, déchiffrement RSA."""
+    from crypto.utils import wrap_aes_key
+    from cryptography.hazmat.primitives import serialization
+    from users.utils import (
+        generate_rsa_key_pair, generate_x25519_key_pair,
+        encrypt_private_key, decrypt_private_key, decrypt_aes_key,
+    )
+
+    private_pem, public_pem = generate_rsa_key_pair()
+    encrypted = encrypt_private_key(private_pem, BENCH_PASSWORD)
+    public_key = serialization.load_pem_public_key(public_pem)
+    wrapped = b64encode(wrap_aes_key(public_key, os.urandom(32))).decode()
+
+    return [
+        measure('generate_rsa_key_pair', generate_rsa_key_pair, repeat),
+        measure('generate_x25519_key_pair', generate_x25519_key_pair, repeat),
+        measure('encrypt_private_key', lambda: encrypt_private_key(private_pem, BENCH_PASSWORD), repeat),
+        measure('decrypt_private_key', lambda: decrypt_private_key(encrypted, BENCH_PASSWORD), repeat),
+        measure('decrypt_aes_key', lambda: decrypt_aes_key(wrapped, private_pem.decode()), repeat),
+    ]
+
+
+def _make_user(key_type):
+    from users.keys import create_user_key
+    from users.models import CustomUser
+    from users.utils import generate_rsa_key_pair, generate_x25519_key_pair, encrypt_private_key
+
+    generate = generate_x25519_key_pair if key_type == CustomUser.KEY_TYPE_X25519 else generate_rsa_key_pair
+    private_pem, public_pem = generate()
+    user = CustomUser.objects.create_user(
+        username=f'bench-{uuid.uuid4().hex[:12]}',
+        password=BENCH_PASSWORD,
+    )
+    create_user_key(user, key_type, public_pem, encrypt_private_key(private_pem, BENCH_PASSWORD))
+    return user, private_pem
+
+
+def _client_for(user, private_pem):
+    """Client DRF authentifié avec une clé privée déverrouillée (comme après login)."""
+    from rest_framework.test import APIClient
+    from users.keyring import SESSION_CLAIM, new_session_id, unlock_private_keys
+
+    session_id = new_session_id()
+    unlock_private_keys(user.pk, session_id, {user.active_key.key_id: private_pem}, user.active_key.key_id)
+    client = APIClient()
+    client.force_authenticate(user, token={SESSION_CLAIM: session_id})
+    return client
+
+
+def bench_views(sizes=MESSAGE_SIZES, inbox_sizes=INBOX_SIZES, repeat=10, key_type='rsa', use_sessions=False):
+    """
+    Chemin complet par message (SendEncryptedMessage, ReadEncryptedMessages,
+    inbox streamée) via le client de test DRF, contre la base configurée.
+
+    À lancer dans une transaction annulée par l'appelant.
+    """
+    from chat import conversations
+
+    sessions_enabled = conversations.CONVERSATION_SESSIONS_ENABLED
+    conversations.CONVERSATION_SESSIONS_ENABLED = use_sessions
+    try:
+        return _bench_views(sizes, inbox_sizes, repeat, key_type, use_sessions)
+    finally:
+        conversations.CONVERSATION_SESSIONS_ENABLED = sessions_enabled
+
+
+def _bench_views(sizes, inbox_sizes, repeat, key_type, use_sessions):
+    import json
+
+    from chat import conversations
+    from chat.models import EncryptedMessage
+    from chat.views import seal_message
+
+    sender, sender_pem = _make_user(key_type)
+    results = []
+
+    recipient, recipient_pem = _make_user(key_type)
+    client = _client_for(sender, sender_pem)
+    for size in sizes:
+        body = {'recipient': recipient.pk, 'message': 'x' * size}
+        results.append(measure(
+            'view.send', lambda: client.post('/api/messages/send/', body, format='json'),
+            repeat, size=size, key_type=key_type, sessions=use_sessions,
+        ))
+
+    for inbox_size in inbox_sizes:
+        recipient, recipient_pem = _make_user(key_type)
+        rows = []
+        for i in range(inbox_size):
+            # Même chemin que l'envoi : session de conversation (avec rotation) ou clé par message
+            session, session_key = conversations.conversation_key_for_send(sender, recipient)
+            rows.append(EncryptedMessage(
+                sender=sender, recipient=recipient, **seal_message(recipient, f'message {i}', session, session_key)
+            ))
+        EncryptedMessage.objects.bulk_create(rows, batch_size=1000)
+
+        client = _client_for(recipient, recipient_pem)
+        params = {'rows': inbox_size, 'key_type': key_type, 'sessions': use_sessions}
+        inbox_repeat = max(1, repeat if inbox_size <= 1000 else repeat // 5)
+        results.append(measure(
+            'view.inbox_page', lambda: client.get('/api/messages/inbox/'), repeat, **params
+        ))
+        results.append(measure(
+            'view.inbox_page_envelope', lambda: client.get('/api/messages/inbox/?mode=envelope'), repeat, **params
+        ))
+        results.append(measure(
+            'view.inbox_stream',
+            lambda: json.loads(b''.join(client.get('/api/messages/inbox/stream/').streaming_content)),
+            inbox_repeat, **params
+        ))
+    return results
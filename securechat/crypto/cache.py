@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives import serialization
+from django.conf import settings
+
+
+# Caches nommés, exposés par les métriques Prometheus (cf. crypto.profiling)
+registry = {}
+
+
+class LRUCache:
+    """
+    Cache LRU en mémoire (par processus), borné en taille et avec TTL optionnel.
+
+    Thread-safe : les workers WSGI multi-threads partagent la même instance.
+    ``on_evict(key, value)`` est appelé quand une entrée sort du cache
+    (éviction LRU, expiration ou suppression explicite). Avec ``name``, le
+    cache est enregistré dans ``registry`` et ses ``stats()`` sont exportées.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, on_evict=None, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.name = name
+        if name is not None:
+            registry[name] = self
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at)
+
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                return True
+            return False
+
+    def purge_expired(self):
+        """Supprime les entrées expirées ; retourne le nombre d'entrées retirées."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]
+            for key in expired:
+                self._remove(key)
+            return len(expired)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def items(self):
+        """Copie des entrées non expirées, ``[(clé, valeur)]``."""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, exp) in self._data.items() if exp is None or exp > now]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        # Appelé avec le verrou tenu
+        value, _ = self._data.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+
+class PublicKeyCache(LRUCache):
+    """
+    Cache des clés publiques déjà parsées (évite le parsing DER/ASN.1).
+
+    La clé de cache est ``(user_id, key_id de la clé active)`` : une rotation
+    (cf. users.keys) invalide l'entrée d'elle-même. Le ``key_id`` est lu sur
+    l'annotation ``active_key_id`` (``users.keys.with_active_key_id``) ou, à
+    défaut, par une requête ; la clé DER n'est lue qu'en cas d'absence du cache.
+    """
+
+    def load(self, user):
+        from users.models import UserKey
+
+        key_id = getattr(user, 'active_key_id', None)
+        if key_id is None and user.__dict__.get('active_key') is not None:
+            key_id = user.active_key.key_id
+        if key_id is None:
+            key_id = UserKey.objects.filter(user=user, is_active=True).values_list('key_id', flat=True).get()
+        key = (user.pk, key_id)
+        public_key = self.get(key)
+        if public_key is None:
+            public_der = UserKey.objects.filter(user=user, key_id=key_id).values_list('public_key', flat=True).get()
+            public_key = serialization.load_der_public_key(bytes(public_der))
+            self.set(key, public_key)
+        return key_id, public_key
+
+
+public_key_cache = PublicKeyCache(
+    name='public_keys',
+    maxsize=getattr(settings, 'PUBLIC_KEY_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'PUBLIC_KEY_CACHE_TTL', None),
+)
+
+
+def load_user_key(user):
+    """
+    Retourne ``(key_id, clé publique chargée)`` de la clé active de ``user``
+    (via le cache). Le ``key_id`` est enregistré avec ce qui est enveloppé
+    pour cette clé : après une rotation, l'ancienne clé privée est retrouvée.
+
+    :raises UserKey.DoesNotExist: l'utilisateur n'a pas de clé active
+    """
+    return public_key_cache.load(user)
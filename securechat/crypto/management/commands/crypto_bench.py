@@ -0,0 +1,69 @@
+import json
+import platform
+import sys
+
+import cryptography
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from crypto import benchmarks
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmarks crypto et chemin complet envoi/inbox, résultats en JSON. '
+        'Les lignes créées sont annulées en fin de run. '
+        'En local : --settings=securechat.settings_sqlite'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=_int_list, default=benchmarks.MESSAGE_SIZES,
+                            help='Tailles de message en octets (ex. 16,1024,1048576)')
+        parser.add_argument('--inbox-sizes', type=_int_list, default=benchmarks.INBOX_SIZES,
+                            help='Nombre de messages dans l\'inbox (ex. 10,100,1000)')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--key-type', choices=['rsa', 'x25519'], default='rsa')
+        parser.add_argument('--sessions', action='store_true', help='Clés de session de conversation')
+        parser.add_argument('--only', choices=['symmetric', 'compression', 'keys', 'views'], action='append',
+                            help='Ne lancer que certains groupes (répétable)')
+        parser.add_argument('--output', help='Fichier JSON de sortie (stdout par défaut)')
+
+    def handle(self, *args, **options):
+        groups = options['only'] or ['symmetric', 'compression', 'keys', 'views']
+        results = []
+
+        if 'symmetric' in groups:
+            results += benchmarks.bench_symmetric(options['sizes'], options['repeat'])
+        if 'compression' in groups:
+            results += benchmarks.bench_compression(repeat=options['repeat'])
+        if 'keys' in groups:
+            results += benchmarks.bench_key_material(max(1, options['repeat'] // 4))
+        if 'views' in groups:
+            with transaction.atomic():
+                results += benchmarks.bench_views(
+                    options['sizes'], options['inbox_sizes'], max(1, options['repeat'] // 2),
+                    options['key_type'], options['sessions'],
+                )
+                transaction.set_rollback(True)
+
+        report = {
+            'meta': {
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'django': django.get_version(),
+                'cryptography': cryptography.__version__,
+                'database': connection.vendor,
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
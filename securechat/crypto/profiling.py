@@ -0,0 +1,369 @@
+"""
+Profilage par requête : temps SQL, KDF, opérations asymétriques et octets
+chiffrés/déchiffrés.
+
+Les helpers crypto sont décorés avec ``timed(<catégorie>)`` ; hors requête
+profilée (commandes, workers) le décorateur se contente d'appeler la fonction.
+``ProfilingMiddleware`` ouvre un profil par requête, l'expose dans l'en-tête
+``Server-Timing``, l'écrit éventuellement dans un log structuré échantillonné
+et l'agrège dans des histogrammes par vue (cf. ``metrics.render``, qui
+exporte aussi les compteurs des caches LRU nommés de crypto.cache et la file
+du pool crypto de users.utils).
+
+Catégories : ``db``, ``kdf``, ``keygen``, ``asym``, ``sym``, ``b64``, ainsi
+que ``seal``/``decrypt`` qui englobent un message complet. Les durées sont
+cumulées : avec le déchiffrement parallèle de l'inbox elles peuvent dépasser
+la durée de la requête.
+"""
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .cache import registry
+
+PROFILING_ENABLED = getattr(settings, 'PROFILING_ENABLED', True)
+PROFILING_SERVER_TIMING = getattr(settings, 'PROFILING_SERVER_TIMING', settings.DEBUG)
+PROFILING_LOG_SAMPLE_RATE = getattr(settings, 'PROFILING_LOG_SAMPLE_RATE', 0.0)
+PROFILING_SLOW_REQUEST_MS = getattr(settings, 'PROFILING_SLOW_REQUEST_MS', None)
+PROFILING_BUCKETS = getattr(
+    settings, 'PROFILING_BUCKETS', (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+logger = logging.getLogger('securechat.profiling')
+
+_current_profile = contextvars.ContextVar('securechat_profile', default=None)
+
+
+class RequestProfile:
+    """Spans d'une requête : ``{catégorie: [opérations, secondes, octets]}``."""
+
+    def __init__(self):
+        self.spans = {}
+        self.started = time.perf_counter()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def add(self, name, duration, nbytes=0):
+        # Peut être appelé depuis les threads de déchiffrement de l'inbox
+        with self._lock:
+            span = self.spans.setdefault(name, [0, 0.0, 0])
+            span[0] += 1
+            span[1] += duration
+            span[2] += nbytes
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - start)
+
+    def server_timing(self):
+        """Valeur de l'en-tête ``Server-Timing`` (durées en ms)."""
+        entries = []
+        for name, (count, duration, nbytes) in sorted(self.spans.items()):
+            desc = f'{nbytes} bytes' if nbytes else f'{count} ops'
+            entries.append(f'{name};dur={duration * 1000:.2f};desc="{desc}"')
+        entries.append(f'total;dur={self.duration * 1000:.2f}')
+        return ', '.join(entries)
+
+    def as_dict(self):
+        return {
+            'duration_ms': self.duration * 1000,
+            'spans': {
+                name: {'count': count, 'duration_ms': duration * 1000, 'bytes': nbytes}
+                for name, (count, duration, nbytes) in self.spans.items()
+            },
+        }
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    # Le profil suit la requête par contextvar : les requêtes SQL faites dans
+    # les threads de sync_to_async (vues async) sont comptées aussi.
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile.sql_wrapper(execute, sql, params, many, context)
+
+
+def install_sql_wrapper(connection, **kwargs):
+    """Branche le compteur SQL sur une connexion (une fois par connexion de thread)."""
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+if PROFILING_ENABLED:
+    connection_created.connect(install_sql_wrapper, dispatch_uid='crypto.profiling.sql_wrapper')
+
+
+def record(name, duration, nbytes=0):
+    """Ajoute un span au profil de la requête courante (s'il y en a un)."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add(name, duration, nbytes)
+
+
+@contextmanager
+def span(name, nbytes=0):
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start, nbytes)
+
+
+def timed(name, size_arg=None):
+    """
+    Décorateur : mesure chaque appel dans la catégorie ``name``.
+
+    ``size_arg`` : index de l'argument positionnel dont la longueur est
+    comptée en octets traités (chiffrement symétrique).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                nbytes = len(args[size_arg]) if size_arg is not None and len(args) > size_arg else 0
+                profile.add(name, time.perf_counter() - start, nbytes)
+
+        # Lu par CryptoWorkerPool pour mesurer l'appel côté parent
+        wrapper.profile_span = name
+        return wrapper
+    return decorator
+
+
+class Histogram:
+    """Histogramme cumulatif au format Prometheus (bornes ``le`` en secondes)."""
+
+    def __init__(self, buckets=PROFILING_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class ProfilingMetrics:
+    """Agrégats par vue (et par catégorie de span), exposés au format texte Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}    # view -> Histogram
+        self.spans = {}       # (view, span) -> Histogram
+        self.operations = {}  # (view, span) -> int
+        self.bytes = {}       # (view, span) -> int
+
+    def observe(self, view, profile):
+        with self._lock:
+            self.requests.setdefault(view, Histogram()).observe(profile.duration)
+            for name, (count, duration, nbytes) in profile.spans.items():
+                key = (view, name)
+                self.spans.setdefault(key, Histogram()).observe(duration)
+                self.operations[key] = self.operations.get(key, 0) + count
+                self.bytes[key] = self.bytes.get(key, 0) + nbytes
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.spans.clear()
+            self.operations.clear()
+            self.bytes.clear()
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += _render_histogram(
+                'securechat_request_duration_seconds', 'Durée des requêtes par vue',
+                {_labels(view=view): h for view, h in sorted(self.requests.items())}
+            )
+            lines += _render_histogram(
+                'securechat_span_duration_seconds', 'Temps cumulé par requête et par catégorie',
+                {_labels(view=view, span=name): h for (view, name), h in sorted(self.spans.items())}
+            )
+            for metric, help_text, values in (
+                ('securechat_span_operations_total', 'Nombre d\'opérations par catégorie', self.operations),
+                ('securechat_span_bytes_total', 'Octets traités par catégorie', self.bytes),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for (view, name), value in sorted(values.items()):
+                    lines.append(f'{metric}{{{_labels(view=view, span=name)}}} {value}')
+        lines += _render_caches()
+        lines += _render_crypto_pool()
+        return '\n'.join(lines) + '\n'
+
+
+def _render_caches():
+    # Caches LRU nommés (crypto.cache.registry)
+    stats = {name: cache.stats() for name, cache in sorted(registry.items())}
+    lines = []
+    for metric, metric_type, help_text, field in (
+        ('securechat_cache_hits_total', 'counter', 'Lectures servies par le cache', 'hits'),
+        ('securechat_cache_misses_total', 'counter', 'Lectures absentes ou expirées', 'misses'),
+        ('securechat_cache_evictions_total', 'counter', 'Entrées évincées (LRU)', 'evictions'),
+        ('securechat_cache_entries', 'gauge', 'Entrées présentes', 'size'),
+        ('securechat_cache_max_entries', 'gauge', 'Taille maximale', 'maxsize'),
+    ):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for name, values in stats.items():
+            lines.append(f'{metric}{{{_labels(cache=name)}}} {values[field]}')
+    return lines
+
+
+def _render_crypto_pool():
+    # Import tardif : users.utils dépend de ce module (span, timed)
+    from users.utils import crypto_pool
+
+    values = crypto_pool.metrics()
+    lines = []
+    for metric, metric_type, help_text, value in (
+        ('securechat_crypto_pool_workers', 'gauge', 'Processus du pool crypto (0 : dans le processus courant)',
+         values['workers']),
+        ('securechat_crypto_pool_queue_depth', 'gauge', 'Tâches crypto en cours ou en attente', values['queue_depth']),
+        ('securechat_crypto_pool_queue_limit', 'gauge', 'Taille maximale de la file crypto', values['queue_limit']),
+        ('securechat_crypto_pool_completed_total', 'counter', 'Tâches crypto terminées', values['completed']),
+        ('securechat_crypto_pool_failed_total', 'counter', 'Tâches crypto en erreur', values['failed']),
+        ('securechat_crypto_pool_rejected_total', 'counter', 'Appels refusés (file pleine)', values['rejected']),
+        ('securechat_crypto_pool_timed_out_total', 'counter', 'Appels abandonnés (timeout)', values['timed_out']),
+        ('securechat_crypto_pool_latency_seconds_total', 'counter', 'Durée cumulée des tâches crypto',
+         values['latency_total_ms'] / 1000),
+        ('securechat_crypto_pool_latency_max_seconds', 'gauge', 'Durée maximale d\'une tâche crypto',
+         values['latency_max_ms'] / 1000),
+    ):
+        if value is None:
+            # File non bornée
+            continue
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        lines.append(f'{metric} {value}')
+    return lines
+
+
+def _render_histogram(metric, help_text, histograms):
+    lines = [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+    for labels, histogram in histograms.items():
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{metric}_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+metrics = ProfilingMetrics()
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match.route
+
+
+class ProfilingMiddleware:
+    """
+    Profil par requête (à placer en tête de ``MIDDLEWARE``).
+
+    Compatible sync et async : sous ASGI, la chaîne reste async (pas de
+    thread par requête imposé par ce middleware).
+
+    Pour les réponses streamées, seul le travail fait avant l'envoi du corps
+    est mesuré.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if PROFILING_ENABLED:
+            # Connexions ouvertes avant le chargement du middleware
+            for conn in connections.all(initialized_only=True):
+                install_sql_wrapper(conn)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not PROFILING_ENABLED:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not PROFILING_ENABLED:
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        profile.finish()
+
+        view = view_label(request)
+        metrics.observe(view, profile)
+
+        if PROFILING_SERVER_TIMING:
+            response['Server-Timing'] = profile.server_timing()
+
+        slow = PROFILING_SLOW_REQUEST_MS is not None and profile.duration * 1000 >= PROFILING_SLOW_REQUEST_MS
+        if slow or (PROFILING_LOG_SAMPLE_RATE and random.random() < PROFILING_LOG_SAMPLE_RATE):
+            logger.info(json.dumps({
+                'view': view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **profile.as_dict(),
+            }))
+
+        return response
@@ -1,3 +1,584 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+from base64 import b64encode
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from crypto import benchmarks, cache as crypto_cache
+from crypto.cache import LRUCache, PublicKeyCache
+from crypto.profiling import ProfilingMiddleware, RequestProfile, current_profile, metrics, span, timed
+from users.keys import create_user_key, with_active_key_id
+from users.models import CustomUser
+from users.utils import CryptoWorkerPool
+from users.utils import generate_x25519_key_pair
+from crypto.utils import (
+    ENVELOPE_V1_CBC, ENVELOPE_V2_GCM, ENVELOPE_V3_GCM_ZLIB, GCM_NONCE_SIZE, MESSAGE_COMPRESSION_MIN_SIZE,
+    X25519_KEY_SIZE, CHUNK_NONCE_PREFIX_SIZE, GCM_TAG_SIZE,
+    _decompress, _encrypt_gcm, decrypt_message, encrypt_message, envelope_version, open_envelope, seal_envelope,
+    open_chunk, seal_stream, unwrap_aes_key, wrap_aes_key,
+)
+
+
+def legacy_cbc(key, plaintext):
+    """Enveloppe v1 telle qu'écrite avant les formats versionnés : (chiffré, IV)."""
+    iv = os.urandom(16)
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(plaintext) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(padded) + encryptor.finalize(), iv
+
+
+class EnvelopeTests(SimpleTestCase):
+    def setUp(self):
+        self.key = AESGCM.generate_key(bit_length=256)
+
+    def test_v1_round_trip(self):
+        ciphertext, iv = legacy_cbc(self.key, b'ancien message')
+        self.assertEqual(envelope_version(ciphertext, iv), ENVELOPE_V1_CBC)
+        self.assertEqual(open_envelope(self.key, ciphertext, iv), b'ancien message')
+
+    def test_v2_round_trip(self):
+        envelope = seal_envelope(self.key, b'bonjour', compress=False)
+        self.assertEqual(envelope_version(envelope), ENVELOPE_V2_GCM)
+        self.assertEqual(len(envelope), 1 + GCM_NONCE_SIZE + len(b'bonjour') + 16)
+        self.assertEqual(open_envelope(self.key, envelope), b'bonjour')
+
+    def test_empty_plaintext(self):
+        self.assertEqual(open_envelope(self.key, seal_envelope(self.key, b'')), b'')
+
+    def test_text_helpers(self):
+        self.assertEqual(decrypt_message(self.key, encrypt_message(self.key, 'héllo ✅')), 'héllo ✅')
+
+    def test_nonce_is_fresh(self):
+        self.assertNotEqual(seal_envelope(self.key, b'x'), seal_envelope(self.key, b'x'))
+
+    def test_tampered_ciphertext(self):
+        envelope = bytearray(seal_envelope(self.key, b'bonjour'))
+        envelope[-1] ^= 1
+        with self.assertRaises(InvalidTag):
+            open_envelope(self.key, bytes(envelope))
+
+    def test_tampered_nonce(self):
+        envelope = bytearray(seal_envelope(self.key, b'bonjour'))
+        envelope[1] ^= 1
+        with self.assertRaises(InvalidTag):
+            open_envelope(self.key, bytes(envelope))
+
+    def test_truncated(self):
+        envelope = seal_envelope(self.key, b'bonjour')
+        for size in (len(envelope) - 1, 1 + GCM_NONCE_SIZE + 8, 1 + GCM_NONCE_SIZE):
+            with self.assertRaises(InvalidTag):
+                open_envelope(self.key, envelope[:size])
+
+    def test_version_byte_is_authenticated(self):
+        # L'octet de version est en données associées : le changer casse le tag
+        envelope = seal_envelope(self.key, b'bonjour', compress=False)
+        relabelled = bytes([ENVELOPE_V3_GCM_ZLIB]) + envelope[1:]
+        with self.assertRaises(InvalidTag):
+            open_envelope(self.key, relabelled)
+
+    def test_wrong_key(self):
+        envelope = seal_envelope(self.key, b'bonjour')
+        with self.assertRaises(InvalidTag):
+            open_envelope(AESGCM.generate_key(bit_length=256), envelope)
+
+    def test_unknown_version(self):
+        envelope = bytes([9]) + seal_envelope(self.key, b'bonjour')[1:]
+        with self.assertRaisesMessage(ValueError, 'Unsupported message envelope version: 9'):
+            open_envelope(self.key, envelope)
+
+
+class CompressedEnvelopeTests(SimpleTestCase):
+    def setUp(self):
+        self.key = AESGCM.generate_key(bit_length=256)
+        self.text = b'bonjour tout le monde ' * 200
+
+    def test_v3_round_trip(self):
+        envelope = seal_envelope(self.key, self.text, compress=True)
+        self.assertEqual(envelope_version(envelope), ENVELOPE_V3_GCM_ZLIB)
+        self.assertLess(len(envelope), len(self.text))
+        self.assertEqual(open_envelope(self.key, envelope), self.text)
+
+    def test_small_messages_are_not_compressed(self):
+        envelope = seal_envelope(self.key, b'x' * (MESSAGE_COMPRESSION_MIN_SIZE - 1), compress=True)
+        self.assertEqual(envelope_version(envelope), ENVELOPE_V2_GCM)
+
+    def test_incompressible_falls_back_to_v2(self):
+        envelope = seal_envelope(self.key, os.urandom(4096), compress=True)
+        self.assertEqual(envelope_version(envelope), ENVELOPE_V2_GCM)
+
+    def test_compression_disabled(self):
+        self.assertEqual(envelope_version(seal_envelope(self.key, self.text, compress=False)), ENVELOPE_V2_GCM)
+
+    def test_v3_tampered(self):
+        envelope = bytearray(seal_envelope(self.key, self.text, compress=True))
+        envelope[-20] ^= 1
+        with self.assertRaises(InvalidTag):
+            open_envelope(self.key, bytes(envelope))
+
+    def test_v3_truncated_stream(self):
+        # Flux zlib tronqué mais authentique (chiffré tel quel) : refusé à la décompression
+        envelope = _encrypt_gcm(self.key, zlib.compress(self.text)[:-10], ENVELOPE_V3_GCM_ZLIB)
+        with self.assertRaisesMessage(ValueError, 'too large or truncated'):
+            open_envelope(self.key, envelope)
+
+    def test_decompress_size_cap(self):
+        bomb = zlib.compress(b'\0' * (1024 * 1024))
+        with mock.patch('crypto.utils.MESSAGE_MAX_DECOMPRESSED_SIZE', 64 * 1024):
+            with self.assertRaisesMessage(ValueError, 'too large or truncated'):
+                _decompress(bomb)
+            with self.assertRaises(ValueError):
+                open_envelope(self.key, _encrypt_gcm(self.key, bomb, ENVELOPE_V3_GCM_ZLIB))
+
+    def test_decompress_at_cap(self):
+        data = b'a' * 4096
+        with mock.patch('crypto.utils.MESSAGE_MAX_DECOMPRESSED_SIZE', len(data)):
+            self.assertEqual(_decompress(zlib.compress(data)), data)
+
+
+class KeyWrapTests(SimpleTestCase):
+    def setUp(self):
+        self.aes_key = AESGCM.generate_key(bit_length=256)
+
+    def test_x25519_round_trip(self):
+        private_key = X25519PrivateKey.generate()
+        wrapped = wrap_aes_key(private_key.public_key(), self.aes_key)
+        # Clé publique éphémère + clé AES enveloppée en AES-KW (8 octets de plus)
+        self.assertEqual(len(wrapped), X25519_KEY_SIZE + len(self.aes_key) + 8)
+        self.assertEqual(unwrap_aes_key(private_key, wrapped), self.aes_key)
+
+    def test_x25519_ephemeral_key_is_fresh(self):
+        public_key = X25519PrivateKey.generate().public_key()
+        first, second = wrap_aes_key(public_key, self.aes_key), wrap_aes_key(public_key, self.aes_key)
+        self.assertNotEqual(first[:X25519_KEY_SIZE], second[:X25519_KEY_SIZE])
+
+    def test_x25519_wrong_recipient(self):
+        wrapped = wrap_aes_key(X25519PrivateKey.generate().public_key(), self.aes_key)
+        with self.assertRaises(InvalidUnwrap):
+            unwrap_aes_key(X25519PrivateKey.generate(), wrapped)
+
+    def test_x25519_tampered(self):
+        private_key = X25519PrivateKey.generate()
+        wrapped = wrap_aes_key(private_key.public_key(), self.aes_key)
+        for position in (0, len(wrapped) - 1):
+            tampered = bytearray(wrapped)
+            tampered[position] ^= 1
+            with self.assertRaises(InvalidUnwrap):
+                unwrap_aes_key(private_key, bytes(tampered))
+
+    def test_rsa_round_trip(self):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        wrapped = wrap_aes_key(private_key.public_key(), self.aes_key)
+        self.assertEqual(unwrap_aes_key(private_key, wrapped), self.aes_key)
+
+
+class ChunkStreamTests(SimpleTestCase):
+    chunk_size = 16
+
+    def setUp(self):
+        self.key = AESGCM.generate_key(bit_length=256)
+        self.prefix = os.urandom(CHUNK_NONCE_PREFIX_SIZE)
+
+    def seal(self, data, read=None):
+        return [chunk for _, chunk in seal_stream(self.key, self.prefix, read or io.BytesIO(data).read, self.chunk_size)]
+
+    def open_all(self, chunks):
+        last = len(chunks) - 1
+        return b''.join(open_chunk(self.key, self.prefix, i, chunk, i == last) for i, chunk in enumerate(chunks))
+
+    def test_round_trip_sizes(self):
+        cs = self.chunk_size
+        # (taille, nombre de blocs) : un multiple exact n'ajoute pas de bloc vide
+        for size, count in ((0, 1), (1, 1), (cs - 1, 1), (cs, 1), (cs + 1, 2), (3 * cs, 3), (3 * cs + 5, 4)):
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                chunks = self.seal(data)
+                self.assertEqual(len(chunks), count)
+                self.assertTrue(all(len(chunk) <= cs + GCM_TAG_SIZE for chunk in chunks))
+                self.assertEqual(self.open_all(chunks), data)
+
+    def test_short_reads(self):
+        # Un flux réseau peut rendre moins que demandé : les blocs restent pleins
+        data = os.urandom(5 * self.chunk_size)
+        source = io.BytesIO(data)
+        chunks = self.seal(data, read=lambda n: source.read(min(n, 3)))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(self.open_all(chunks), data)
+
+    def test_reordered_chunks(self):
+        chunks = self.seal(os.urandom(3 * self.chunk_size))
+        with self.assertRaises(InvalidTag):
+            open_chunk(self.key, self.prefix, 0, chunks[1], False)
+        with self.assertRaises(InvalidTag):
+            self.open_all([chunks[1], chunks[0], chunks[2]])
+
+    def test_truncated_stream(self):
+        # Dernier bloc retiré : l'avant-dernier n'a pas le drapeau final
+        chunks = self.seal(os.urandom(3 * self.chunk_size))
+        with self.assertRaises(InvalidTag):
+            self.open_all(chunks[:2])
+
+    def test_extended_stream(self):
+        # Bloc ajouté après le dernier : le dernier d'origine n'est plus lu comme final
+        chunks = self.seal(os.urandom(2 * self.chunk_size))
+        with self.assertRaises(InvalidTag):
+            self.open_all(chunks + [chunks[-1]])
+
+    def test_truncated_chunk(self):
+        chunks = self.seal(os.urandom(self.chunk_size))
+        with self.assertRaises(InvalidTag):
+            open_chunk(self.key, self.prefix, 0, chunks[0][:-1], True)
+
+    def test_chunk_from_another_file(self):
+        chunk = self.seal(b'a' * 8)[0]
+        with self.assertRaises(InvalidTag):
+            open_chunk(self.key, os.urandom(CHUNK_NONCE_PREFIX_SIZE), 0, chunk, True)
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_hits_and_misses(self):
+        cache = LRUCache(maxsize=2)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 'défaut'), 'défaut')
+        self.assertEqual(cache.stats(), {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 2, 'evictions': 0})
+
+    def test_evicts_least_recently_used(self):
+        evicted = []
+        cache = LRUCache(maxsize=2, on_evict=lambda key, value: evicted.append(key))
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(evicted, ['b'])
+        self.assertEqual(sorted(key for key, _ in cache.items()), ['a', 'c'])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_replace_does_not_count_as_eviction(self):
+        evicted = []
+        cache = LRUCache(maxsize=2, on_evict=lambda key, value: evicted.append(value))
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(evicted, [1])
+        self.assertEqual(cache.stats()['evictions'], 0)
+
+    def test_ttl(self):
+        cache = LRUCache(maxsize=10, ttl=5)
+        with mock.patch('crypto.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+            cache.set('b', 2, ttl=50)
+        with mock.patch('crypto.cache.time.monotonic', return_value=106):
+            self.assertEqual(cache.items(), [('b', 2)])
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(len(cache), 1)
+        with mock.patch('crypto.cache.time.monotonic', return_value=200):
+            self.assertEqual(cache.purge_expired(), 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_delete_and_clear(self):
+        evicted = []
+        cache = LRUCache(on_evict=lambda key, value: evicted.append(key))
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertTrue(cache.delete('a'))
+        self.assertFalse(cache.delete('a'))
+        cache.clear()
+        self.assertEqual(evicted, ['a', 'b'])
+        self.assertEqual(len(cache), 0)
+
+    def test_registry(self):
+        self.addCleanup(crypto_cache.registry.pop, 'test_cache', None)
+        cache = LRUCache(name='test_cache')
+        self.assertIs(crypto_cache.registry['test_cache'], cache)
+        self.assertNotIn(None, crypto_cache.registry)
+        LRUCache()
+        self.assertIs(crypto_cache.registry['test_cache'], cache)
+
+    def test_prometheus_counters(self):
+        self.addCleanup(crypto_cache.registry.pop, 'test_cache', None)
+        cache = LRUCache(maxsize=1, name='test_cache')
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('b')
+        cache.get('a')
+        lines = metrics.render().splitlines()
+        for line in (
+            '# TYPE securechat_cache_hits_total counter',
+            '# TYPE securechat_cache_entries gauge',
+            'securechat_cache_hits_total{cache="test_cache"} 1',
+            'securechat_cache_misses_total{cache="test_cache"} 1',
+            'securechat_cache_evictions_total{cache="test_cache"} 1',
+            'securechat_cache_entries{cache="test_cache"} 1',
+            'securechat_cache_max_entries{cache="test_cache"} 1',
+            'securechat_cache_entries{cache="public_keys"} %d' % len(crypto_cache.public_key_cache),
+        ):
+            self.assertIn(line, lines)
+
+
+class PublicKeyCacheTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='alice')
+        self.key = self.create_key()
+        self.cache = PublicKeyCache(maxsize=4)
+
+    def create_key(self):
+        public_pem = generate_x25519_key_pair()[1]
+        return create_user_key(self.user, CustomUser.KEY_TYPE_X25519, public_pem, b64encode(b'unused').decode())
+
+    def annotated(self):
+        return with_active_key_id(CustomUser.objects.all()).get(pk=self.user.pk)
+
+    def test_parsed_once(self):
+        user = self.annotated()
+        # Clé absente : lecture de la clé DER
+        with self.assertNumQueries(1):
+            key_id, first = self.cache.load(user)
+        self.assertEqual(key_id, self.key.key_id)
+        with self.assertNumQueries(0):
+            self.assertIs(self.cache.load(user)[1], first)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_without_annotation(self):
+        # Sans active_key_id : une requête pour le key_id de la clé active
+        self.cache.load(self.annotated())
+        user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            key_id, _ = self.cache.load(user)
+        self.assertEqual(key_id, self.key.key_id)
+
+    def test_rotation_invalidates(self):
+        _, old = self.cache.load(self.annotated())
+        rotated = self.create_key()
+        key_id, new = self.cache.load(self.annotated())
+        self.assertEqual(key_id, rotated.key_id)
+        self.assertIsNot(new, old)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+
+@mock.patch('crypto.profiling.PROFILING_SERVER_TIMING', True)
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.request = RequestFactory().get('/profiled/')
+
+    def view(self, request):
+        # Travail mesuré : une requête SQL, un span chiffré, un span manuel
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        seal_envelope(os.urandom(32), b'x' * 100, compress=False)
+        with span('kdf'):
+            pass
+        return HttpResponse('ok')
+
+    def test_spans_outside_a_request(self):
+        calls = []
+
+        @timed('asym')
+        def work(value):
+            calls.append(current_profile())
+            return value * 2
+
+        self.assertEqual(work(21), 42)
+        self.assertEqual(calls, [None])
+        self.assertEqual(work.profile_span, 'asym')
+
+    def test_server_timing(self):
+        response = ProfilingMiddleware(self.view)(self.request)
+        self.assertEqual(response.content, b'ok')
+        entries = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(entries), {'db', 'kdf', 'sym', 'total'})
+        self.assertTrue(entries['db'].endswith('desc="1 ops"'))
+        self.assertTrue(entries['sym'].endswith('desc="100 bytes"'))
+        self.assertTrue(entries['total'].startswith('dur='))
+        # Le profil ne fuit pas hors de la requête
+        self.assertIsNone(current_profile())
+
+    def test_async(self):
+        async def view(request):
+            profile = current_profile()
+            with span('asym'):
+                pass
+            return HttpResponse(str(profile is not None))
+
+        middleware = ProfilingMiddleware(view)
+        response = asyncio.run(middleware(self.request))
+        self.assertEqual(response.content, b'True')
+        self.assertIn('asym;dur=', response['Server-Timing'])
+
+    def test_disabled(self):
+        with mock.patch('crypto.profiling.PROFILING_ENABLED', False):
+            response = ProfilingMiddleware(self.view)(self.request)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.requests, {})
+
+    def test_server_timing_off(self):
+        with mock.patch('crypto.profiling.PROFILING_SERVER_TIMING', False):
+            response = ProfilingMiddleware(self.view)(self.request)
+        self.assertNotIn('Server-Timing', response)
+        # Agrégé quand même
+        self.assertEqual(metrics.requests['unresolved'].count, 1)
+
+    def test_slow_request_log(self):
+        with mock.patch('crypto.profiling.PROFILING_SLOW_REQUEST_MS', 0), \
+                self.assertLogs('securechat.profiling', 'INFO') as logs:
+            ProfilingMiddleware(self.view)(self.request)
+        [line] = logs.records
+        entry = json.loads(line.getMessage())
+        self.assertEqual((entry['view'], entry['method'], entry['path'], entry['status']), ('unresolved', 'GET', '/profiled/', 200))
+        self.assertEqual(entry['spans']['sym']['bytes'], 100)
+
+    def test_sampled_log(self):
+        with mock.patch('crypto.profiling.PROFILING_LOG_SAMPLE_RATE', 0.5), \
+                mock.patch('crypto.profiling.random.random', side_effect=[0.9, 0.1]), \
+                self.assertLogs('securechat.profiling', 'INFO') as logs:
+            ProfilingMiddleware(self.view)(self.request)
+            ProfilingMiddleware(self.view)(self.request)
+        self.assertEqual(len(logs.records), 1)
+
+    def test_request_through_the_stack(self):
+        user = CustomUser.objects.create_user(username='alice')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('received_encrypted_messages'), {'mode': 'envelope'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(metrics.requests['received_encrypted_messages'].count, 1)
+
+    def test_profile_summary(self):
+        profile = RequestProfile()
+        profile.add('asym', 0.002)
+        profile.add('asym', 0.001)
+        profile.add('sym', 0.0005, 64)
+        profile.finish()
+        self.assertEqual(profile.spans['asym'][:1] + profile.spans['sym'][::2], [2, 1, 64])
+        self.assertTrue(profile.server_timing().startswith('asym;dur=3.00;desc="2 ops", sym;dur=0.50;desc="64 bytes", total;dur='))
+        self.assertEqual(profile.as_dict()['spans']['sym']['bytes'], 64)
+
+
+class ProfilingMetricsViewTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        profile = RequestProfile()
+        profile.add('asym', 0.003)
+        profile.add('sym', 0.002, 128)
+        profile.finish()
+        profile.duration = 0.02
+        metrics.observe('received_encrypted_messages', profile)
+
+    def test_render(self):
+        lines = metrics.render().splitlines()
+        view = 'view="received_encrypted_messages"'
+        for line in (
+            '# TYPE securechat_request_duration_seconds histogram',
+            f'securechat_request_duration_seconds_bucket{{{view},le="0.01"}} 0',
+            f'securechat_request_duration_seconds_bucket{{{view},le="0.025"}} 1',
+            f'securechat_request_duration_seconds_bucket{{{view},le="+Inf"}} 1',
+            f'securechat_request_duration_seconds_count{{{view}}} 1',
+            f'securechat_span_duration_seconds_count{{{view},span="asym"}} 1',
+            f'securechat_span_operations_total{{{view},span="asym"}} 1',
+            f'securechat_span_bytes_total{{{view},span="sym"}} 128',
+        ):
+            self.assertIn(line, lines)
+
+    @override_settings(INTERNAL_IPS=[])
+    def test_permissions(self):
+        url = reverse('profiling_metrics')
+        client = APIClient()
+        self.assertIn(client.get(url).status_code, (401, 403))
+        client.force_authenticate(CustomUser.objects.create_user(username='alice'))
+        self.assertEqual(client.get(url).status_code, 403)
+        client.force_authenticate(CustomUser.objects.create_user(username='admin', is_staff=True))
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'securechat_request_duration_seconds_count{view="received_encrypted_messages"} 1', response.content)
+
+    @override_settings(INTERNAL_IPS=['10.0.0.5'])
+    def test_internal_ip(self):
+        response = APIClient().get(reverse('profiling_metrics'), REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_measure(self):
+        calls = []
+        result = benchmarks.measure('noop', lambda: calls.append(1), repeat=3, size=16)
+        # Échauffement + 3 mesures
+        self.assertEqual(len(calls), 4)
+        self.assertEqual((result['name'], result['params'], result['iterations']), ('noop', {'size': 16}, 3))
+        self.assertLessEqual(result['min_ms'], result['p50_ms'])
+        self.assertLessEqual(result['p50_ms'], result['max_ms'])
+
+    def test_sample_payloads(self):
+        payloads = benchmarks.sample_payloads(512)
+        self.assertEqual(set(payloads), {'logs', 'json', 'random'})
+        self.assertTrue(all(len(payload) == 512 for payload in payloads.values()))
+        self.assertEqual(benchmarks.sample_payloads(512), payloads)
+        # Les logs se compressent, le base64 aléatoire beaucoup moins
+        self.assertLess(len(zlib.compress(payloads['logs'])), len(zlib.compress(payloads['random'])))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CryptoBenchCommandTests(TestCase):
+    def setUp(self):
+        pool = CryptoWorkerPool(max_workers=0)
+        for patcher in (
+            mock.patch('users.utils.crypto_pool', pool),
+            mock.patch('users.utils.PRIVATE_KEY_KDF_ITERATIONS', 1000),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def bench(self, *args):
+        out = io.StringIO()
+        call_command('crypto_bench', '--repeat', '2', *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_symmetric(self):
+        report = self.bench('--only', 'symmetric', '--sizes', '16,64')
+        self.assertEqual(report['meta']['database'], connection.vendor)
+        self.assertEqual(
+            [(row['name'], row['params']['size']) for row in report['results']],
+            [('encrypt_message', 16), ('decrypt_message', 16), ('encrypt_message', 64), ('decrypt_message', 64)]
+        )
+        self.assertTrue(all(row['iterations'] == 2 for row in report['results']))
+
+    def test_views_are_rolled_back(self):
+        report = self.bench(
+            '--only', 'views', '--sizes', '16', '--inbox-sizes', '3', '--key-type', 'x25519', '--sessions',
+        )
+        names = [row['name'] for row in report['results']]
+        self.assertEqual(names, ['view.send', 'view.inbox_page', 'view.inbox_page_envelope', 'view.inbox_stream'])
+        self.assertEqual(report['results'][1]['params'], {'rows': 3, 'key_type': 'x25519', 'sessions': True})
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_output_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.json')
+            out = io.StringIO()
+            call_command('crypto_bench', '--only', 'symmetric', '--sizes', '16', '--repeat', '1', '--output', path, stdout=out)
+            self.assertEqual(out.getvalue(), '')
+            with open(path) as f:
+                self.assertEqual(len(json.load(f)['results']), 2)
@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import ProfilingMetricsView
+
+urlpatterns = [
+    path('metrics/', ProfilingMetricsView.as_view(), name='profiling_metrics'),
+]
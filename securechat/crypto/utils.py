@@ -1,33 +1,268 @@
 import os
-from base64 import b64encode, b64decode
-from cryptography.hazmat.primitives import padding, hashes, hmac
+import zlib
+from base64 import b64decode
+from cryptography.hazmat.primitives import padding, hashes
+from cryptography.hazmat.primitives.asymmetric import padding as asym_padding
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
-def encrypt_message(key: bytes, plaintext: str):
-    iv = os.urandom(16)
-    padder = padding.PKCS7(128).padder()
-    padded_data = padder.update(plaintext.encode()) + padder.finalize()
+from django.conf import settings
 
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-    encryptor = cipher.encryptor()
-    ciphertext = encryptor.update(padded_data) + encryptor.finalize()
+from .profiling import timed
 
-    # HMAC
-    h = hmac.HMAC(key, hashes.SHA256())
-    h.update(ciphertext)
-    tag = h.finalize()
+# Padding RSA-OAEP utilisé pour envelopper les clés AES des messages
+OAEP_PADDING = asym_padding.OAEP(
+    mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
 
-    return b64encode(ciphertext).decode(), b64encode(iv).decode(), b64encode(tag).decode()
+# Formats d'enveloppe des messages.
+# v1 : AES-256-CBC + PKCS7, IV stocké à part, sans octet de version ni intégrité.
+# v2 : version (1 octet) | nonce (12 octets) | ciphertext + tag GCM (16 octets).
+# v3 : comme v2, le clair étant compressé (zlib) avant chiffrement.
+ENVELOPE_V1_CBC = 1
+ENVELOPE_V2_GCM = 2
+ENVELOPE_V3_GCM_ZLIB = 3
+GCM_NONCE_SIZE = 12
 
-def decrypt_message(key: bytes, ciphertext_b64: str, iv_b64: str):
-    ciphertext = b64decode(ciphertext_b64)
-    iv = b64decode(iv_b64)
+# La compression révèle la compressibilité du clair (taille du chiffré) :
+# à désactiver si un attaquant peut mêler ses données à un secret (type CRIME).
+MESSAGE_COMPRESSION_ENABLED = getattr(settings, 'MESSAGE_COMPRESSION_ENABLED', True)
+MESSAGE_COMPRESSION_MIN_SIZE = getattr(settings, 'MESSAGE_COMPRESSION_MIN_SIZE', 1024)
+MESSAGE_COMPRESSION_LEVEL = getattr(settings, 'MESSAGE_COMPRESSION_LEVEL', 6)
+# Borne à la décompression (bombe zlib)
+MESSAGE_MAX_DECOMPRESSED_SIZE = getattr(settings, 'MESSAGE_MAX_DECOMPRESSED_SIZE', 64 * 1024 * 1024)
 
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-    decryptor = cipher.decryptor()
+# Enveloppe X25519 d'une clé AES : clé publique éphémère (32 octets) | clé AES
+# enveloppée en AES-KW (RFC 3394) sous une clé dérivée par ECDH + HKDF.
+X25519_KEY_SIZE = 32
+X25519_WRAP_INFO = b'securechat x25519 aes key wrap'
+
+# Pièces jointes : fichier découpé en blocs chiffrés séparément en AES-256-GCM.
+# Nonce = préfixe aléatoire du fichier (8 octets) | index du bloc (4 octets) ;
+# l'index et le drapeau « dernier bloc » sont authentifiés (AAD) : un bloc ne
+# peut être ni déplacé, ni rejoué dans un autre fichier, ni le fichier tronqué.
+CHUNK_NONCE_PREFIX_SIZE = 8
+GCM_TAG_SIZE = 16
+
+
+def _as_bytes(data):
+    # Compatibilité : les anciens appelants passent du base64 (str)
+    return b64decode(data) if isinstance(data, str) else data
+
+
+def server_key(purpose: bytes, configured: str = None) -> bytes:
+    """
+    Clé AES-256 détenue par le serveur, jamais stockée à côté de ce qu'elle
+    chiffre : ``configured`` (base64) si fourni, sinon dérivée de SECRET_KEY
+    par HKDF avec ``purpose`` comme contexte (une clé distincte par usage).
+    """
+    if configured:
+        return b64decode(configured)
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None, info=purpose,
+    ).derive(settings.SECRET_KEY.encode())
+
+def _encrypt_gcm(key: bytes, plaintext: bytes, version: int = ENVELOPE_V2_GCM) -> bytes:
+    header = bytes([version])
+    nonce = os.urandom(GCM_NONCE_SIZE)
+    # L'octet de version est authentifié (AAD) : impossible de le modifier sans casser le tag
+    return header + nonce + AESGCM(key).encrypt(nonce, plaintext, header)
+
+def _decrypt_gcm(key: bytes, envelope: bytes) -> bytes:
+    envelope = bytes(envelope)
+    header, nonce = envelope[:1], envelope[1:1 + GCM_NONCE_SIZE]
+    return AESGCM(key).decrypt(nonce, envelope[1 + GCM_NONCE_SIZE:], header)
+
+def _decrypt_cbc(key: bytes, iv: bytes, ciphertext: bytes) -> bytes:
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
     padded_data = decryptor.update(ciphertext) + decryptor.finalize()
 
     unpadder = padding.PKCS7(128).unpadder()
-    plaintext = unpadder.update(padded_data) + unpadder.finalize()
+    return unpadder.update(padded_data) + unpadder.finalize()
+
+@timed('compress', size_arg=0)
+def _compress(plaintext: bytes) -> bytes:
+    return zlib.compress(plaintext, MESSAGE_COMPRESSION_LEVEL)
+
+@timed('compress', size_arg=0)
+def _decompress(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj()
+    plaintext = decompressor.decompress(data, MESSAGE_MAX_DECOMPRESSED_SIZE)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('Compressed message is too large or truncated')
+    return plaintext
+
+def _decrypt_gcm_zlib(key: bytes, envelope: bytes) -> bytes:
+    return _decompress(_decrypt_gcm(key, envelope))
+
+# Déchiffrement par octet de version (formats v2 et suivants)
+ENVELOPE_DECRYPTORS = {
+    ENVELOPE_V2_GCM: _decrypt_gcm,
+    ENVELOPE_V3_GCM_ZLIB: _decrypt_gcm_zlib,
+}
+
+
+def envelope_version(envelope: bytes, iv: bytes = None) -> int:
+    """
+    Version d'une enveloppe stockée. Les lignes v1 (CBC) n'ont pas d'octet de
+    version : on les reconnaît à leur IV séparé non vide.
+    """
+    if iv:
+        return ENVELOPE_V1_CBC
+    return envelope[0]
+
+@timed('sym', size_arg=1)
+def seal_envelope(key: bytes, plaintext: bytes, compress: bool = None) -> bytes:
+    """
+    Chiffre ``plaintext`` en AES-256-GCM : v3 (compressé) à partir de
+    ``MESSAGE_COMPRESSION_MIN_SIZE`` octets si zlib fait gagner de la place,
+    sinon v2.
+
+    :param compress: force/désactive la compression (défaut : ``MESSAGE_COMPRESSION_ENABLED``)
+    """
+    if compress is None:
+        compress = MESSAGE_COMPRESSION_ENABLED
+    if compress and len(plaintext) >= MESSAGE_COMPRESSION_MIN_SIZE:
+        compressed = _compress(plaintext)
+        if len(compressed) < len(plaintext):
+            return _encrypt_gcm(key, compressed, ENVELOPE_V3_GCM_ZLIB)
+    return _encrypt_gcm(key, plaintext)
+
+@timed('sym', size_arg=1)
+def open_envelope(key: bytes, envelope: bytes, iv: bytes = None) -> bytes:
+    """
+    Déchiffre une enveloppe en choisissant l'algorithme selon sa version.
+
+    :param iv: IV séparé des lignes v1 (CBC) ; vide/None pour les formats versionnés
+    :raises ValueError: version inconnue, ou message v3 au-delà de ``MESSAGE_MAX_DECOMPRESSED_SIZE``
+    :raises cryptography.exceptions.InvalidTag: message altéré (v2, v3)
+    """
+    version = envelope_version(envelope, iv)
+    if version == ENVELOPE_V1_CBC:
+        return _decrypt_cbc(key, bytes(iv), bytes(envelope))
+
+    decrypt = ENVELOPE_DECRYPTORS.get(version)
+    if decrypt is None:
+        raise ValueError(f'Unsupported message envelope version: {version}')
+    return decrypt(key, envelope)
+
+def encrypt_message(key: bytes, plaintext: str) -> bytes:
+    """Chiffre un texte avec ``key`` ; retourne l'enveloppe v2 ou v3 (bytes, cf. ``seal_envelope``)."""
+    return seal_envelope(key, plaintext.encode())
+
+def decrypt_message(key: bytes, envelope, iv=None) -> str:
+    """
+    Déchiffre une enveloppe (bytes ou base64). ``iv`` n'est fourni que pour
+    les anciens messages CBC.
+    """
+    envelope = _as_bytes(envelope)
+    iv = _as_bytes(iv) if iv is not None else None
+    return open_envelope(key, envelope, iv).decode()
+
+def encrypt_payload(plaintext: str):
+    """
+    Chiffre un message avec une clé AES-256 neuve (enveloppe v2/v3, AES-GCM).
+
+    :return: (aes_key, envelope) en bytes
+    """
+    aes_key = AESGCM.generate_key(bit_length=256)
+    return aes_key, seal_envelope(aes_key, plaintext.encode())
+
+def _x25519_kek(shared_secret: bytes, ephemeral_public: bytes, recipient_public: bytes) -> bytes:
+    # Les deux clés publiques servent de sel : la clé dérivée est propre à cet échange
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32,
+        salt=ephemeral_public + recipient_public, info=X25519_WRAP_INFO
+    ).derive(shared_secret)
+
+def _raw_public_bytes(public_key) -> bytes:
+    return public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+@timed('asym')
+def wrap_aes_key(public_key, aes_key: bytes) -> bytes:
+    """
+    Chiffre une clé AES pour le destinataire selon le type de sa clé :
+    RSA-OAEP, ou X25519 (ECDH éphémère + HKDF + AES-KW), bien moins coûteux.
+    """
+    if isinstance(public_key, X25519PublicKey):
+        ephemeral = X25519PrivateKey.generate()
+        ephemeral_public = _raw_public_bytes(ephemeral.public_key())
+        kek = _x25519_kek(ephemeral.exchange(public_key), ephemeral_public, _raw_public_bytes(public_key))
+        return ephemeral_public + aes_key_wrap(kek, aes_key)
+
+    return public_key.encrypt(aes_key, OAEP_PADDING)
+
+@timed('asym')
+def unwrap_aes_key(private_key, encrypted_aes_key: bytes) -> bytes:
+    """
+    Déchiffre une clé AES enveloppée par ``wrap_aes_key`` (RSA-OAEP ou X25519).
+    """
+    encrypted_aes_key = bytes(encrypted_aes_key)
+
+    if isinstance(private_key, X25519PrivateKey):
+        ephemeral_public = encrypted_aes_key[:X25519_KEY_SIZE]
+        shared_secret = private_key.exchange(X25519PublicKey.from_public_bytes(ephemeral_public))
+        kek = _x25519_kek(shared_secret, ephemeral_public, _raw_public_bytes(private_key.public_key()))
+        return aes_key_unwrap(kek, encrypted_aes_key[X25519_KEY_SIZE:])
+
+    return private_key.decrypt(encrypted_aes_key, OAEP_PADDING)
+
+def _chunk_nonce_aad(prefix: bytes, index: int, final: bool):
+    position = index.to_bytes(4, 'big')
+    return prefix + position, bytes([ENVELOPE_V2_GCM]) + position + bytes([final])
+
+@timed('sym', size_arg=3)
+def seal_chunk(key: bytes, prefix: bytes, index: int, plaintext: bytes, final: bool) -> bytes:
+    """Chiffre le bloc ``index`` d'un fichier ; sortie = ``len(plaintext) + GCM_TAG_SIZE`` octets."""
+    nonce, aad = _chunk_nonce_aad(prefix, index, final)
+    return AESGCM(key).encrypt(nonce, plaintext, aad)
+
+@timed('sym', size_arg=3)
+def open_chunk(key: bytes, prefix: bytes, index: int, ciphertext: bytes, final: bool) -> bytes:
+    """
+    :raises cryptography.exceptions.InvalidTag: bloc altéré, déplacé ou mauvais drapeau final
+    """
+    nonce, aad = _chunk_nonce_aad(prefix, index, final)
+    return AESGCM(key).decrypt(nonce, bytes(ciphertext), aad)
+
+def seal_stream(key: bytes, prefix: bytes, read, chunk_size: int):
+    """
+    Chiffre un flux bloc par bloc : ``read(n)`` est appelé jusqu'à ce qu'il
+    retourne ``b''``. Un bloc est lu d'avance pour savoir lequel est le
+    dernier ; un flux vide donne un seul bloc vide. Mémoire : deux blocs.
+
+    :return: générateur de (bloc clair, bloc chiffré)
+    """
+    index = 0
+    current = _read_exactly(read, chunk_size)
+    while True:
+        following = _read_exactly(read, chunk_size) if len(current) == chunk_size else b''
+        final = not following
+        yield current, seal_chunk(key, prefix, index, current, final)
+        if final:
+            return
+        current = following
+        index += 1
+
+def _read_exactly(read, size: int) -> bytes:
+    # Les flux réseau peuvent rendre moins que demandé avant la fin
+    data = read(size)
+    while data and len(data) < size:
+        more = read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
 
-    return plaintext.decode()
+def decrypt_payload(aes_key: bytes, iv: bytes, envelope: bytes) -> bytes:
+    """
+    Déchiffre le contenu d'un message stocké (v1 CBC si ``iv`` est non vide,
+    sinon selon l'octet de version).
+    """
+    return open_envelope(aes_key, envelope, iv)
@@ -1,3 +1,23 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.permissions import BasePermission, IsAdminUser
+from rest_framework.views import APIView
 
-# Create your views here.
+from .profiling import metrics
+
+
+class IsAdminOrInternalIP(BasePermission):
+    """Administrateur, ou scraper Prometheus depuis une IP de ``INTERNAL_IPS``."""
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in getattr(settings, 'INTERNAL_IPS', ()):
+            return True
+        return IsAdminUser().has_permission(request, view)
+
+
+class ProfilingMetricsView(APIView):
+    """Histogrammes par vue de ``crypto.profiling`` au format texte Prometheus."""
+    permission_classes = [IsAdminOrInternalIP]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -13,4 +13,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'securechat.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importé après get_asgi_application() : les apps doivent être chargées
+from chat.realtime import ProtocolRouter, websocket_application  # noqa: E402
+
+application = ProtocolRouter({
+    'http': django_application,
+    'websocket': websocket_application,
+})
@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # En premier : mesure toute la requête (cf. crypto.profiling)
+    'crypto.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +93,34 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Inbox chaude (cf. chat.inbox_cache) : au plus 2 x INBOX_CACHE_WINDOW_BYTES
+    # (64 Kio) par destinataire, éviction LRU au-delà de MAX_ENTRIES. Propre à
+    # chaque processus : utiliser Redis/Memcached avec plusieurs workers.
+    'inbox': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'inbox',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    # Clés privées déverrouillées des sessions (cf. users.keyring), chiffrées
+    # sous une clé serveur. Doit être partagé par tous les workers
+    # (Redis/Memcached) : avec LocMemCache, une requête servie par un autre
+    # worker que celui du login répond 403 « Private key locked ».
+    'keyring': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'keyring',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -134,6 +164,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication avec principal en cache et colonnes de clés différées
+        'users.authentication.CachedJWTAuthentication',
     ),
 }
\ No newline at end of file
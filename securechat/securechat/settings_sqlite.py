@@ -0,0 +1,19 @@
+"""
+Settings pour les benchmarks et tests de charge locaux.
+
+Remplace la base MySQL de ``settings.DATABASES`` par un fichier SQLite :
+
+    python manage.py crypto_bench --settings=securechat.settings_sqlite
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'bench.sqlite3',
+    }
+}
+
+ALLOWED_HOSTS = ['testserver', 'localhost', '127.0.0.1']
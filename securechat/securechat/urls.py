@@ -21,4 +21,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/users/', include('users.urls')),
     path('api/messages/', include('chat.urls')),
+    path('api/crypto/', include('crypto.urls')),
 ]
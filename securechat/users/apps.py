@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.conf import settings
+
+        # Signaux d'invalidation du cache des principaux JWT
+        from . import authentication  # noqa: F401
+        from . import checks  # noqa: F401
+
+        if getattr(settings, 'KEY_POOL_AUTOSTART', False):
+            from .keypool import start_refiller
+            start_refiller()
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+User = get_user_model()
+
+# Colonnes chargées pour authentifier une requête ; le reste du profil est
+# différé (chargé à l'accès), les clés sont dans UserKey.
+PRINCIPAL_FIELDS = ['id', 'username', 'is_active', 'is_staff', 'is_superuser']
+if api_settings.CHECK_REVOKE_TOKEN:
+    PRINCIPAL_FIELDS.append('password')
+# Model.from_db attend les valeurs dans l'ordre des colonnes du modèle
+_column_order = [field.attname for field in User._meta.concrete_fields]
+PRINCIPAL_FIELDS.sort(key=_column_order.index)
+
+AUTH_PRINCIPAL_CACHE_ALIAS = getattr(settings, 'AUTH_PRINCIPAL_CACHE_ALIAS', 'default')
+# Courte et indépendante de la durée du token : c'est le délai maximal avant
+# qu'une désactivation soit vue par un worker dont le cache n'est pas invalidé
+# (cache par processus). Jamais plus longue qu'un access token.
+AUTH_PRINCIPAL_CACHE_TTL = min(
+    getattr(settings, 'AUTH_PRINCIPAL_CACHE_TTL', 30),
+    api_settings.ACCESS_TOKEN_LIFETIME.total_seconds(),
+)
+
+
+def _principal_key(user_id):
+    return f'users:principal:{user_id}'
+
+
+def get_principal_cache():
+    return caches[AUTH_PRINCIPAL_CACHE_ALIAS]
+
+
+def invalidate_principal(user_id):
+    get_principal_cache().delete(_principal_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` sans requête complète sur l'utilisateur.
+
+    L'id vient des claims du token validé. Le principal (``PRINCIPAL_FIELDS``)
+    est lu avec ``.only()`` puis mis en cache ``AUTH_PRINCIPAL_CACHE_TTL``
+    secondes (30 par défaut). Il est reconstruit en instance ``CustomUser`` dont les autres
+    champs sont différés : ``request.user.email`` reste utilisable (une
+    requête à la première lecture).
+
+    Le cache est invalidé à chaque sauvegarde ou suppression de
+    l'utilisateur (désactivation comprise). Les ``QuerySet.update()`` ne
+    passent pas par les signaux : appeler ``invalidate_principal``. Avec le
+    cache local-memory (par processus), les autres workers voient la
+    désactivation au plus tard après ``AUTH_PRINCIPAL_CACHE_TTL`` : utiliser
+    un cache partagé en multi-processus (cf. ``check --deploy``, users.W002).
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        cache = get_principal_cache()
+        values = cache.get(_principal_key(user_id))
+        if values is None:
+            values = (
+                User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+                .values_list(*PRINCIPAL_FIELDS).first()
+            )
+            if values is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            cache.set(_principal_key(user_id), values, AUTH_PRINCIPAL_CACHE_TTL)
+
+        user = User.from_db(User.objects.db, PRINCIPAL_FIELDS, values)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            from rest_framework_simplejwt.utils import get_md5_hash_password
+
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
+
+
+@receiver(post_save, sender=User, dispatch_uid='users.invalidate_principal_on_save')
+@receiver(post_delete, sender=User, dispatch_uid='users.invalidate_principal_on_delete')
+def _invalidate_principal(sender, instance, **kwargs):
+    invalidate_principal(instance.pk)
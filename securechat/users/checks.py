@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core import checks
+
+_PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_keyring_cache(app_configs, **kwargs):
+    """Le trousseau des clés déverrouillées doit être partagé entre les workers."""
+    from .keyring import PRIVATE_KEY_KEYRING_CACHE
+
+    alias = PRIVATE_KEY_KEYRING_CACHE if PRIVATE_KEY_KEYRING_CACHE in settings.CACHES else 'default'
+    backend = settings.CACHES[alias]['BACKEND']
+    if backend == 'django.core.cache.backends.dummy.DummyCache':
+        return [checks.Error(
+            f"The '{alias}' cache used by the private key keyring discards every entry.",
+            hint='Every request would answer 403 "Private key locked"; use Redis or Memcached.',
+            id='users.E001',
+        )]
+    if backend in _PROCESS_LOCAL_BACKENDS:
+        return [checks.Warning(
+            f"The '{alias}' cache used by the private key keyring is local to each process.",
+            hint='With several workers, use Redis or Memcached (or run a single worker).',
+            id='users.W001',
+        )]
+    return []
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_principal_cache(app_configs, **kwargs):
+    """Une désactivation doit invalider le principal mis en cache sur tous les workers."""
+    from .authentication import AUTH_PRINCIPAL_CACHE_ALIAS, AUTH_PRINCIPAL_CACHE_TTL
+
+    backend = settings.CACHES[AUTH_PRINCIPAL_CACHE_ALIAS]['BACKEND']
+    if backend == 'django.core.cache.backends.locmem.LocMemCache':
+        return [checks.Warning(
+            f"The '{AUTH_PRINCIPAL_CACHE_ALIAS}' cache used for JWT principals is local to each process.",
+            hint=(
+                f'A deactivated user keeps access for up to {AUTH_PRINCIPAL_CACHE_TTL:g}s on the other '
+                'workers; use Redis or Memcached (AUTH_PRINCIPAL_CACHE_ALIAS) or run a single worker.'
+            ),
+            id='users.W002',
+        )]
+    return []
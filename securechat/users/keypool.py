@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+from crypto.utils import server_key
+
+from .models import PooledKeyPair
+from .utils import crypto_pool, generate_rsa_key_pair, CryptoServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+KEY_POOL_ENABLED = getattr(settings, 'KEY_POOL_ENABLED', True)
+KEY_POOL_LOW_WATERMARK = getattr(settings, 'KEY_POOL_LOW_WATERMARK', 10)
+KEY_POOL_HIGH_WATERMARK = getattr(settings, 'KEY_POOL_HIGH_WATERMARK', 50)
+KEY_POOL_REFILL_INTERVAL = getattr(settings, 'KEY_POOL_REFILL_INTERVAL', 5)
+# Clé AES-256 (base64) qui chiffre les clés privées du pool ; dérivée de SECRET_KEY si absente
+KEY_POOL_WRAP_KEY = getattr(settings, 'KEY_POOL_WRAP_KEY', None)
+
+_NONCE_SIZE = 12
+
+
+def _wrap_key():
+    # Clé détenue par le serveur, jamais en base : une sauvegarde ou un
+    # réplica de la table ne contient aucune clé privée exploitable.
+    return server_key(b'securechat key pool', KEY_POOL_WRAP_KEY)
+
+
+def seal_private_key(private_pem, public_pem):
+    """Chiffre la clé privée (AES-256-GCM, clé publique en données associées)."""
+    nonce = os.urandom(_NONCE_SIZE)
+    return nonce + AESGCM(_wrap_key()).encrypt(nonce, private_pem, public_pem)
+
+
+def open_private_key(wrapped, public_pem):
+    """:raises InvalidTag: clé serveur changée ou ligne altérée"""
+    wrapped = bytes(wrapped)
+    return AESGCM(_wrap_key()).decrypt(wrapped[:_NONCE_SIZE], wrapped[_NONCE_SIZE:], public_pem)
+
+
+class KeyPoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.taken = 0
+        self.fallbacks = 0
+        self.discarded = 0
+        self.generated = 0
+        self.last_refill_count = 0
+        self.last_refill_seconds = 0.0
+
+    def incr(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def record_refill(self, count, seconds):
+        with self._lock:
+            self.generated += count
+            self.last_refill_count = count
+            self.last_refill_seconds = seconds
+
+
+stats = KeyPoolStats()
+
+# Réveille le thread de remplissage quand le pool passe sous le seuil bas
+_refill_wanted = threading.Event()
+
+
+def take_key_pair():
+    """
+    Consomme une paire pré-générée, ou en génère une si le pool est vide.
+
+    La consommation est atomique : la ligne n'est attribuée qu'à l'appelant
+    dont le DELETE l'a effectivement supprimée. Une ligne illisible (clé
+    serveur changée) est abandonnée.
+
+    :return: (private_pem, public_pem) en bytes, comme generate_rsa_key_pair()
+    """
+    if KEY_POOL_ENABLED:
+        for _ in range(3):
+            pair = PooledKeyPair.objects.order_by('id').first()
+            if pair is None:
+                break
+            deleted, _ = PooledKeyPair.objects.filter(pk=pair.pk).delete()
+            if deleted:
+                if PooledKeyPair.objects.count() < KEY_POOL_LOW_WATERMARK:
+                    _refill_wanted.set()
+                public_pem = pair.public_key.encode()
+                try:
+                    private_pem = open_private_key(pair.private_key_wrapped, public_pem)
+                except InvalidTag:
+                    logger.warning('Discarding unreadable pooled key pair %s', pair.pk)
+                    stats.incr('discarded')
+                    continue
+                stats.incr('taken')
+                return private_pem, public_pem
+
+        _refill_wanted.set()
+
+    stats.incr('fallbacks')
+    return crypto_pool.run(generate_rsa_key_pair)
+
+
+def refill(low=KEY_POOL_LOW_WATERMARK, high=KEY_POOL_HIGH_WATERMARK, generate=generate_rsa_key_pair):
+    """
+    Remplit le pool jusqu'à ``high`` paires s'il est passé sous ``low``.
+
+    :return: nombre de paires ajoutées
+    """
+    depth = PooledKeyPair.objects.count()
+    if depth >= low:
+        return 0
+
+    start = time.monotonic()
+    added = 0
+    for _ in range(high - depth):
+        private_pem, public_pem = generate()
+        PooledKeyPair.objects.create(
+            public_key=public_pem.decode(),
+            private_key_wrapped=seal_private_key(private_pem, public_pem),
+        )
+        added += 1
+
+    stats.record_refill(added, time.monotonic() - start)
+    return added
+
+
+def metrics():
+    depth = PooledKeyPair.objects.count()
+    with stats._lock:
+        rate = stats.last_refill_count / stats.last_refill_seconds if stats.last_refill_seconds else 0.0
+        return {
+            'depth': depth,
+            'low_watermark': KEY_POOL_LOW_WATERMARK,
+            'high_watermark': KEY_POOL_HIGH_WATERMARK,
+            'taken': stats.taken,
+            'fallbacks': stats.fallbacks,
+            'discarded': stats.discarded,
+            'generated': stats.generated,
+            'refill_rate_per_s': rate,
+        }
+
+
+class KeyPoolRefiller(threading.Thread):
+    """Thread de fond qui maintient le pool entre les deux seuils."""
+
+    def __init__(self, interval=KEY_POOL_REFILL_INTERVAL):
+        super().__init__(name='key-pool-refiller', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                # La génération passe par le pool de processus (file bornée)
+                refill(generate=lambda: crypto_pool.run(generate_rsa_key_pair))
+            except CryptoServiceUnavailable:
+                pass
+            except Exception:
+                logger.exception('Key pool refill failed')
+            _refill_wanted.wait(self.interval)
+            _refill_wanted.clear()
+
+    def stop(self):
+        self._stopped.set()
+        _refill_wanted.set()
+
+
+_refiller = None
+
+
+def start_refiller():
+    global _refiller
+    if _refiller is None or not _refiller.is_alive():
+        _refiller = KeyPoolRefiller()
+        _refiller.start()
+    return _refiller
@@ -0,0 +1,237 @@
+import json
+import os
+import time
+import uuid
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.settings import api_settings
+
+from crypto.cache import LRUCache
+from crypto.utils import server_key
+
+# Claim JWT qui relie les tokens d'une même session (copié du refresh vers les access)
+SESSION_CLAIM = 'sid'
+
+# Trousseau partagé entre les workers : alias de cache (Redis/Memcached en
+# production) où chaque session est stockée chiffrée sous une clé serveur
+PRIVATE_KEY_KEYRING_CACHE = getattr(settings, 'PRIVATE_KEY_KEYRING_CACHE', 'keyring')
+# Clé AES-256 (base64) du trousseau partagé ; dérivée de SECRET_KEY si absente
+PRIVATE_KEY_KEYRING_WRAP_KEY = getattr(settings, 'PRIVATE_KEY_KEYRING_WRAP_KEY', None)
+PRIVATE_KEY_KEYRING_TTL = getattr(
+    settings, 'PRIVATE_KEY_KEYRING_TTL',
+    api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+)
+
+_VERSION_SIZE = 16
+_NONCE_SIZE = 12
+
+
+class UnlockedKeys:
+    """
+    Clés privées déverrouillées d'une session, par ``key_id`` : la clé active
+    et les clés retirées par rotation (les anciens messages restent lisibles).
+    """
+
+    __slots__ = ('keys', 'active_key_id')
+
+    def __init__(self, keys, active_key_id):
+        self.keys = keys
+        self.active_key_id = active_key_id
+
+    @property
+    def active(self):
+        return self.keys[self.active_key_id]
+
+    def for_key(self, key_id):
+        """
+        Clé privée ``key_id`` (la clé active si ``key_id`` est vide).
+
+        :raises LookupError: clé inconnue (non déverrouillée pour cette session)
+        """
+        try:
+            return self.keys[key_id or self.active_key_id]
+        except KeyError:
+            raise LookupError(f'Private key {key_id[:16]} is not unlocked')
+
+    def wipe(self):
+        # OpenSSL efface les composantes privées (BN_clear_free) quand
+        # la dernière référence à la clé est libérée.
+        self.keys = {}
+
+
+def _wipe_entry(key, entry):
+    entry[1].wipe()
+
+
+# Clés déjà parsées par ce processus, avec la version de l'entrée partagée
+# dont elles viennent : évite de déchiffrer et parser à chaque requête.
+keyring = LRUCache(
+    name='unlocked_keys',
+    maxsize=getattr(settings, 'PRIVATE_KEY_KEYRING_SIZE', 10000),
+    ttl=PRIVATE_KEY_KEYRING_TTL,
+    on_evict=_wipe_entry,
+)
+
+
+def shared_keyring():
+    alias = PRIVATE_KEY_KEYRING_CACHE if PRIVATE_KEY_KEYRING_CACHE in settings.CACHES else 'default'
+    return caches[alias]
+
+
+def _entry_key(user_id, session_id):
+    return f'users:keyring:{user_id}:{session_id}'
+
+
+def _index_key(user_id):
+    # Sessions déverrouillées d'un utilisateur (rotation, cf. add_unlocked_key)
+    return f'users:keyring:{user_id}:sessions'
+
+
+def _seal_entry(user_id, session_id, pems, active_key_id, expires_at):
+    """
+    Entrée partagée : version (16 octets aléatoires) | nonce | AES-256-GCM du
+    JSON ``{active, expires_at, keys: {key_id: PEM}}``. L'utilisateur et la
+    session sont en données associées : une entrée ne peut pas être recopiée
+    sous une autre session.
+    """
+    payload = json.dumps({
+        'active': active_key_id,
+        'expires_at': expires_at,
+        'keys': {key_id: bytes(pem).decode('ascii') for key_id, pem in pems.items()},
+    }).encode()
+    nonce = os.urandom(_NONCE_SIZE)
+    aad = f'{user_id}:{session_id}'.encode()
+    sealed = AESGCM(server_key(b'securechat keyring', PRIVATE_KEY_KEYRING_WRAP_KEY)).encrypt(nonce, payload, aad)
+    return os.urandom(_VERSION_SIZE) + nonce + sealed
+
+
+def _open_entry(user_id, session_id, blob):
+    """:raises InvalidTag: clé serveur changée ou entrée altérée"""
+    blob = bytes(blob)
+    nonce = blob[_VERSION_SIZE:_VERSION_SIZE + _NONCE_SIZE]
+    aad = f'{user_id}:{session_id}'.encode()
+    payload = AESGCM(server_key(b'securechat keyring', PRIVATE_KEY_KEYRING_WRAP_KEY)).decrypt(
+        nonce, blob[_VERSION_SIZE + _NONCE_SIZE:], aad
+    )
+    data = json.loads(payload)
+    pems = {key_id: pem.encode('ascii') for key_id, pem in data['keys'].items()}
+    return pems, data['active'], data['expires_at']
+
+
+def _store_entry(user_id, session_id, pems, active_key_id, expires_at):
+    timeout = expires_at - time.time()
+    if timeout <= 0:
+        return None
+    blob = _seal_entry(user_id, session_id, pems, active_key_id, expires_at)
+    shared_keyring().set(_entry_key(user_id, session_id), blob, timeout)
+    return blob
+
+
+def _load_keys(pems, active_key_id):
+    keys = {
+        key_id: serialization.load_pem_private_key(bytes(pem), password=None)
+        for key_id, pem in pems.items()
+    }
+    return UnlockedKeys(keys, active_key_id)
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def unlock_private_keys(user_id, session_id, private_key_pems, active_key_id):
+    """
+    Garde les clés privées (PEM déjà déchiffrés) pour la durée de la session,
+    chiffrées dans le cache partagé : tous les workers y ont accès.
+
+    :param private_key_pems: ``{key_id: PEM}`` ; les PEM en bytearray sont remis à zéro
+    :return: ``UnlockedKeys``
+    """
+    unlocked = _load_keys(private_key_pems, active_key_id)
+    expires_at = time.time() + PRIVATE_KEY_KEYRING_TTL
+    blob = _store_entry(user_id, session_id, private_key_pems, active_key_id, expires_at)
+    for private_key_pem in private_key_pems.values():
+        if isinstance(private_key_pem, bytearray):
+            private_key_pem[:] = bytes(len(private_key_pem))
+    if blob is None:
+        # Durée de session nulle : rien à garder
+        return unlocked
+
+    cache = shared_keyring()
+    sessions = cache.get(_index_key(user_id)) or []
+    sessions = [sid for sid in sessions if cache.has_key(_entry_key(user_id, sid))] + [session_id]
+    cache.set(_index_key(user_id), sessions, PRIVATE_KEY_KEYRING_TTL)
+
+    keyring.set((user_id, session_id), (blob[:_VERSION_SIZE], unlocked))
+    return unlocked
+
+
+def get_unlocked_keys(user_id, session_id):
+    """Retourne les clés privées de la session (``UnlockedKeys``), ou None si elles sont verrouillées/expirées."""
+    if not session_id:
+        return None
+    blob = shared_keyring().get(_entry_key(user_id, session_id))
+    if blob is None:
+        # Verrouillée (déconnexion sur un autre worker) ou expirée
+        keyring.delete((user_id, session_id))
+        return None
+
+    version = bytes(blob[:_VERSION_SIZE])
+    entry = keyring.get((user_id, session_id))
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    try:
+        pems, active_key_id, _ = _open_entry(user_id, session_id, blob)
+    except InvalidTag:
+        return None
+    unlocked = _load_keys(pems, active_key_id)
+    keyring.set((user_id, session_id), (version, unlocked))
+    return unlocked
+
+
+def add_unlocked_key(user_id, key_id, private_key_pem):
+    """
+    Ajoute une nouvelle clé active aux sessions déverrouillées de ``user_id``
+    (rotation) : les messages enveloppés pour elle restent lisibles sans
+    nouvelle connexion. Chaque entrée est rechiffrée sans prolonger sa durée ;
+    les autres workers la rechargent à leur prochaine lecture (version changée).
+
+    :return: nombre de sessions mises à jour
+    """
+    cache = shared_keyring()
+    updated = 0
+    for session_id in cache.get(_index_key(user_id)) or []:
+        blob = cache.get(_entry_key(user_id, session_id))
+        if blob is None:
+            continue
+        try:
+            pems, _, expires_at = _open_entry(user_id, session_id, blob)
+        except InvalidTag:
+            continue
+        pems[key_id] = bytes(private_key_pem)
+        if _store_entry(user_id, session_id, pems, key_id, expires_at) is not None:
+            keyring.delete((user_id, session_id))
+            updated += 1
+    return updated
+
+
+def lock_private_key(user_id, session_id):
+    """Retire les clés de la session du trousseau partagé (déconnexion)."""
+    keyring.delete((user_id, session_id))
+    return shared_keyring().delete(_entry_key(user_id, session_id))
+
+
+def session_id_from_request(request):
+    """Lit l'identifiant de session dans le token JWT validé de la requête."""
+    token = getattr(request, 'auth', None)
+    if token is None:
+        return None
+    try:
+        return token.get(SESSION_CLAIM)
+    except AttributeError:
+        return None
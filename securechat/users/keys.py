@@ -0,0 +1,178 @@
+"""
+Clés des utilisateurs (table ``UserKey``) : création, rotation et sélection
+de la clé active.
+
+La ligne ``CustomUser`` ne porte plus de matériel de clé : l'authentification
+et les jointures sur l'expéditeur restent légères, et une rotation n'écrit
+qu'ici.
+"""
+import hashlib
+import logging
+from base64 import b64decode
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from crypto.utils import open_envelope, seal_envelope, unwrap_aes_key, wrap_aes_key
+from .keyring import add_unlocked_key
+from .models import CustomUser, UserKey
+
+logger = logging.getLogger(__name__)
+
+
+def key_fingerprint(public_der: bytes) -> str:
+    """Identifiant d'une clé : empreinte SHA-256 de sa forme DER."""
+    return hashlib.sha256(public_der).hexdigest()
+
+
+def build_user_key(user, algorithm, public_pem, private_key_encrypted):
+    """
+    ``UserKey`` non sauvegardée (pour ``bulk_create``).
+
+    :param public_pem: clé publique PEM (bytes ou str), stockée en DER
+    :param private_key_encrypted: sortie base64 de ``encrypt_private_key``, stockée décodée
+    """
+    if isinstance(public_pem, str):
+        public_pem = public_pem.encode()
+    public_der = serialization.load_pem_public_key(public_pem).public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return UserKey(
+        user=user,
+        key_id=key_fingerprint(public_der),
+        algorithm=algorithm,
+        public_key=public_der,
+        private_key_encrypted=b64decode(private_key_encrypted),
+    )
+
+
+def create_user_key(user, algorithm, public_pem, private_key_encrypted):
+    """
+    Enregistre une nouvelle clé active ; l'éventuelle clé précédente est
+    désactivée (``rotated_at``) dans la même transaction.
+
+    Les messages déjà enveloppés pour l'ancienne clé ne sont pas réécrits :
+    ils portent son ``key_id`` et toutes les clés de l'utilisateur sont
+    déverrouillées à la connexion (cf. users.keyring).
+    """
+    key = build_user_key(user, algorithm, public_pem, private_key_encrypted)
+    with transaction.atomic():
+        UserKey.objects.filter(user=user, is_active=True).update(is_active=False, rotated_at=timezone.now())
+        key.save()
+    user.active_key = key
+    return key
+
+
+def seal_retired_key(active_public_key, private_pem):
+    """
+    Scelle la clé privée d'une clé retirée pour la clé active : clé AES
+    enveloppée pour elle (comme un message) et PEM chiffré sous cette clé.
+
+    :return: (sealed_key, sealed_private_key)
+    """
+    aes_key = AESGCM.generate_key(bit_length=256)
+    return wrap_aes_key(active_public_key, aes_key), seal_envelope(aes_key, bytes(private_pem), compress=False)
+
+
+def open_retired_key(active_private_key, sealed_key, sealed_private_key):
+    """:raises InvalidTag, InvalidUnwrap, ValueError: scellée pour une autre clé ou altérée"""
+    return open_envelope(unwrap_aes_key(active_private_key, sealed_key), bytes(sealed_private_key))
+
+
+def unlock_user_keys(user, password):
+    """
+    Déchiffre les clés privées de ``user`` : la clé active sous son mot de
+    passe (un seul PBKDF2), les clés retirées avec la clé active quand elles
+    sont scellées pour elle (cf. ``rotate_user_key``), sous le mot de passe
+    sinon (rotation antérieure au scellement). Une clé retirée illisible est
+    ignorée : seuls ses anciens messages restent illisibles.
+
+    :return: (``{key_id: PEM}``, key_id de la clé active)
+    :raises LookupError: pas de clé active
+    :raises ValueError: clé active indéchiffrable (mot de passe incorrect)
+    :raises CryptoServiceUnavailable: pool crypto saturé
+    """
+    from .utils import CryptoServiceUnavailable, crypto_pool, decrypt_private_key
+
+    rows = list(
+        UserKey.objects.filter(user=user)
+        .order_by('-is_active', '-created_at')
+        .values_list('key_id', 'is_active', 'private_key_encrypted', 'sealed_for', 'sealed_key', 'sealed_private_key')
+    )
+    if not rows or not rows[0][1]:
+        raise LookupError('No active key for this user')
+
+    active_key_id = rows[0][0]
+    try:
+        private_keys = {active_key_id: crypto_pool.run(decrypt_private_key, bytes(rows[0][2]), password)}
+    except CryptoServiceUnavailable:
+        raise
+    except Exception as e:
+        raise ValueError(f'Unable to decrypt private key: {e}')
+
+    active_private_key = None
+    for key_id, _, private_key_encrypted, sealed_for, sealed_key, sealed_private_key in rows[1:]:
+        try:
+            if sealed_for == active_key_id:
+                if active_private_key is None:
+                    active_private_key = serialization.load_pem_private_key(private_keys[active_key_id], password=None)
+                private_keys[key_id] = open_retired_key(active_private_key, sealed_key, sealed_private_key)
+            else:
+                private_keys[key_id] = crypto_pool.run(decrypt_private_key, bytes(private_key_encrypted), password)
+        except CryptoServiceUnavailable:
+            raise
+        except Exception:
+            logger.warning('Unable to decrypt retired key %s of user %s', key_id[:16], user.pk)
+    return private_keys, active_key_id
+
+
+def rotate_user_key(user, password, algorithm=None):
+    """
+    Génère une nouvelle paire pour ``user``, chiffrée sous son mot de passe,
+    et la rend active. Les clés précédentes sont rescellées pour la nouvelle
+    (cf. ``unlock_user_keys``). Les sessions déjà déverrouillées reçoivent
+    la nouvelle clé privée ; l'ancienne reste dans leur trousseau et en base.
+
+    :param algorithm: défaut : celui de la clé active
+    :raises ValueError: mot de passe incorrect
+    """
+    from .keypool import take_key_pair
+    from .utils import crypto_pool, encrypt_private_key, generate_x25519_key_pair
+
+    if not user.check_password(password):
+        raise ValueError('Invalid password')
+    previous_keys, _ = unlock_user_keys(user, password)
+    if algorithm is None:
+        current = user.keys.filter(is_active=True).values_list('algorithm', flat=True).first()
+        algorithm = current or CustomUser.KEY_TYPE_RSA
+
+    if algorithm == CustomUser.KEY_TYPE_X25519:
+        private_pem, public_pem = generate_x25519_key_pair()
+    else:
+        private_pem, public_pem = take_key_pair()
+    private_key_encrypted = crypto_pool.run(encrypt_private_key, private_pem, password)
+    public_key = serialization.load_pem_public_key(public_pem)
+
+    with transaction.atomic():
+        key = create_user_key(user, algorithm, public_pem, private_key_encrypted)
+        for key_id, previous_pem in previous_keys.items():
+            sealed_key, sealed_private_key = seal_retired_key(public_key, previous_pem)
+            UserKey.objects.filter(user=user, key_id=key_id).update(
+                sealed_for=key.key_id, sealed_key=sealed_key, sealed_private_key=sealed_private_key,
+            )
+    transaction.on_commit(lambda: add_unlocked_key(user.pk, key.key_id, private_pem))
+    return key
+
+
+def with_active_key_id(queryset):
+    """
+    Annote ``active_key_id`` (empreinte de la clé active) sur un queryset
+    d'utilisateurs : la clé publique parsée vient ensuite du cache
+    (cf. crypto.cache), sans autre requête.
+    """
+    active = UserKey.objects.filter(user=OuterRef('pk'), is_active=True).values('key_id')[:1]
+    return queryset.annotate(active_key_id=Subquery(active))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users import keypool
+
+
+class Command(BaseCommand):
+    help = 'Remplit le pool de paires RSA pré-générées utilisé à l\'inscription.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--low', type=int, default=keypool.KEY_POOL_LOW_WATERMARK)
+        parser.add_argument('--high', type=int, default=keypool.KEY_POOL_HIGH_WATERMARK)
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='Reste actif et vérifie le pool toutes les --interval secondes.'
+        )
+        parser.add_argument('--interval', type=float, default=keypool.KEY_POOL_REFILL_INTERVAL)
+
+    def handle(self, *args, **options):
+        while True:
+            added = keypool.refill(low=options['low'], high=options['high'])
+            if added:
+                self.stdout.write(f'{added} key pair(s) added — {keypool.metrics()}')
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_pooledkeypair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='key_type',
+            field=models.CharField(choices=[('rsa', 'RSA-2048 (OAEP)'), ('x25519', 'X25519 (ECDH + HKDF)')], default='rsa', max_length=16),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_customuser_key_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_id', models.CharField(max_length=64, unique=True)),
+                ('algorithm', models.CharField(choices=[('rsa', 'RSA-2048 (OAEP)'), ('x25519', 'X25519 (ECDH + HKDF)')], max_length=16)),
+                ('public_key', models.BinaryField()),
+                ('private_key_encrypted', models.BinaryField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rotated_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='keys', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'is_active'], name='users_key_active_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,104 @@
+import base64
+import hashlib
+
+from cryptography.hazmat.primitives import serialization
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def move_keys(apps, schema_editor):
+    """
+    Recopie les clés de ``CustomUser`` (PEM / base64) dans ``UserKey``
+    (DER / octets bruts), par lots de ``BATCH_SIZE`` utilisateurs (un commit
+    par lot). Les utilisateurs qui ont déjà une clé sont ignorés : la
+    migration peut être relancée après une interruption.
+    """
+    CustomUser = apps.get_model('users', 'CustomUser')
+    UserKey = apps.get_model('users', 'UserKey')
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+
+    while True:
+        batch = list(
+            CustomUser.objects.using(db_alias)
+            .filter(id__gt=last_id, public_key__isnull=False)
+            .exclude(public_key='')
+            .order_by('id')
+            .only('id', 'public_key', 'private_key_encrypted', 'key_type')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        done = set(
+            UserKey.objects.using(db_alias)
+            .filter(user_id__in=[user.id for user in batch]).values_list('user_id', flat=True)
+        )
+        keys = []
+        for user in batch:
+            if user.id in done:
+                continue
+            public_der = serialization.load_pem_public_key(user.public_key.encode()).public_bytes(
+                encoding=serialization.Encoding.DER,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            keys.append(UserKey(
+                user_id=user.id,
+                key_id=hashlib.sha256(public_der).hexdigest(),
+                algorithm=user.key_type,
+                public_key=public_der,
+                private_key_encrypted=base64.b64decode(user.private_key_encrypted or ''),
+                is_active=True,
+            ))
+
+        with transaction.atomic(using=db_alias):
+            UserKey.objects.using(db_alias).bulk_create(keys)
+        last_id = batch[-1].id
+
+
+def restore_keys(apps, schema_editor):
+    # Seule la clé active revient sur CustomUser (l'ancien schéma n'en garde qu'une)
+    CustomUser = apps.get_model('users', 'CustomUser')
+    UserKey = apps.get_model('users', 'UserKey')
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+
+    while True:
+        batch = list(
+            UserKey.objects.using(db_alias)
+            .filter(id__gt=last_id, is_active=True)
+            .order_by('id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        users = []
+        for key in batch:
+            public_pem = serialization.load_der_public_key(bytes(key.public_key)).public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            users.append(CustomUser(
+                id=key.user_id,
+                public_key=public_pem.decode(),
+                private_key_encrypted=base64.b64encode(bytes(key.private_key_encrypted)).decode(),
+                key_type=key.algorithm,
+            ))
+
+        with transaction.atomic(using=db_alias):
+            CustomUser.objects.using(db_alias).bulk_update(users, ['public_key', 'private_key_encrypted', 'key_type'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    # Un commit par lot plutôt qu'une transaction sur toute la table
+    atomic = False
+
+    dependencies = [
+        ('users', '0004_userkey'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_keys, restore_keys),
+    ]
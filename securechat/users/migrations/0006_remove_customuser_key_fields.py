@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_move_user_keys'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='key_type',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='private_key_encrypted',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='public_key',
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+def purge_plaintext_pool(apps, schema_editor):
+    # Paires stockées en clair : on les jette (le pool se remplit de nouveau)
+    PooledKeyPair = apps.get_model('users', 'PooledKeyPair')
+    PooledKeyPair.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_remove_customuser_key_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(purge_plaintext_pool, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='pooledkeypair',
+            name='private_key',
+        ),
+        migrations.AddField(
+            model_name='pooledkeypair',
+            name='private_key_wrapped',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+    ]
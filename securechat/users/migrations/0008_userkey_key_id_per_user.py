@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_pooledkeypair_wrapped'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userkey',
+            name='key_id',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='userkey',
+            constraint=models.UniqueConstraint(fields=('user', 'key_id'), name='users_key_user_key_id_uniq'),
+        ),
+    ]
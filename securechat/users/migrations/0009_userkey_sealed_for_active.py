@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_userkey_key_id_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userkey',
+            name='sealed_for',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='userkey',
+            name='sealed_key',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='userkey',
+            name='sealed_private_key',
+            field=models.BinaryField(null=True),
+        ),
+    ]
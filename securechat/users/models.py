@@ -1,9 +1,70 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils.functional import cached_property
 
 class CustomUser(AbstractUser):
-    public_key = models.TextField(blank=True, null=True)
-    private_key_encrypted = models.TextField(blank=True, null=True)
+    KEY_TYPE_RSA = 'rsa'
+    KEY_TYPE_X25519 = 'x25519'
+    KEY_TYPE_CHOICES = [
+        (KEY_TYPE_RSA, 'RSA-2048 (OAEP)'),
+        (KEY_TYPE_X25519, 'X25519 (ECDH + HKDF)'),
+    ]
+
+    @cached_property
+    def active_key(self):
+        """Clé active (cf. ``UserKey``), sans la clé privée chiffrée ; None si aucune."""
+        return self.keys.filter(is_active=True).defer('private_key_encrypted').first()
 
     def __str__(self):
         return self.username
+
+
+class UserKey(models.Model):
+    """
+    Paire de clés d'un utilisateur, hors de la ligne ``CustomUser``.
+
+    Une seule clé active par utilisateur (c'est elle qui reçoit les nouveaux
+    messages) ; une rotation désactive l'ancienne sans la supprimer
+    (cf. users.keys).
+    """
+    user = models.ForeignKey(CustomUser, related_name='keys', on_delete=models.CASCADE)
+    # Empreinte SHA-256 de la clé publique DER (unique par utilisateur)
+    key_id = models.CharField(max_length=64)
+    algorithm = models.CharField(max_length=16, choices=CustomUser.KEY_TYPE_CHOICES)
+    # SubjectPublicKeyInfo DER
+    public_key = models.BinaryField()
+    # sel + IV + clé privée PKCS#8 chiffrée sous le mot de passe (cf. users.utils.encrypt_private_key)
+    private_key_encrypted = models.BinaryField()
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    rotated_at = models.DateTimeField(blank=True, null=True)
+    # Clé retirée, scellée pour la clé active ``sealed_for`` (cf. users.keys) :
+    # clé AES enveloppée pour elle + clé privée PKCS#8 chiffrée (enveloppe v2).
+    # Le login ne fait qu'un PBKDF2 quel que soit le nombre de rotations.
+    sealed_for = models.CharField(max_length=64, blank=True, null=True)
+    sealed_key = models.BinaryField(null=True)
+    sealed_private_key = models.BinaryField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_active'], name='users_key_active_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key_id'], name='users_key_user_key_id_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key_id[:16]} ({self.algorithm})'
+
+
+class PooledKeyPair(models.Model):
+    """
+    Paire RSA générée à l'avance pour l'inscription (cf. users.keypool).
+
+    Chaque ligne est consommée une seule fois puis supprimée. La clé privée
+    n'est jamais stockée en clair : elle est chiffrée sous une clé serveur
+    (cf. ``users.keypool.seal_private_key``).
+    """
+    public_key = models.TextField()
+    private_key_wrapped = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
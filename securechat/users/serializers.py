@@ -1,36 +1,49 @@
 from rest_framework import serializers
 from .models import CustomUser
 from django.contrib.auth.password_validation import validate_password
-from .utils import generate_rsa_key_pair, encrypt_private_key
+from .utils import encrypt_private_key, generate_x25519_key_pair, crypto_pool
+from .keypool import take_key_pair
+from .keys import create_user_key, rotate_user_key, unlock_user_keys
 
 from django.contrib.auth import authenticate
+from django.db import transaction
 from .models import CustomUser
-from .utils import decrypt_private_key
+from .keyring import SESSION_CLAIM, new_session_id, unlock_private_keys
 from rest_framework_simplejwt.tokens import RefreshToken
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, validators=[validate_password])
+    # Algorithme de la clé active (cf. UserKey)
+    key_type = serializers.ChoiceField(
+        choices=CustomUser.KEY_TYPE_CHOICES, default=CustomUser.KEY_TYPE_RSA, source='active_key.algorithm'
+    )
 
     class Meta:
         model = CustomUser
-        fields = ('username', 'password', 'email')
+        fields = ('username', 'password', 'email', 'key_type')
 
     def create(self, validated_data):
         username = validated_data['username']
         password = validated_data['password']
         email = validated_data.get('email', '')
+        key_type = validated_data.get('active_key', {}).get('algorithm', CustomUser.KEY_TYPE_RSA)
 
-        # Génération de la paire RSA
-        private_key, public_key = generate_rsa_key_pair()
-        private_key_encrypted = encrypt_private_key(private_key, password)
-
-        user = CustomUser.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            public_key=public_key.decode(),
-            private_key_encrypted=private_key_encrypted
-        )
+        if key_type == CustomUser.KEY_TYPE_X25519:
+            # Génération X25519 quasi instantanée : pas besoin du pool
+            private_key, public_key = generate_x25519_key_pair()
+        else:
+            # Paire RSA pré-générée (cf. users.keypool), générée à la volée si le pool est vide
+            private_key, public_key = take_key_pair()
+        # (hors du worker web : pool de processus à file bornée)
+        private_key_encrypted = crypto_pool.run(encrypt_private_key, private_key, password)
+
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(
+                username=username,
+                email=email,
+                password=password,
+            )
+            create_user_key(user, key_type, public_key, private_key_encrypted)
         return user
 
 
@@ -46,17 +59,41 @@ class LoginSerializer(serializers.Serializer):
         if not user:
             raise serializers.ValidationError('Invalid credentials')
 
-        # Déchiffrement de la clé privée RSA
+        # Déchiffrement des clés privées : la clé active (PBKDF2), puis les clés
+        # retirées par rotation, scellées pour elle (les messages plus anciens
+        # sont enveloppés pour elles)
         try:
-            private_key = decrypt_private_key(user.private_key_encrypted, password)
-        except Exception as e:
-            raise serializers.ValidationError('Unable to decrypt private key: ' + str(e))
+            private_keys, active_key_id = unlock_user_keys(user, password)
+        except (LookupError, ValueError) as e:
+            raise serializers.ValidationError(str(e))
+        private_key = private_keys[active_key_id]
 
-        # Génère un token
+        # Génère un token ; le claim de session est recopié dans chaque access token
         refresh = RefreshToken.for_user(user)
+        session_id = new_session_id()
+        refresh[SESSION_CLAIM] = session_id
+
+        # Déverrouille les clés une fois pour toute la session (pas de PBKDF2 ni de parsing PEM ensuite)
+        try:
+            unlock_private_keys(user.pk, session_id, private_keys, active_key_id)
+        except Exception as e:
+            raise serializers.ValidationError('Unable to load private key: ' + str(e))
 
         return {
             'refresh': str(refresh),
             'access': str(refresh.access_token),
             'private_key': private_key.decode()  # optionnel, à sécuriser selon l’usage
         }
+
+
+class RotateKeySerializer(serializers.Serializer):
+    password = serializers.CharField(write_only=True)
+    key_type = serializers.ChoiceField(choices=CustomUser.KEY_TYPE_CHOICES, required=False)
+
+    def save(self):
+        user = self.context['request'].user
+        try:
+            key = rotate_user_key(user, self.validated_data['password'], self.validated_data.get('key_type'))
+        except (LookupError, ValueError) as e:
+            raise serializers.ValidationError(str(e))
+        return key
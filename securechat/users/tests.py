@@ -1,3 +1,462 @@
-from django.test import TestCase
+import time
+from base64 import b64encode
+from unittest import mock
 
-# Create your tests here.
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import serialization
+from django.core import checks
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat import inbox_cache
+from chat.models import EncryptedMessage
+from crypto.profiling import metrics
+from . import keyring
+from .keypool import open_private_key, refill, seal_private_key, take_key_pair
+from .authentication import (
+    AUTH_PRINCIPAL_CACHE_TTL, CachedJWTAuthentication, _principal_key, get_principal_cache, invalidate_principal,
+)
+from .checks import check_keyring_cache, check_principal_cache
+from .keyring import (
+    _entry_key, _open_entry, add_unlocked_key, get_unlocked_keys, lock_private_key, shared_keyring,
+    unlock_private_keys,
+)
+from .keys import rotate_user_key, unlock_user_keys
+from .models import CustomUser, PooledKeyPair, UserKey
+from . import utils
+from .utils import CryptoServiceUnavailable, CryptoWorkerPool, generate_x25519_key_pair
+
+
+def public_bytes(private_key):
+    return private_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+class KeyringTests(SimpleTestCase):
+    user_id = 42
+
+    def setUp(self):
+        self.clear()
+        self.addCleanup(self.clear)
+        self.private_pem, _ = generate_x25519_key_pair()
+
+    def clear(self):
+        shared_keyring().clear()
+        keyring.keyring.clear()
+
+    def unlock(self, session_id='s1', key_id='k1', private_pem=None):
+        return unlock_private_keys(self.user_id, session_id, {key_id: private_pem or self.private_pem}, key_id)
+
+    def blob(self, session_id='s1'):
+        return shared_keyring().get(_entry_key(self.user_id, session_id))
+
+    def test_unlock_and_get(self):
+        unlocked = self.unlock()
+        self.assertEqual(unlocked.active_key_id, 'k1')
+        # Même processus : les clés déjà parsées sont réutilisées
+        self.assertIs(get_unlocked_keys(self.user_id, 's1'), unlocked)
+
+    def test_unknown_session(self):
+        self.unlock()
+        self.assertIsNone(get_unlocked_keys(self.user_id, 's2'))
+        self.assertIsNone(get_unlocked_keys(self.user_id, None))
+
+    def test_shared_entry_is_encrypted(self):
+        self.unlock()
+        blob = bytes(self.blob())
+        self.assertNotIn(b'PRIVATE KEY', blob)
+        self.assertNotIn(self.private_pem.split(b'\n')[1], blob)
+
+    def test_bytearray_pem_is_wiped(self):
+        pem = bytearray(self.private_pem)
+        self.unlock(private_pem=pem)
+        self.assertEqual(pem, bytes(len(pem)))
+
+    def test_other_worker_reloads_from_shared_cache(self):
+        expected = public_bytes(self.unlock().active)
+        # Autre worker : cache local vide, seule l'entrée partagée existe
+        keyring.keyring.clear()
+        reloaded = get_unlocked_keys(self.user_id, 's1')
+        self.assertEqual(public_bytes(reloaded.active), expected)
+        self.assertIs(get_unlocked_keys(self.user_id, 's1'), reloaded)
+
+    def test_entry_is_bound_to_its_session(self):
+        self.unlock()
+        shared_keyring().set(_entry_key(self.user_id, 's2'), self.blob())
+        shared_keyring().set(_entry_key(self.user_id + 1, 's1'), self.blob())
+        self.assertIsNone(get_unlocked_keys(self.user_id, 's2'))
+        self.assertIsNone(get_unlocked_keys(self.user_id + 1, 's1'))
+
+    def test_tampered_entry(self):
+        self.unlock()
+        blob = bytearray(self.blob())
+        blob[-1] ^= 1
+        shared_keyring().set(_entry_key(self.user_id, 's1'), bytes(blob))
+        keyring.keyring.clear()
+        self.assertIsNone(get_unlocked_keys(self.user_id, 's1'))
+
+    def test_wrap_key_changed(self):
+        self.unlock()
+        keyring.keyring.clear()
+        with mock.patch('users.keyring.PRIVATE_KEY_KEYRING_WRAP_KEY', b64encode(bytes(32)).decode()):
+            self.assertIsNone(get_unlocked_keys(self.user_id, 's1'))
+
+    def test_lock(self):
+        unlocked = self.unlock()
+        self.assertTrue(lock_private_key(self.user_id, 's1'))
+        self.assertIsNone(self.blob())
+        self.assertIsNone(get_unlocked_keys(self.user_id, 's1'))
+        self.assertEqual(unlocked.keys, {})
+
+    def test_lock_on_another_worker(self):
+        unlocked = self.unlock()
+        # Déconnexion servie ailleurs : seule l'entrée partagée disparaît
+        shared_keyring().delete(_entry_key(self.user_id, 's1'))
+        self.assertIsNone(get_unlocked_keys(self.user_id, 's1'))
+        self.assertEqual(unlocked.keys, {})
+        self.assertNotIn((self.user_id, 's1'), dict(keyring.keyring.items()))
+
+    def test_add_unlocked_key(self):
+        self.unlock('s1')
+        self.unlock('s2')
+        _, _, expires_at = _open_entry(self.user_id, 's1', self.blob('s1'))
+        new_pem, _ = generate_x25519_key_pair()
+
+        self.assertEqual(add_unlocked_key(self.user_id, 'k2', new_pem), 2)
+        for session_id in ('s1', 's2'):
+            unlocked = get_unlocked_keys(self.user_id, session_id)
+            self.assertEqual(unlocked.active_key_id, 'k2')
+            self.assertEqual(set(unlocked.keys), {'k1', 'k2'})
+        # Rechiffrée sans prolonger la durée de la session
+        self.assertEqual(_open_entry(self.user_id, 's1', self.blob('s1'))[2], expires_at)
+
+    def test_add_unlocked_key_skips_locked_sessions(self):
+        self.unlock('s1')
+        self.unlock('s2')
+        lock_private_key(self.user_id, 's1')
+        self.assertEqual(add_unlocked_key(self.user_id, 'k2', generate_x25519_key_pair()[0]), 1)
+        self.assertIsNone(self.blob('s1'))
+
+    def test_expired_entry_is_not_stored(self):
+        with mock.patch('users.keyring.PRIVATE_KEY_KEYRING_TTL', 0):
+            self.assertEqual(self.unlock().active_key_id, 'k1')
+        self.assertIsNone(self.blob())
+        self.assertIsNone(get_unlocked_keys(self.user_id, 's1'))
+
+    def test_expiry_is_kept_across_workers(self):
+        self.unlock()
+        _, _, expires_at = _open_entry(self.user_id, 's1', self.blob())
+        self.assertAlmostEqual(expires_at, time.time() + keyring.PRIVATE_KEY_KEYRING_TTL, delta=5)
+
+
+class KeyPoolTests(TestCase):
+    def setUp(self):
+        self.private_pem, self.public_pem = generate_x25519_key_pair()
+
+    def test_seal_round_trip(self):
+        wrapped = seal_private_key(self.private_pem, self.public_pem)
+        self.assertNotIn(self.private_pem.split(b'\n')[1], wrapped)
+        self.assertEqual(open_private_key(wrapped, self.public_pem), self.private_pem)
+
+    def test_sealed_key_is_bound_to_its_public_key(self):
+        wrapped = seal_private_key(self.private_pem, self.public_pem)
+        with self.assertRaises(InvalidTag):
+            open_private_key(wrapped, generate_x25519_key_pair()[1])
+
+    def test_wrap_key_changed(self):
+        wrapped = seal_private_key(self.private_pem, self.public_pem)
+        with mock.patch('users.keypool.KEY_POOL_WRAP_KEY', b64encode(bytes(32)).decode()):
+            with self.assertRaises(InvalidTag):
+                open_private_key(wrapped, self.public_pem)
+
+    def test_refill_and_take(self):
+        self.assertEqual(refill(low=2, high=3, generate=generate_x25519_key_pair), 3)
+        self.assertEqual(refill(low=2, high=3, generate=generate_x25519_key_pair), 0)
+        first = PooledKeyPair.objects.order_by('id').first()
+        private_pem, public_pem = take_key_pair()
+        self.assertEqual(public_pem, first.public_key.encode())
+        self.assertEqual(open_private_key(first.private_key_wrapped, public_pem), private_pem)
+        self.assertEqual(PooledKeyPair.objects.count(), 2)
+
+    def test_unreadable_pair_is_discarded(self):
+        PooledKeyPair.objects.create(public_key=self.public_pem.decode(), private_key_wrapped=b'\0' * 64)
+        refill(low=2, high=2, generate=generate_x25519_key_pair)
+        self.assertEqual(PooledKeyPair.objects.count(), 2)
+        _, public_pem = take_key_pair()
+        self.assertNotEqual(public_pem, self.public_pem)
+        self.assertEqual(PooledKeyPair.objects.count(), 0)
+
+    @mock.patch('users.keypool.crypto_pool')
+    def test_empty_pool_falls_back(self, crypto_pool):
+        crypto_pool.run.return_value = (self.private_pem, self.public_pem)
+        self.assertEqual(take_key_pair(), (self.private_pem, self.public_pem))
+        crypto_pool.run.assert_called_once()
+
+
+class CryptoWorkerPoolTests(SimpleTestCase):
+    def pool(self, **kwargs):
+        pool = CryptoWorkerPool(**kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_in_process(self):
+        pool = self.pool(max_workers=0)
+        self.assertIsNone(pool.max_pending)
+        # Aucune file : les appels ne sont jamais refusés
+        self.assertEqual([pool.run(abs, -i) for i in range(10)], list(range(10)))
+        self.assertEqual(pool.metrics()['completed'], 10)
+        self.assertEqual(pool.metrics()['queue_depth'], 0)
+
+    def test_in_process_with_explicit_limit(self):
+        pool = self.pool(max_workers=0, max_pending=2)
+        self.assertEqual(pool.run(abs, -1), 1)
+        self.assertEqual(pool.metrics()['queue_limit'], 2)
+
+    def test_in_process_failure(self):
+        pool = self.pool(max_workers=0)
+        with self.assertRaises(ValueError):
+            pool.run(int, 'x')
+        self.assertEqual((pool.metrics()['failed'], pool.metrics()['queue_depth']), (1, 0))
+
+    def test_pooled(self):
+        pool = self.pool(max_workers=1)
+        self.assertEqual(pool.max_pending, 4)
+        self.assertEqual(pool.run(abs, -1), 1)
+        with self.assertRaises(ValueError):
+            pool.run(int, 'x')
+        values = pool.metrics()
+        self.assertEqual((values['completed'], values['failed'], values['queue_depth']), (1, 1, 0))
+
+    def test_timeout_keeps_the_slot_until_the_task_ends(self):
+        pool = self.pool(max_workers=1, max_pending=1, timeout=0.05, retry_after=3)
+        with self.assertRaises(CryptoServiceUnavailable) as cm:
+            pool.run(time.sleep, 0.5)
+        self.assertEqual(cm.exception.wait, 3)
+        # Le worker est encore occupé : la file est pleine
+        with self.assertRaises(CryptoServiceUnavailable):
+            pool.run(abs, -1)
+        values = pool.metrics()
+        self.assertEqual((values['timed_out'], values['rejected']), (1, 1))
+
+        deadline = time.monotonic() + 5
+        while pool.metrics()['queue_depth'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.run(abs, -1), 1)
+
+    def test_prometheus_export(self):
+        with mock.patch('users.utils.crypto_pool', self.pool(max_workers=0)) as pool:
+            pool.run(abs, -1)
+            text = metrics.render()
+        self.assertIn('securechat_crypto_pool_queue_depth 0\n', text)
+        self.assertIn('securechat_crypto_pool_completed_total 1\n', text)
+        self.assertIn('# TYPE securechat_crypto_pool_latency_seconds_total counter\n', text)
+        # File non bornée : pas de limite exportée
+        self.assertNotIn('securechat_crypto_pool_queue_limit', text)
+
+
+class PrincipalCacheTests(TestCase):
+    def setUp(self):
+        get_principal_cache().clear()
+        self.addCleanup(get_principal_cache().clear)
+        self.user = CustomUser.objects.create_user(username='alice', email='alice@example.com')
+        self.token = AccessToken.for_user(self.user)
+        self.auth = CachedJWTAuthentication()
+
+    def cached(self):
+        return get_principal_cache().get(_principal_key(self.user.pk))
+
+    def test_cache_hit(self):
+        with self.assertNumQueries(1):
+            self.auth.get_user(self.token)
+        with self.assertNumQueries(0):
+            user = self.auth.get_user(self.token)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, 'alice', True))
+        # Champs différés : lus à la demande
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'alice@example.com')
+
+    def test_ttl_is_short(self):
+        # Indépendante de la durée de vie du token
+        self.assertEqual(AUTH_PRINCIPAL_CACHE_TTL, 30)
+        self.assertLess(AUTH_PRINCIPAL_CACHE_TTL, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+    def test_deactivation_invalidates(self):
+        self.auth.get_user(self.token)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.cached())
+        with self.assertRaisesMessage(AuthenticationFailed, 'User is inactive'):
+            self.auth.get_user(self.token)
+
+    def test_password_change_invalidates(self):
+        self.auth.get_user(self.token)
+        self.user.set_password('nouveau mot de passe')
+        self.user.save()
+        self.assertIsNone(self.cached())
+        with self.assertNumQueries(1):
+            self.auth.get_user(self.token)
+
+    def test_queryset_update_needs_explicit_invalidation(self):
+        self.auth.get_user(self.token)
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertTrue(self.auth.get_user(self.token).is_active)
+        invalidate_principal(self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+    def test_deleted_user(self):
+        self.auth.get_user(self.token)
+        self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User not found'):
+            self.auth.get_user(self.token)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class KeyRotationTests(TestCase):
+    password = 'Correct-horse-42'
+
+    def setUp(self):
+        for cache in (shared_keyring(), inbox_cache.get_cache()):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        keyring.keyring.clear()
+        # PBKDF2 allégé, dans le processus de test : pas de pool de processus à démarrer
+        pool = CryptoWorkerPool(max_workers=0)
+        for patcher in (
+            mock.patch('users.utils.crypto_pool', pool),
+            mock.patch('users.serializers.crypto_pool', pool),
+            mock.patch('users.utils.PRIVATE_KEY_KDF_ITERATIONS', 1000),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.alice = self.register('alice')
+        self.bob = self.register('bob')
+
+    def register(self, username):
+        response = self.client.post(reverse('register'), {
+            'username': username, 'password': self.password, 'key_type': CustomUser.KEY_TYPE_X25519,
+        })
+        self.assertEqual(response.status_code, 201)
+        return CustomUser.objects.get(username=username)
+
+    def login(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': self.password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['access']
+
+    def send(self, text):
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('send_encrypted_message'), {'recipient': self.alice.pk, 'message': text})
+        self.assertEqual(response.status_code, 201)
+        return EncryptedMessage.objects.latest('id')
+
+    def rotate(self, access, password=None):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(reverse('rotate_key'), {'password': password or self.password})
+        finally:
+            self.client.credentials()
+
+    def inbox(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        try:
+            response = self.client.get(reverse('received_encrypted_messages'))
+        finally:
+            self.client.credentials()
+        self.assertEqual(response.status_code, 200)
+        return [row.get('message', row.get('error')) for row in response.json()['results']]
+
+    def test_rotation(self):
+        access = self.login()
+        before = self.send('avant')
+        old_key_id = before.recipient_key_id
+
+        response = self.rotate(access)
+        self.assertEqual(response.status_code, 201)
+        new_key_id = response.json()['key_id']
+        self.assertNotEqual(new_key_id, old_key_id)
+        self.assertEqual(response.json()['key_type'], CustomUser.KEY_TYPE_X25519)
+
+        # Nouveaux envois pour la nouvelle clé
+        after = self.send('après')
+        self.assertEqual(after.recipient_key_id, new_key_id)
+        # Session courante : la nouvelle clé est ajoutée sans nouvelle connexion
+        self.assertEqual(self.inbox(access), ['avant', 'après'])
+        # Nouvelle connexion : anciens et nouveaux messages lisibles
+        self.assertEqual(self.inbox(self.login()), ['avant', 'après'])
+
+    def test_login_runs_one_kdf_whatever_the_rotations(self):
+        self.send('k1')
+        for text in ('k2', 'k3'):
+            rotate_user_key(self.alice, self.password)
+            self.send(text)
+        retired = UserKey.objects.filter(user=self.alice, is_active=False)
+        active_key_id = UserKey.objects.get(user=self.alice, is_active=True).key_id
+        self.assertEqual(set(retired.values_list('sealed_for', flat=True)), {active_key_id})
+
+        with mock.patch('users.utils.decrypt_private_key', wraps=utils.decrypt_private_key) as kdf:
+            access = self.login()
+        self.assertEqual(kdf.call_count, 1)
+        self.assertEqual(self.inbox(access), ['k1', 'k2', 'k3'])
+
+    def test_unsealed_retired_key_falls_back_to_password(self):
+        # Rotation antérieure au scellement : la clé retirée n'a que le chiffrement par mot de passe
+        self.send('ancien')
+        rotate_user_key(self.alice, self.password)
+        UserKey.objects.filter(user=self.alice, is_active=False).update(
+            sealed_for=None, sealed_key=None, sealed_private_key=None
+        )
+        private_keys, active_key_id = unlock_user_keys(self.alice, self.password)
+        self.assertEqual(len(private_keys), 2)
+        self.assertEqual(self.inbox(self.login()), ['ancien'])
+
+    def test_wrong_password(self):
+        response = self.rotate(self.login(), password='wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UserKey.objects.filter(user=self.alice).count(), 1)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.post(reverse('rotate_key'), {'password': self.password}).status_code, 401)
+
+
+class KeyringCheckTests(SimpleTestCase):
+    def caches(self, backend):
+        return override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'keyring': {'BACKEND': backend},
+        })
+
+    def test_shared_backend(self):
+        with self.caches('django.core.cache.backends.redis.RedisCache'):
+            self.assertEqual(check_keyring_cache(None), [])
+
+    def test_process_local_backend(self):
+        with self.caches('django.core.cache.backends.locmem.LocMemCache'):
+            [warning] = check_keyring_cache(None)
+        self.assertIsInstance(warning, checks.Warning)
+        self.assertEqual(warning.id, 'users.W001')
+
+    def test_dummy_backend(self):
+        with self.caches('django.core.cache.backends.dummy.DummyCache'):
+            [error] = check_keyring_cache(None)
+        self.assertIsInstance(error, checks.Error)
+        self.assertEqual(error.id, 'users.E001')
+
+
+class PrincipalCacheCheckTests(SimpleTestCase):
+    def test_process_local_backend(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            [warning] = check_principal_cache(None)
+        self.assertIsInstance(warning, checks.Warning)
+        self.assertEqual(warning.id, 'users.W002')
+
+    def test_shared_backend(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_principal_cache(None), [])
@@ -1,9 +1,13 @@
 from django.urls import path
-from .views import RegisterView
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .views import RegisterView, LoginView, LogoutView, RotateKeyView, CryptoPoolMetricsView, KeyPoolMetricsView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
-    path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('login/', LoginView.as_view(), name='token_obtain_pair'),
+    path('logout/', LogoutView.as_view(), name='logout'),
+    path('keys/rotate/', RotateKeyView.as_view(), name='rotate_key'),
+    path('crypto-pool/metrics/', CryptoPoolMetricsView.as_view(), name='crypto_pool_metrics'),
+    path('key-pool/metrics/', KeyPoolMetricsView.as_view(), name='key_pool_metrics'),
     path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
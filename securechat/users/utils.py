@@ -1,11 +1,21 @@
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, x25519
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 from base64 import b64encode, b64decode
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
 import os
+import threading
+import time
+
+from crypto.profiling import span, timed
 
 # Génération de la paire RSA
+@timed('keygen')
 def generate_rsa_key_pair():
     private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
     public_key = private_key.public_key()
@@ -24,12 +34,34 @@ def generate_rsa_key_pair():
 
     return private_pem, public_pem
 
+# Génération d'une paire X25519 (mêmes formats PEM que la paire RSA)
+@timed('keygen')
+def generate_x25519_key_pair():
+    private_key = x25519.X25519PrivateKey.generate()
+
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()  # chiffré plus tard
+    )
+
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    return private_pem, public_pem
+
+# Itérations PBKDF2 des clés privées : fixées, les clés déjà chiffrées en dépendent
+PRIVATE_KEY_KDF_ITERATIONS = 390000
+
 # Chiffrer la clé privée avec le mot de passe de l’utilisateur
+@timed('kdf')
 def encrypt_private_key(private_key_bytes, password):
     salt = os.urandom(16)
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(), length=32, salt=salt,
-        iterations=390000, backend=default_backend()
+        iterations=PRIVATE_KEY_KDF_ITERATIONS, backend=default_backend()
     )
     key = kdf.derive(password.encode())
 
@@ -45,11 +77,16 @@ def encrypt_private_key(private_key_bytes, password):
 
     return b64encode(salt + iv + encrypted).decode()
 
+@timed('kdf')
 def decrypt_private_key(encrypted_data_b64, password):
     from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
     from cryptography.hazmat.primitives import padding
 
-    encrypted_data = b64decode(encrypted_data_b64)
+    # base64 (sortie de encrypt_private_key) ou octets bruts (UserKey)
+    if isinstance(encrypted_data_b64, str):
+        encrypted_data = b64decode(encrypted_data_b64)
+    else:
+        encrypted_data = bytes(encrypted_data_b64)
     salt = encrypted_data[:16]
     iv = encrypted_data[16:32]
     encrypted_key = encrypted_data[32:]
@@ -57,7 +94,7 @@ def decrypt_private_key(encrypted_data_b64, password):
     # Dérive la même clé AES à partir du mot de passe
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(), length=32, salt=salt,
-        iterations=390000, backend=default_backend()
+        iterations=PRIVATE_KEY_KDF_ITERATIONS, backend=default_backend()
     )
     key = kdf.derive(password.encode())
 
@@ -73,6 +110,7 @@ def decrypt_private_key(encrypted_data_b64, password):
 
 
 
+@timed('asym')
 def decrypt_aes_key(encrypted_aes_key_b64: str, private_key_pem: str) -> bytes:
     """
     Déchiffre une clé AES chiffrée avec RSA-OAEP.
@@ -103,3 +141,150 @@ def decrypt_aes_key(encrypted_aes_key_b64: str, private_key_pem: str) -> bytes:
     )
 
     return decrypted_key  # bytes
+
+
+class CryptoServiceUnavailable(APIException):
+    """File d'attente crypto saturée : 503 + en-tête Retry-After (via ``wait``)."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Crypto service busy, please retry later.'
+    default_code = 'crypto_service_unavailable'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class CryptoWorkerPool:
+    """
+    Exécute les opérations crypto coûteuses (génération RSA, PBKDF2) dans un
+    ``ProcessPoolExecutor`` pour ne pas bloquer les workers WSGI.
+
+    La file est bornée : au-delà de ``max_pending`` tâches en cours ou en
+    attente, ``run`` lève ``CryptoServiceUnavailable`` au lieu d'attendre ;
+    de même si la tâche dépasse ``timeout``.
+    Avec ``max_workers=0`` les appels sont exécutés dans le processus courant,
+    sans limite de file sauf ``max_pending`` explicite (chaque thread appelant
+    fait son propre calcul).
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, retry_after=1, timeout=None):
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        if max_pending is None and self.max_workers:
+            max_pending = self.max_workers * 4
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending is not None else None
+
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def run(self, fn, *args):
+        """
+        Exécute ``fn(*args)`` dans le pool et retourne son résultat.
+
+        :raises CryptoServiceUnavailable: file pleine, ou résultat non obtenu
+            dans ``timeout`` secondes. La place n'est rendue qu'à la fin
+            réelle de la tâche (callback du future) : un worker encore occupé
+            par une tâche abandonnée compte toujours dans la file.
+        """
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise CryptoServiceUnavailable(wait=self.retry_after)
+
+        with self._lock:
+            self.pending += 1
+        start = time.monotonic()
+
+        if self.max_workers == 0:
+            ok = False
+            try:
+                result = fn(*args)
+                ok = True
+                return result
+            finally:
+                self._task_done(start, ok)
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException as e:
+            self._task_done(start, False)
+            if isinstance(e, BrokenProcessPool):
+                self._reset_executor()
+            raise
+        future.add_done_callback(
+            lambda f: self._task_done(start, not f.cancelled() and f.exception() is None)
+        )
+
+        try:
+            # Le span mesuré dans le worker est perdu : on le mesure ici
+            with span(getattr(fn, 'profile_span', 'crypto_pool')):
+                return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise CryptoServiceUnavailable(wait=self.retry_after)
+        except BrokenProcessPool:
+            # Un worker a été tué : on recrée le pool pour les appels suivants
+            self._reset_executor()
+            raise
+
+    def _task_done(self, start, ok):
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.pending -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+        if self._slots is not None:
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self.pending,
+                'queue_limit': self.max_pending,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'latency_avg_ms': (self.latency_total / done * 1000) if done else 0.0,
+                'latency_total_ms': self.latency_total * 1000,
+                'latency_max_ms': self.latency_max * 1000,
+            }
+
+    def shutdown(self):
+        self._reset_executor()
+
+
+crypto_pool = CryptoWorkerPool(
+    max_workers=getattr(settings, 'CRYPTO_POOL_WORKERS', None),
+    max_pending=getattr(settings, 'CRYPTO_POOL_MAX_PENDING', None),
+    retry_after=getattr(settings, 'CRYPTO_POOL_RETRY_AFTER', 1),
+    timeout=getattr(settings, 'CRYPTO_POOL_TIMEOUT', None),
+)
@@ -1,7 +1,58 @@
-from rest_framework import generics
-from .serializers import RegisterSerializer
+from rest_framework import generics, status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .serializers import RegisterSerializer, LoginSerializer, RotateKeySerializer
 from .models import CustomUser
+from .keyring import lock_private_key, session_id_from_request
+from .utils import crypto_pool
+from . import keypool
 
 class RegisterView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = RegisterSerializer
+
+
+class LoginView(APIView):
+    def post(self, request):
+        serializer = LoginSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+
+class LogoutView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Oublie la clé privée déverrouillée pour cette session
+        lock_private_key(request.user.pk, session_id_from_request(request))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RotateKeyView(APIView):
+    """
+    Nouvelle paire de clés active pour l'utilisateur (mot de passe requis).
+    Les anciens messages restent lisibles ; la session courante reçoit la
+    nouvelle clé privée sans nouvelle connexion.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = RotateKeySerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        key = serializer.save()
+        return Response({'key_id': key.key_id, 'key_type': key.algorithm}, status=status.HTTP_201_CREATED)
+
+
+class CryptoPoolMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(crypto_pool.metrics())
+
+
+class KeyPoolMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(keypool.metrics())